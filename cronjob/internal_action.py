@@ -12,8 +12,11 @@ try:
 
   response = requests.request("POST", url, headers=headers, data=payload)
 
-  if (response.status_code == 200):
+  # The job runs in the background, its status can be checked in /jobs/<job_id>
+  if (response.status_code in [200, 202]):
     print(f"[INTERNAL ACTION] Response: {response.text}")
+  elif (response.status_code == 409):
+    print(f"[INTERNAL ACTION] Previous internal action is still running. Response: {response.text}")
   else:
     print(f"[FAILED INTERNAL ACTION] Failed doing internal action. Status code: {response.status_code}. Response: {response.text}")
 
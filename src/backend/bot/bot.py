@@ -530,7 +530,8 @@ class InstagramBot:
         api_url = f"{llm_module_url}/chat"
         data = {
             "chat_message": combined_message,
-            "sender_id": username
+            "sender_id": username,
+            "user_id": self.user_obj.id
             }
 
         response = requests.post(api_url, json=data)
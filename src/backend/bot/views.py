@@ -382,7 +382,7 @@ def bot_configuration(request):
             while(attempt <= max_attempt and not is_success):
               llm_module_url = os.getenv("LLM_MODULE_URL")
               api_url = f"{llm_module_url}/config"
-              response = requests.post(api_url)
+              response = requests.post(api_url, json={"user_id": user.id})
               # Break if already success
               if (response.status_code == 200):
                 is_success = True
@@ -527,7 +527,7 @@ def user_persona(request):
         while(attempt <= max_attempt and not is_success):
             llm_module_url = os.getenv("LLM_MODULE_URL")
             api_url = f"{llm_module_url}/persona"
-            response = requests.post(api_url)
+            response = requests.post(api_url, json={"user_id": user.id})
             # Break if already success
             if (response.status_code == 200):
                 is_success = True
@@ -1,10 +1,32 @@
 import random
 import json
-import time
-
+import asyncio
+import concurrent.futures
+import contextlib
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Optional, Tuple
+
+from agent.classifier import ChatCategoryClassifier
+from agent.embedding import EmbeddingCache
+from agent.ingestion import (IngestionPipeline,
+                             convert_hotel,
+                             convert_post,
+                             convert_association_rule,
+                             convert_tourist_attraction)
+from agent.job import JobRunner
+from agent.labelling import CommunityLabeller
 from agent.memory import Memory
 from agent.model import Model
 from agent.persona import Persona
+from agent.response_cache import ResponseCache
+from agent.router import ProvinceRouter
+from agent.target import TargetSelector
+from connector.keyword import KeywordIndex, HybridRetriever
+from connector.local import LocalConnector
 from connector.pinecone import PineconeConnector
 from connector.mongo import MongoConnector
 from connector.postgres import PostgresConnector
@@ -13,14 +35,31 @@ from gateway.input import InputGateway
 from gateway.output import OutputGateway
 from generator.prompt import PromptGenerator
 from generator.action import ActionGenerator
-from utils.function import (hotel_data_to_string_list, 
-                            attraction_data_to_string_list, 
-                            text_to_document, parse_documents, 
+from utils.function import (text_to_document, parse_documents, 
                             clean_quotation_string, 
                             sanitize_text_to_list, 
                             adjust_scheduled_time)
 
 
+class AgentContext():
+  """
+  Per-user state of the agent: persona, model configuration and clients, memory, and tool caches
+  """
+
+  def __init__(self, agent_component: object, user_id: str, embedding_cache: EmbeddingCache):
+    """
+    Instantiate the per-user components
+    """
+    self.user_id = user_id
+    # Requests and jobs running on the context, it is not evicted while they run
+    self.in_flight = 0
+    self.persona_component = Persona()
+    self.memory_component = Memory(agent_component)
+    self.model_component = Model(self.persona_component, embedding_cache, agent_component.keyword_index_component)
+    self.evaluator_component = Evaluator(self.model_component, self.persona_component)
+    self.prompt_generator_component = PromptGenerator(self.persona_component)
+
+
 class Agent():
   """
   General class that encapsulate all the components
@@ -28,91 +67,289 @@ class Agent():
 
   _search_top_k = 30
   _search_threshold = 0.35
+
+  # Evaluation mode used by each action, see Evaluator.EVALUATION_MODES
+  # High-volume actions use a single combined evaluator call
+  _evaluation_modes = {
+    "reply_chat": "separate",
+    "generate_caption": "separate",
+    "comment": "combined",
+  }
+
+  # Semantic response cache for action reply chat is opt-in
+  _use_response_cache = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() == "true"
+
+  # Max user contexts held in the pool, the least recently used one is evicted
+  _max_pool_size = int(os.getenv("AGENT_POOL_SIZE", 8))
+  # Vector store backend: "pinecone" or "local"
+  _vector_store_backend = os.getenv("VECTOR_STORE_BACKEND", "pinecone").lower()
+
+  # RAG tools of the tourism namespaces: namespace -> (tool name, tool description)
+  # Only the namespaces routed by the province router are loaded
+  _tourism_tools = {
+    "hotels_ntt": ("rag_tools_for_ntt_hotels_data", "Used to answer hotels-related query in Nusa Tenggara Timur (NTT) based on retrieved documents"),
+    "hotels_ntb": ("rag_tools_for_ntb_hotels_data", "Used to answer hotels-related query in Nusa Tenggara Barat (NTB) based on retrieved documents"),
+    "association_rules": ("rag_tools_for_association_rules_data", "Used to give hotel recommendations based on its antecedent-consequent relation based on retrieved documents"),
+    "tourist_attractions_ntt": ("rag_tools_for_ntt_tourist_attractions_data", "Used to answer destination or tourist-attractions-related query in Nusa Tenggara Timur (NTT) based on retrieved documents"),
+    "tourist_attractions_ntb": ("rag_tools_for_ntb_tourist_attractions_data", "Used to answer destination or tourist-attractions-related query in Nusa Tenggara Barat (NTB) based on retrieved documents"),
+  }
   
   def __init__(self):
-    self.user_id = None
-    # Instantiate Agent Component
-    self.persona_component = Persona()
-    self.memory_component = Memory(self)
-    self.model_component = Model(self.persona_component)
+    # Pool of user contexts, the context of the current request is held in context variable
+    self._contexts: OrderedDict = OrderedDict()
+    self._current_context: ContextVar = ContextVar("agent_context", default=None)
+    # Contexts used by the current request scope, see request_scope
+    self._scope_contexts: ContextVar = ContextVar("agent_scope_contexts", default=None)
+    # Contexts being constructed, keyed by user_id, so concurrent first requests of a user share one construction
+    self._pending_contexts: dict = {}
+    self._contexts_lock = threading.Lock()
+    self._default_user_id = None
+    # Instantiate Agent Component shared by all users
+    self.embedding_cache_component = EmbeddingCache(db_path=os.getenv("EMBEDDING_CACHE_PATH"))
+    self.response_cache_component = ResponseCache()
+    self.job_runner_component = JobRunner()
     print("[AGENT INITIALIZED] Agent component(s) initialized")
     # Instantiate Connector
     self.mongo_connector_component = MongoConnector() 
     self.postgres_connector_component = PostgresConnector()
-    self.pinecone_connector_component = PineconeConnector(self.model_component)
+    # Vector store backend, the local one has the same interface as Pinecone
+    if (self._vector_store_backend == "local"):
+      self.pinecone_connector_component = LocalConnector(self)
+    else:
+      self.pinecone_connector_component = PineconeConnector(self)
+    # Keyword index of hotels and tourist attractions, for hybrid retrieval
+    self.keyword_index_component = KeywordIndex()
     print("[AGENT INITIALIZED] Connector component(s) initialized")
-    # Instantiate Evaluator
-    self.evaluator_component = Evaluator(self.model_component, self.persona_component)
-    print("[AGENT INITIALIZED] Evaluator component(s) initialized")
+    # Instantiate target selection index, shared by all users
+    self.target_selector_component = TargetSelector(self.mongo_connector_component)
+    # Instantiate province router of tourism chats, shared by all users
+    self.province_router_component = ProvinceRouter(self.mongo_connector_component)
+    # Instantiate local chat category classifier, shared by all users
+    self.chat_classifier_component = ChatCategoryClassifier(self.mongo_connector_component)
+    # Instantiate Mongo to Pinecone ingestion pipeline
+    self.ingestion_pipeline_component = IngestionPipeline(self)
+    self.community_labeller_component = CommunityLabeller(self)
     # Instantiate Gateway
     self.input_gateway_component = InputGateway(self)
     self.output_gateway_component = OutputGateway(self)
     print("[AGENT INITIALIZED] Gateway component(s) initialized")
     # Instantiate Generator
-    self.prompt_generator_component = PromptGenerator(self.persona_component)
     self.action_generator_component = ActionGenerator()
     print("[AGENT INITIALIZED] Generator component(s) initialized")
 
 
+  ##################################
+  ######## CONTEXT (PER USER) ######
+  ##################################
+
+  def _get_context(self) -> AgentContext:
+    """
+    Return the context of the current request, or the context of the default user
+    """
+    context = self._current_context.get()
+    if (context is None):
+      context = self._contexts.get(self._default_user_id, None)
+    if (context is None):
+      raise Exception("No user has been set. Set the user first")
+    return context
+
+  @property
+  def user_id(self) -> Optional[str]:
+    context = self._current_context.get()
+    if (context is None):
+      context = self._contexts.get(self._default_user_id, None)
+    return context.user_id if context is not None else None
+
+  @property
+  def persona_component(self) -> Persona:
+    return self._get_context().persona_component
+
+  @property
+  def memory_component(self) -> Memory:
+    return self._get_context().memory_component
+
+  @property
+  def model_component(self) -> Model:
+    return self._get_context().model_component
+
+  @property
+  def evaluator_component(self) -> Evaluator:
+    return self._get_context().evaluator_component
+
+  @property
+  def prompt_generator_component(self) -> PromptGenerator:
+    return self._get_context().prompt_generator_component
+
+
+  async def _store_remaining_memory(self) -> None:
+    """
+    Summarize and store all the short-term memory of the current context to vector database
+    """
+    if (self.memory_component.count() > 0):
+      memories = self.memory_component.retrieve_all()
+      for sender_id, memory_data in memories.items():
+
+        # Try inserting memory with maximum of 3 attempts
+        max_attempt = 3
+        attempt = 1
+        success = False
+        while (attempt <= max_attempt and not success):
+          success = await self.summarize_and_store_memory(sender_id, memory_data)
+          attempt += 1
+        if (success):
+          print(f"[STORING REMAINING MEMORY] Storing remaining memory from user_id: {self.user_id} with {sender_id}")
+        else:
+          print(f"[ERROR STORING REMAINING MEMORY] Error storing remaining memory user_id: {self.user_id} with {sender_id} after {max_attempt} attempts. Memory will be lost")
+    # Delete all memory
+    self.memory_component.delete_all()
+
+
+  async def _evict_contexts(self) -> None:
+    """
+    Evict the least recently used contexts until the pool fits, storing their remaining memory first.
+    The default user and the contexts with requests in flight are not evicted, the pool exceeds its size until they are done
+    """
+    while (True):
+      with self._contexts_lock:
+        if (len(self._contexts) <= self._max_pool_size):
+          return
+        user_key, context = next(((user_key, context) for user_key, context in self._contexts.items()
+                                  if user_key != self._default_user_id and context.in_flight == 0), (None, None))
+        if (context is None):
+          return
+        del self._contexts[user_key]
+
+      print(f"[AGENT CONTEXT EVICTED] Evicting context of user_id: {context.user_id}")
+      token = self._current_context.set(context)
+      try:
+        await self._store_remaining_memory()
+      finally:
+        self._current_context.reset(token)
+
+
   #######################
   ######## SETUP ########
   #######################
 
-  async def set_user(self, user_id:str) -> None:
+  async def _construct_context(self, user_id: str) -> AgentContext:
     """
-    Set user_id, as well as model config and persona.
-    This function should be called first thing
+    Construct and setup the context of user_id
     """
+    print(f"[AGENT CONSTRUCTED] Constructing agent for user_id: {user_id}")
+    context = AgentContext(self, user_id, self.embedding_cache_component)
+    token = self._current_context.set(context)
+    try:
+      # Setup components
+      await self.set_config()
+      await self.set_persona()
+    finally:
+      self._current_context.reset(token)
+    return context
+
+
+  def _claim_context(self, context: AgentContext) -> None:
+    """
+    Count the context in flight until the end of the current request_scope, if any.
+    Must be called with the contexts lock held
+    """
+    scope_contexts = self._scope_contexts.get()
+    if (scope_contexts is not None):
+      context.in_flight += 1
+      scope_contexts.append(context)
+
+
+  async def _acquire_context(self, user_id: str) -> AgentContext:
+    """
+    Return the context of user_id from the pool, constructing it if it is not in the pool.
+    Concurrent requests of a user that is not in the pool wait for the same construction.
+    The context is claimed (see _claim_context) in the same step it is taken from the pool, so it is not evicted in between
+    """
+    user_key = str(user_id)
+    while (True):
+      with self._contexts_lock:
+        context = self._contexts.get(user_key, None)
+        if (context is not None):
+          self._contexts.move_to_end(user_key)
+          self._claim_context(context)
+          return context
+        pending_context = self._pending_contexts.get(user_key, None)
+        if (pending_context is None):
+          pending_context = concurrent.futures.Future()
+          self._pending_contexts[user_key] = pending_context
+          break
+      # Constructed by a concurrent request, possibly on another event loop (Flask mode), so the future is thread-safe
+      await asyncio.wrap_future(pending_context)
 
     try:
-      # Check if there is any memory
-      # Insert first the memory before changing user_id
-      if (self.user_id is None or user_id != self.user_id):
-        if (self.user_id and self.memory_component.count() > 0):
-          memories = self.memory_component.retrieve_all()
-          for sender_id, memory_data in memories.items():
-
-            # Try inserting memory with maximum of 3 attempts
-            max_attempt = 3
-            attempt = 1
-            success = False
-            while (attempt <= max_attempt and not success):
-              success = await self.summarize_and_store_memory(sender_id, memory_data)
-              attempt += 1
-            if (success):
-              print(f"[STORING REMAINING MEMORY] Storing remaining memory from previous user_id: {user_id} with {sender_id}")
-            else:
-              print(f"[ERROR STORING REMAINING MEMORY] Error storing remaining memory user_id: {user_id} with {sender_id} after {max_attempt} attempts. Memory will be lost")
-        # Delete all memory
-        self.memory_component.delete_all()
-
-        print(f"[AGENT CONSTRUCTED] Constructing agent for user_id: {user_id}")
-        self.user_id = user_id
-        # Reset model tools
-        self.model_component.refresh_tools("", is_all=True)
-
-        # Setup components
-        self.set_config()
-        self.set_persona()
+      context = await self._construct_context(user_id)
+    except Exception as e:
+      with self._contexts_lock:
+        del self._pending_contexts[user_key]
+      pending_context.set_exception(e)
+      raise e
+    with self._contexts_lock:
+      self._contexts[user_key] = context
+      del self._pending_contexts[user_key]
+      self._claim_context(context)
+    pending_context.set_result(context)
+    return context
+
+
+  @contextlib.asynccontextmanager
+  async def request_scope(self):
+    """
+    Scope of a request or a job: the contexts used in it (see use_user) are not evicted until it ends
+    """
+    token = self._scope_contexts.set([])
+    try:
+      yield
+    finally:
+      contexts = self._scope_contexts.get()
+      self._scope_contexts.reset(token)
+      with self._contexts_lock:
+        for context in contexts:
+          context.in_flight -= 1
+
+
+  async def use_user(self, user_id: str) -> AgentContext:
+    """
+    Use the context of user_id for the current request, constructing it if it is not in the pool.
+    Within a request_scope, the context is not evicted until the scope ends
+    """
+    try:
+      context = await self._acquire_context(user_id)
+      self._current_context.set(context)
+      await self._evict_contexts()
+      return context
     except Exception as e:
       print(f"[ERROR SETTING UP USER] Error in setting up user: {e}")
       raise Exception(e)
 
 
-  def set_persona(self) -> None:
+  async def set_user(self, user_id:str) -> None:
+    """
+    Set user_id as the default user, as well as model config and persona.
+    The default user is used by requests that do not carry user_id.
+    This function should be called first thing
+    """
+    await self.use_user(user_id)
+    self._default_user_id = str(user_id)
+
+
+  async def set_persona(self) -> None:
     """
     Change the agent persona
     """
-    persona_data = self.postgres_connector_component.get_persona_data(self.user_id)
+    persona_data = await self.postgres_connector_component.aget_persona_data(self.user_id)
     self.persona_component.load_persona(persona_data)
     self.model_component.set_model()
 
   
-  def set_config(self) -> None:
+  async def set_config(self) -> None:
     """
     Adjust the performance of the model
     """
-    config_data = self.postgres_connector_component.get_config_data(self.user_id)
+    config_data = await self.postgres_connector_component.aget_config_data(self.user_id)
     self.model_component.config(config_data)
 
 
@@ -120,12 +357,12 @@ class Agent():
   ######## GET ########
   #####################
 
-  def get_user(self) -> dict:
+  async def get_user(self) -> dict:
     """
     Return user identifiers
     """
     try:
-      username = self.postgres_connector_component.get_username(self.user_id)
+      username = await self.postgres_connector_component.aget_username(self.user_id)
       user_data = {
         "user_id": self.user_id,
         "username": username
@@ -154,6 +391,23 @@ class Agent():
       return {}
   
 
+  def get_cache_stats(self) -> dict:
+    """
+    Return statistics of the caches used by the agent
+    """
+    return {
+      "embedding": self.embedding_cache_component.get_stats(),
+      "response": self.response_cache_component.get_stats()
+    }
+
+
+  def get_latency_stats(self) -> dict:
+    """
+    Return latency histogram of the calls to other module
+    """
+    return self.output_gateway_component.get_stats()
+
+
   def get_memory(self) -> dict:
     """
     Return all the memory in memory component
@@ -161,7 +415,7 @@ class Agent():
     return self.memory_component.retrieve_all()
 
 
-  def get_observation_elm(self) -> list:
+  async def get_observation_elm(self) -> list:
     """
     Return social media account observation_elm
     """
@@ -170,7 +424,7 @@ class Agent():
       # statistics = (1,2,1)
       # statistics = (0,0,0) 
 
-      statistics = self.output_gateway_component.request_statistics(self.user_id)
+      statistics = await self.output_gateway_component.request_statistics(self.user_id)
       observations = self.action_generator_component.observe_statistics(statistics)
       return observations
     except Exception as e:
@@ -217,12 +471,17 @@ class Agent():
     """
     Load tools to be inserted to array of tools and later be used by ReAct
     """
+    # Reuse the tool if it has been constructed for this namespace
+    if (self.model_component.load_cached_tool(pinecone_namespace_name, metadata_name, metadata_description, tool_user_id)):
+      print(f"[LOADING TOOLS] Inserting cached tools for RAG: {pinecone_namespace_name}")
+      return
     vector_store, storage_context = self.pinecone_connector_component.get_vector_store(pinecone_namespace_name)
     await self.model_component.load_data(vector_store, 
                                           storage_context, 
                                           metadata_name,
                                           metadata_description,
-                                          tool_user_id)
+                                          tool_user_id,
+                                          namespace=pinecone_namespace_name)
     print(f"[LOADING TOOLS] Inserting tools for RAG: {pinecone_namespace_name}")
 
   
@@ -230,10 +489,80 @@ class Agent():
     """
     Return query engine as retrieval system
     """
+    query_engine = self.model_component.get_cached_query_engine(pinecone_namespace_name, top_k)
+    if (query_engine is not None):
+      return query_engine
     vector_store, storage_context = self.pinecone_connector_component.get_vector_store(pinecone_namespace_name)
-    return self.model_component.construct_retrieval_system(vector_store, storage_context, top_k)
+    return self.model_component.construct_retrieval_system(vector_store, storage_context, top_k, pinecone_namespace_name)
 
   
+  def _get_response_cache_scope(self) -> str:
+    """
+    Return the response cache scope, cached answers are only shared within the same user and persona
+    """
+    persona_hash = hashlib.sha256(self.persona_component.get_persona_str().encode("utf-8")).hexdigest()
+    return f"{self.user_id}:{persona_hash}"
+
+
+  async def _lookup_response_cache(self, chat_message: str, sender_id: str) -> Tuple[Optional[str], Optional[list[float]]]:
+    """
+    Look up answer in the response cache. Returns the cached answer and the message embedding.
+    The cache is bypassed if the sender has short-term memory, since it changes the context of the message.
+    It is also bypassed if the sender has long-term memory, since the answer would be built with the memory tool
+    and must not be served to another sender. No embedding is returned when bypassed, so the answer is not stored either
+    """
+    if (not self._use_response_cache or len(self.memory_component.retrieve(sender_id)) > 0):
+      return None, None
+    try:
+      if (self.pinecone_connector_component.is_namespace_exist(f"chat_bot[{self.user_id}]_sender[{sender_id}]")):
+        return None, None
+      embedding = await self.model_component.embed_model.aget_query_embedding(chat_message)
+      answer = self.response_cache_component.lookup(self._get_response_cache_scope(), embedding)
+      return answer, embedding
+    except Exception as e:
+      print(f"[ERROR RESPONSE CACHE] Error occured while looking up response cache: {e}")
+      return None, None
+
+
+  async def _identify_chat_category(self, chat_message: str, sender_id: str, message_embedding: Optional[list[float]] = None) -> str:
+    """
+    Identify the category of the chat message with the local classifier, the LLM is only used if the classifier is not confident.
+    The classifier only sees the message, so messages with short-term memory (e.g. a follow-up "berapa harganya?") are categorized by the LLM,
+    and are not logged either, as their category depends on the previous messages.
+    Categorizations of the LLM are logged to train the classifier
+    """
+    embedding_model = self.model_component.get_config()["embedding_model_name"]
+    previous_messages = self.memory_component.retrieve(sender_id)
+    try:
+      if (len(previous_messages) == 0):
+        if (message_embedding is None):
+          message_embedding = await self.model_component.embed_model.aget_query_embedding(chat_message)
+        category, margin = await asyncio.to_thread(self.chat_classifier_component.classify, message_embedding, embedding_model)
+        if (category is not None):
+          print(f"[ACTION REPLY CHAT MESSAGE CATEGORY] Message classified locally with category: {category} | With margin: {margin:.3f}")
+          return category
+    except Exception as e:
+      print(f"[ERROR CHAT CLASSIFIER] Error occured while classifying the chat message: {e}")
+      message_embedding = None
+
+    prompt = self.prompt_generator_component.generate_prompt_identify_chat_category(
+      new_message=chat_message, 
+      previous_messages=previous_messages)  
+    print(prompt)
+    categorization, _ = await self.model_component.answer(prompt, is_direct=True)
+    json_categorization = json.loads(categorization)
+    category = json_categorization['category']
+    reason = json_categorization['reason']
+    print(f"[ACTION REPLY CHAT MESSAGE CATEGORY] Message retrieved with category: {category} | With reason: {reason}")
+
+    if (message_embedding is not None and len(previous_messages) == 0):
+      try:
+        await asyncio.to_thread(self.chat_classifier_component.log, chat_message, category, message_embedding, embedding_model)
+      except Exception as e:
+        print(f"[ERROR CHAT CLASSIFIER] Error occured while logging the chat category: {e}")
+    return category
+
+
   def _similarity_search(self, namespace_name: str, prompt: str) -> list:
     """
     Get nodes by doing similarity search on certain namespace using certain prompt
@@ -241,7 +570,9 @@ class Agent():
     try:
       # Load the data
       query_engine = self._construct_retrieval_system(namespace_name, self._search_top_k)
-      # Retrieve data
+      # Retrieve data, the threshold applies to the vector similarity before it is fused with the keyword search
+      if (isinstance(query_engine.retriever, HybridRetriever)):
+        return query_engine.retriever.retrieve_with_threshold(prompt, self._search_threshold)
       nodes = query_engine.retriever.retrieve(prompt)
       selected_nodes = [node for node in nodes if node.score >= self._search_threshold]
       return selected_nodes
@@ -260,17 +591,16 @@ class Agent():
     Operate the action reply chat
     """
 
+    answer = None
     try:
+      # Check the response cache first
+      answer, message_embedding = await self._lookup_response_cache(chat_message, sender_id)
+      if (answer is not None):
+        print(f"[ACTION REPLY CHAT] Answer is retrieved from the response cache")
+        return
+
       # Detect the category first
-      prompt = self.prompt_generator_component.generate_prompt_identify_chat_category(
-        new_message=chat_message, 
-        previous_messages= self.memory_component.retrieve(sender_id))  
-      print(prompt)
-      categorization, _ = await self.model_component.answer(prompt, is_direct=True)
-      json_categorization = json.loads(categorization)
-      category = json_categorization['category']
-      reason = json_categorization['reason']
-      print(f"[ACTION REPLY CHAT MESSAGE CATEGORY] Message retrieved with category: {category} | With reason: {reason}")
+      category = await self._identify_chat_category(chat_message, sender_id, message_embedding)
 
       # Do iteration of action reply chat
       # While the thresholds are not satisfied, do the iteration
@@ -283,28 +613,31 @@ class Agent():
 
         # Filter the based on category
         if (category == "tourism"):
-          # Load the data from pinecone
-          # First hotel data ntb and ntt
-          await self._load_tools_rag("hotels_ntt", "rag_tools_for_ntt_hotels_data", "Used to answer hotels-related query in Nusa Tenggara Timur (NTT) based on retrieved documents", sender_id)
-          await self._load_tools_rag("hotels_ntb", "rag_tools_for_ntb_hotels_data", "Used to answer hotels-related query in Nusa Tenggara Barat (NTB) based on retrieved documents", sender_id)
-          # Then asso-rules
-          await self._load_tools_rag("association_rules", "rag_tools_for_association_rules_data", "Used to give hotel recommendations based on its antecedent-consequent relation based on retrieved documents", sender_id)
-          # Then tourist attractions ntt and ntb
-          await self._load_tools_rag("tourist_attractions_ntt", "rag_tools_for_ntt_tourist_attractions_data", "Used to answer destination or tourist-attractions-related query in Nusa Tenggara Timur (NTT) based on retrieved documents", sender_id)
-          await self._load_tools_rag("tourist_attractions_ntb", "rag_tools_for_ntb_tourist_attractions_data", "Used to answer destination or tourist-attractions-related query in Nusa Tenggara Barat (NTB) based on retrieved documents", sender_id)
-          # Load the long-term memory from pinecone
-          chat_memory_namespace_name = f"chat_bot[{self.user_id}]_sender[{sender_id}]"
-          if (self.pinecone_connector_component.is_namespace_exist(chat_memory_namespace_name)):
-            await self._load_tools_rag(chat_memory_namespace_name, f"rag_tools_for_memory_chat_with_{sender_id}", f"Used to help answering question from {sender_id} based on previous messages", sender_id)
+          # Tools stay loaded until the end of the action, so they are loaded on the first attempt only
+          if (attempt == 0):
+            # Route the message to its province(s) and entity type(s), ambiguous messages fan out to all namespaces
+            route = await asyncio.to_thread(self.province_router_component.route, chat_message, self.memory_component.retrieve(sender_id))
+            print(f"[ACTION REPLY CHAT ROUTE] Provinces: {route['provinces']} | Entity types: {route['entity_types']} | Fan-out: {route['is_fanout']}")
+            # Load the routed data from pinecone
+            for namespace in route['namespaces']:
+              metadata_name, metadata_description = self._tourism_tools[namespace]
+              await self._load_tools_rag(namespace, metadata_name, metadata_description, sender_id)
+            # Load the long-term memory from pinecone
+            chat_memory_namespace_name = f"chat_bot[{self.user_id}]_sender[{sender_id}]"
+            if (self.pinecone_connector_component.is_namespace_exist(chat_memory_namespace_name)):
+              await self._load_tools_rag(chat_memory_namespace_name, f"rag_tools_for_memory_chat_with_{sender_id}", f"Used to help answering question from {sender_id} based on previous messages", sender_id)
 
           # Generate prompt
           prompt = self.prompt_generator_component.generate_prompt_reply_chat(
             new_message=chat_message,
             previous_messages=self.memory_component.retrieve(sender_id),
-            previous_iteration_notes=previous_iteration_notes)  
+            previous_iteration_notes=previous_iteration_notes,
+            is_routed=not route['is_fanout'])  
           # Answer the query
           # Skip if the answer is None
-          answer, rag_contexts = await self.model_component.answer(prompt, tool_user_id=sender_id)
+          # Retries escalate to the ReAct agent, as a failed answer is likely a hard query
+          answer_mode = None if attempt == 0 else "react"
+          answer, rag_contexts = await self.model_component.answer(prompt, tool_user_id=sender_id, mode=answer_mode, query=chat_message)
           print(f"[ACTION REPLY CHAT] Temporary answer: {answer}. ")
 
           if (answer is None):
@@ -324,7 +657,7 @@ class Agent():
               print(f"[ACTION REPLY CHAT CONTEXT #{i+1}]: {context_to_display}")
 
             # Do Evaluation
-            evaluation_result = await self.evaluator_component.evaluate_response(chat_message, answer, rag_contexts, ["faithfulness", "relevancy", "naturalness"])
+            evaluation_result = await self.evaluator_component.evaluate_response(chat_message, answer, rag_contexts, ["faithfulness", "relevancy", "naturalness"], mode=self._evaluation_modes["reply_chat"])
             evaluation_result['your_answer'] = answer
             evaluation_passing = evaluation_result['evaluation_passing']
             print(f"[EVALUATION RESULT] {evaluation_result}")
@@ -341,7 +674,9 @@ class Agent():
             previous_messages=self.memory_component.retrieve(sender_id),
             previous_iteration_notes=previous_iteration_notes)  
           # Answer the query
-          answer, rag_contexts = await self.model_component.answer(prompt, tool_user_id=sender_id)
+          # Retries escalate to the ReAct agent, as a failed answer is likely a hard query
+          answer_mode = None if attempt == 0 else "react"
+          answer, rag_contexts = await self.model_component.answer(prompt, tool_user_id=sender_id, mode=answer_mode, query=chat_message)
           print(f"[ACTION REPLY CHAT] Temporary answer: {answer}. ")
 
           if (answer is None):
@@ -361,7 +696,7 @@ class Agent():
               print(f"[ACTION REPLY CHAT CONTEXT #{i+1}]: {context_to_display}")
 
             # Do Evaluation
-            evaluation_result = await self.evaluator_component.evaluate_response(chat_message, answer, [], ["relevancy", "naturalness"])
+            evaluation_result = await self.evaluator_component.evaluate_response(chat_message, answer, [], ["relevancy", "naturalness"], mode=self._evaluation_modes["reply_chat"])
             evaluation_result['your_answer'] = answer
             evaluation_passing = evaluation_result['evaluation_passing']
             print(f"[EVALUATION RESULT] {evaluation_result}")
@@ -376,7 +711,7 @@ class Agent():
           print(f"[ACTION REPLY CHAT] Temporary answer: {answer}. ")
 
           # Do Evaluation
-          evaluation_result = await self.evaluator_component.evaluate_response(chat_message, answer, [], ["naturalness"])
+          evaluation_result = await self.evaluator_component.evaluate_response(chat_message, answer, [], ["naturalness"], mode=self._evaluation_modes["reply_chat"])
           evaluation_result['your_answer'] = answer
           evaluation_passing = evaluation_result['evaluation_passing']
           print(f"[EVALUATION RESULT] {evaluation_result}")
@@ -391,6 +726,10 @@ class Agent():
                 evaluation_passing = True
               else:
                 raise Exception(f"Model cannot answer this query after {max_attempts} attempts. The evaluations thresholds are not satisfied.")
+
+      # Only cache answer that has actually passed the evaluation
+      if (message_embedding is not None and evaluation_result.get('evaluation_passing', False)):
+        self.response_cache_component.store(self._get_response_cache_scope(), message_embedding, chat_message, answer)
     
     except Exception as e:
       print(f"[ERROR ACTION REPLY CHAT] Error occured while processing action reply chat: {e}")
@@ -443,7 +782,7 @@ class Agent():
                     f"Here are the keywords: {keywords_str}"]  
         
         # Evaluate the answer
-        evaluation_result = await self.evaluator_component.evaluate_response("Create a caption for an Instagram post", caption_message, contexts, ["relevancy", "naturalness"]) 
+        evaluation_result = await self.evaluator_component.evaluate_response("Create a caption for an Instagram post", caption_message, contexts, ["relevancy", "naturalness"], mode=self._evaluation_modes["generate_caption"]) 
         evaluation_result['your_answer'] = caption_message 
         evaluation_passing = evaluation_result['evaluation_passing']
         print(f"[EVALUATION RESULT] {evaluation_result}")
@@ -519,12 +858,46 @@ class Agent():
   ######## INTERNAL TRIGGER ACTION ########
   #########################################
 
+  async def _run_decide_action(self, user_id: str) -> None:
+    """
+    Decide action as a job, with the context of user_id
+    """
+    async with self.request_scope():
+      if (user_id is not None):
+        await self.use_user(user_id)
+      await self.decide_action()
+
+
+  def submit_decide_action(self) -> Tuple[dict, bool]:
+    """
+    Submit decide action of the current user as a background job.
+    Returns the job and False if the decide action of the current user is still running
+    """
+    user_id = self.user_id
+    return self.job_runner_component.submit(f"decide_action:{user_id}", "decide_action", self._run_decide_action, user_id)
+
+
+  def submit_check_schedule(self) -> Tuple[dict, bool]:
+    """
+    Submit check schedule as a background job.
+    Returns the job and False if check schedule is still running
+    """
+    return self.job_runner_component.submit("check_schedule", "check_schedule", self.check_schedule)
+
+
+  def get_job(self, job_id: str) -> Optional[dict]:
+    """
+    Return the status of a background job, None if it is not found
+    """
+    return self.job_runner_component.get_job(job_id)
+
+
   async def check_schedule(self) -> None:
     """
     Check for schedule in database
     """
     try:
-      post_to_schedule = self.postgres_connector_component.get_scheduled_post_data()
+      post_to_schedule = await self.postgres_connector_component.aget_scheduled_post_data()
       print(f"[CHECK SCHEDULE] Got {len(post_to_schedule)} scheduled post to be posted")
       # Handle no scheduled post
       if (len(post_to_schedule) == 0):
@@ -539,14 +912,14 @@ class Agent():
         tourism_object_id = post[4]
         print(f"[DOING POST] Post for post_id {id} of user_id {user_id}")
 
-        success = self.output_gateway_component.request_post(img_url, caption, user_id, tourism_object_id)
+        success = await self.output_gateway_component.request_post(img_url, caption, user_id, tourism_object_id)
         if (success):
-          self.postgres_connector_component.mark_posts_as_posted(id)
+          await self.postgres_connector_component.amark_posts_as_posted(id)
 
         # Give time delay
         sleep_time = random.randint(60, 180)
         print(f"[ACTION TIME SLEEP] Delay for {sleep_time} seconds")
-        time.sleep(sleep_time)
+        await asyncio.sleep(sleep_time)
 
     except Exception as e:
       print(f"[ERROR CHECK SCHEDULE] Error checking scheduled post: {e}")
@@ -560,7 +933,7 @@ class Agent():
     """
 
     try:
-      observations = self.get_observation_elm()
+      observations = await self.get_observation_elm()
       print(f"[ACTION OBSERVATION] Acquired observations: {observations}")
       if (len(observations) == 0):
         raise Exception ("Invalid observation element: empty list")
@@ -584,20 +957,10 @@ class Agent():
           print(f"[CHOOSE COMMUNITY {i+1}] Score: {similarity_score} ID | Label: {community_id} | {community_label}. ")
           community_id_list.append(community_id)
       
-      # Get Communities data from Mongo
-      get_filter_using_id = {"community_id": {"$in": community_id_list}}
-      communities = self.mongo_connector_component.get_data("communities", get_filter_using_id)
 
       # Max 5 times of action decision
       max_iteration = 5
-      actions = []
-      states = []
-      for itr in range(max_iteration):
-        action, state = self.action_generator_component.decide_action(observations, itr)
-        actions.append(action)
-        states.append(state)
-        if (action is None):
-          break
+      actions, states = self.action_generator_component.decide_actions(observations, max_iteration)
       
       print(f"[ACTION DECISION] Decided actions: {actions}")
       for itr in range(len(actions)):
@@ -606,55 +969,36 @@ class Agent():
         print(f"[ACTION] {itr+1}. action \"{action}\" in state \"{state}\"")
 
         if (action == "like"):
-          await self.action_like(communities)
+          await self.action_like(community_id_list)
         elif (action == "follow"):
-          await self.action_follow(communities)
+          await self.action_follow(community_id_list)
         elif (action == "comment"):
-          await self.action_comment(communities)
+          await self.action_comment(community_id_list)
         else:
           return
         
         # Give time delay
         sleep_time = random.randint(60, 180)
         print(f"[ACTION TIME SLEEP] Delay for {sleep_time} seconds")
-        time.sleep(sleep_time)
+        await asyncio.sleep(sleep_time)
 
     except Exception as e:
       print(f"[ERROR IN DECIDING ACTION] {e}")
       raise Exception (e)
 
 
-  async def action_follow(self, communities: list[dict]) -> None:
+  async def action_follow(self, community_ids: list[int]) -> None:
     """
     Operate the action follow
     """
     try:
-      mongo_collection_name = "communities"
-      
-      found = False
-      chosen_influencer = None
-      # Pick certain influencer
-      for community in communities:
-        community_id = community['community_id']
-        # Get influencer
-        influencers = community['influencers']
-        # Traverse the influencer
-        for influencer in influencers:
-          if (not "mark_follow" in influencer):
-            found = True
-            chosen_influencer = influencer
-            break
-          # Case mark_follow list already in post
-          elif (self.user_id not in influencer['mark_follow'] and str(self.user_id) not in influencer['mark_follow']):
-            found = True
-            chosen_influencer = influencer
-            break
-        # Get out of loop if it is found
-        if (found):
-          break
+      # Pick influencer that has not been followed
+      next_target = self.target_selector_component.next_target(self.user_id, "follow", community_ids)
       # Handle if not found
-      if (not found):
+      if (next_target is None):
         raise Exception("No available data to be marked")
+      community_id = next_target['community_id']
+      chosen_influencer = next_target['target']
 
       # Get Influencer
       influencer_id = chosen_influencer['id']
@@ -662,16 +1006,11 @@ class Agent():
       print(f"[CHOSEN INFLUENCER] Influencer {influencer_username} with influencer_id {influencer_id} in community {community_id}")
 
       # Request
-      is_success = self.output_gateway_component.request_follow(influencer_username)
+      is_success = await self.output_gateway_component.request_follow(influencer_username)
       if (is_success):
         # Mark influencer
-        if ('mark_follow' in chosen_influencer and isinstance(chosen_influencer['mark_follow'], list)):
-          chosen_influencer['mark_follow'].append(self.user_id)
-          print(f"[ACTION FOLLOW] Mark array has been created for {self.user_id}")
-        else:
-          chosen_influencer['mark_follow'] = [self.user_id]
-          print(f"[ACTION FOLLOW] {self.user_id} is inserted to mark array")
-        self.mongo_connector_component.update_one_data(mongo_collection_name, {"community_id": community_id}, {"influencers": influencers})
+        self.target_selector_component.mark_done(self.user_id, "follow", community_id, influencer_id)
+        print(f"[ACTION FOLLOW] Engagement has been marked for {self.user_id}")
         print(f"[ACTION FOLLOW] Successfully follow influencer {influencer_username}")
       
     except Exception as e:
@@ -679,53 +1018,29 @@ class Agent():
       raise Exception(e)
 
 
-  async def action_like(self, communities: list[dict]) -> None:
+  async def action_like(self, community_ids: list[int]) -> None:
     """
     Operate the action like
     """
     try:
-      mongo_collection_name = "communities"
-      
-      found = False
-      chosen_post = None
-      # Pick certain post
-      for community in communities:
-        community_id = community['community_id']
-        # Get post
-        posts = community['posts']
-        # Traverse the post
-        for post in posts:
-          if (not "mark_like" in post):
-            found = True
-            chosen_post = post
-            break
-          # Case mark_like list already in post
-          elif (self.user_id not in post['mark_like'] and str(self.user_id) not in post['mark_like']):
-            found = True
-            chosen_post = post
-            break
-        # Get out of loop if it is found
-        if (found):
-          break
+      # Pick post that has not been liked
+      next_target = self.target_selector_component.next_target(self.user_id, "like", community_ids)
       # Handle if not found
-      if (not found):
+      if (next_target is None):
         raise Exception("No available data to be marked")
+      community_id = next_target['community_id']
+      chosen_post = next_target['target']
 
       # Get Influencer
       post_id = chosen_post['id']
       print(f"[CHOSEN POST] Like post with post_id {post_id} in community {community_id}")
 
       # Request
-      is_success = self.output_gateway_component.request_like(post_id)
+      is_success = await self.output_gateway_component.request_like(post_id)
       if (is_success):
         # Mark post
-        if ('mark_like' in chosen_post and isinstance(chosen_post['mark_like'], list)):
-          chosen_post['mark_like'].append(self.user_id)
-          print(f"[ACTION LIKE] Mark array has been created for {self.user_id}")
-        else:
-          chosen_post['mark_like'] = [self.user_id]
-          print(f"[ACTION LIKE] {self.user_id} is inserted to mark array")
-        self.mongo_connector_component.update_one_data(mongo_collection_name, {"community_id": community_id}, {"posts": posts})
+        self.target_selector_component.mark_done(self.user_id, "like", community_id, post_id)
+        print(f"[ACTION LIKE] Engagement has been marked for {self.user_id}")
         print(f"[ACTION LIKE] Successfully like post with post_id {post_id}")
 
     except Exception as e:
@@ -733,37 +1048,21 @@ class Agent():
       raise Exception(e)
 
 
-  async def action_comment(self, communities: list[dict]) -> None:
+  async def action_comment(self, community_ids: list[int]) -> None:
     """
     Operate the action comment
     """
     try:
-      mongo_collection_name = "communities"
-      
-      found = False
-      chosen_post = None
-      # Pick certain post
-      for community in communities:
-        community_id = community['community_id']
-        # Get post
-        posts = community['posts']
-        # Traverse the post
-        for post in posts:
-          if (not "mark_comment" in post):
-            found = True
-            chosen_post = post
-            break
-          # Case marked_comment list already in post
-          elif (self.user_id not in post['mark_comment'] and str(self.user_id) not in post['mark_comment']):
-            found = True
-            chosen_post = post
-            break
-        # Get out of loop if it is found
-        if (found):
-          break
+      # Pick post that has not been commented
+      next_target = self.target_selector_component.next_target(self.user_id, "comment", community_ids)
       # Handle if not found
-      if (not found):
+      if (next_target is None):
         raise Exception("No available data to be marked")
+      community_id = next_target['community_id']
+      # Queue only holds the post id, get the post detail
+      chosen_post = self.mongo_connector_component.get_array_element("communities", {"community_id": community_id}, "posts", {"id": next_target['target']['id']})
+      if (chosen_post is None):
+        raise Exception(f"Post {next_target['target']['id']} is not found in community {community_id}")
 
       # Get Influencer
       post_id = chosen_post['id']
@@ -790,7 +1089,7 @@ class Agent():
 
         # Do Evaluation
         contexts = [f"Caption of the post that you need to comment on: {post_caption}"]
-        evaluation_result = await self.evaluator_component.evaluate_response("Create a comment on this caption", comment_message, contexts, ["relevancy", "naturalness"])  
+        evaluation_result = await self.evaluator_component.evaluate_response("Create a comment on this caption", comment_message, contexts, ["relevancy", "naturalness"], mode=self._evaluation_modes["comment"])  
         evaluation_result['your_answer'] = comment_message
         evaluation_passing = evaluation_result['evaluation_passing']
         print(f"[EVALUATION RESULT] {evaluation_result}")
@@ -804,16 +1103,11 @@ class Agent():
             raise Exception(f"Model cannot answer this query after {max_attempts} attempts. The evaluations thresholds are not satisfied.")
 
       # Request
-      is_success = self.output_gateway_component.request_comment(post_id, comment_message)
+      is_success = await self.output_gateway_component.request_comment(post_id, comment_message)
       if (is_success):
         # Mark post
-        if ('mark_comment' in chosen_post and isinstance(chosen_post['mark_comment'], list)):
-          chosen_post['mark_comment'].append(self.user_id)
-          print(f"[ACTION COMMENT] Mark array has been created for {self.user_id}")
-        else:
-          chosen_post['mark_comment'] = [self.user_id]
-          print(f"[ACTION COMMENT] {self.user_id} is inserted to mark array")
-        self.mongo_connector_component.update_one_data(mongo_collection_name, {"community_id": community_id}, {"posts": posts})
+        self.target_selector_component.mark_done(self.user_id, "comment", community_id, post_id)
+        print(f"[ACTION COMMENT] Engagement has been marked for {self.user_id}")
         print(f"[ACTION COMMENT] Successfully comment post with post_id {post_id}")
         
     except Exception as e:
@@ -830,298 +1124,42 @@ class Agent():
   It is run to convert the data from Document type in Mongo to Vector in Pinecone
   """
 
-  def process_data_hotel(self) -> None:
-    """
-    Process data hotel, "migrate" it from mongodb document to pinecone vector
-    """
-    mongo_collection_name = "hotel-v2"
-    pinecone_namespace_name_ntb = "hotels_ntb"
-    pinecone_namespace_name_ntt = "hotels_ntt"
-
-    # Get hotel data from mongo
-    hotels = self.mongo_connector_component.get_data(mongo_collection_name, {})
-    print(f"[FETCHED] Fetched {len(hotels)} hotels")
-
-    idx = 0
-    n_batch = 20
-    length_per_batch = (len(hotels)//n_batch)+1
-    while (idx < len(hotels)):
-      # Set batch indices
-      hotel_docs_ntt = []
-      hotel_docs_ntb = []
-      upper_idx = min(idx+length_per_batch, len(hotels))
-      curr_batch_hotels = hotels[idx : upper_idx]
-
-      # Iterate data in the current batch list
-      for i, hotel in enumerate(curr_batch_hotels):
-        print(f"[PROCESS DATA] Processing data {i+1} in batch")
-        hotel_string_data, province = hotel_data_to_string_list(hotel)
-
-        if (hotel_string_data and province):
-          documents_list = text_to_document(hotel_string_data)
-          if (province == "ntt"):
-            hotel_docs_ntt.extend(documents_list)
-          else:
-            hotel_docs_ntb.extend(documents_list)
-
-      # Parse hotel data and insert to Pinecone
-      if (len(hotel_docs_ntt) > 0):
-        hotel_data_ntt_parsed = parse_documents(hotel_docs_ntt)
-        self.pinecone_connector_component.store_data(hotel_data_ntt_parsed, pinecone_namespace_name_ntt) 
-        print(f"[BATCH PROGRESS] Processed {len(hotel_docs_ntt)} NTT nodes data")
-      
-      if (len(hotel_docs_ntb) > 0):
-        hotel_data_ntb_parsed = parse_documents(hotel_docs_ntb)
-        self.pinecone_connector_component.store_data(hotel_data_ntb_parsed, pinecone_namespace_name_ntb)         
-        print(f"[BATCH PROGRESS] Processed {len(hotel_docs_ntb)} NTB nodes data")
-      
-      print(f'[BATCH PROGRESS] Successfully inserted data idx {idx} to {upper_idx}')
-      
-      # Increment idx
-      idx += length_per_batch
-
-
-  def process_data_post(self) -> None:
-    """
-    Process data communities, "migrate" it from mongodb document to pinecone vector
-    """
-    mongo_collection_name = "communities"
-    pinecone_namespace_name = "posts"
-
-    # Get data from mongo
-    communities = self.mongo_connector_component.get_data(mongo_collection_name, {})
-    print(f"[FETCHED] Fetched {len(communities)} communities")
-
-    # Insert data as batch
-    idx = 0
-    n_batch = 20
-    length_per_batch = (len(communities)//n_batch)+1
-    while (idx < len(communities)):
-      # Set batch indices
-      batch_post_data = []
-      upper_idx = min(idx+length_per_batch, len(communities))
-      curr_batch_communities = communities[idx : upper_idx]
-
-      # Iterate data in the current batch list
-      for community in curr_batch_communities:
-        community_id = community['community_id']
-        posts = community['posts']
-        # Iterate posts in community
-        for post in posts:
-          post_data = f"""Community ID: {community_id}\n""" \
-                      f"""Post Caption: \"{post['caption']}\"\n""" \
-                      f"""Post Created Time: {post['posted_at']}\n"""\
-                      f"""Comment Ammount: {len(post['comments'])}\n"""
-          batch_post_data.append(post_data)
-
-      # Preprocess
-      batch_post_docs = text_to_document(batch_post_data)
-      batch_post_parsed = parse_documents(batch_post_docs)
-      
-      # Insert data to pinecone
-      self.pinecone_connector_component.store_data(batch_post_parsed, pinecone_namespace_name)        
-      print(f'[BATCH PROGRESS] Successfully inserted data idx {idx} to {upper_idx}')
-
-      # Increment idx
-      idx += length_per_batch
-
-
-  def process_data_association_rule(self) -> None:
+  async def process_data_hotel(self, force: bool = False) -> dict:
     """
-    Process data association rule, "migrate" it from mongodb document to pinecone vector
+    Process data hotel, sync it from mongodb document to pinecone vector
     """
-    mongo_collection_name = "association-rule"
-    pinecone_namespace_name = "association_rules"
+    return await self.ingestion_pipeline_component.run("hotel-v2", convert_hotel, force=force, is_keyword_indexed=True,
+                                                       legacy_namespaces=["hotels_ntt", "hotels_ntb"])
 
-    # Get data from mongo
-    asso_rules = self.mongo_connector_component.get_data(mongo_collection_name, {})
-    print(f"[FETCHED] Fetched {len(asso_rules)} asso_rules")
 
-    asso_rule_string_list = []
-    # Iterate association rules
-    for asso_rule in asso_rules:
-      antecedents = asso_rule['antecedent']
-      consequents = asso_rule['consequent']
+  async def process_data_post(self, force: bool = False) -> dict:
+    """
+    Process data communities, sync it from mongodb document to pinecone vector
+    """
+    projection = {"community_id": 1, "posts.caption": 1, "posts.posted_at": 1, "posts.comments": 1}
+    return await self.ingestion_pipeline_component.run("communities", convert_post, projection, force=force, legacy_namespaces=["posts"])
 
-      antecedents_string = "Antecedents:\n"
-      for i, antecedent in enumerate(antecedents):
-        antecedents_string += f"{i+1}. {antecedent['place']}\n"
 
-      consequents_string = "Consequents:\n"
-      for i, consequent in enumerate(consequents):
-        consequents_string += f"{i+1}. {consequent['place']}\n"
+  async def process_data_association_rule(self, force: bool = False) -> dict:
+    """
+    Process data association rule, sync it from mongodb document to pinecone vector
+    """
+    projection = {"antecedent.place": 1, "consequent.place": 1}
+    return await self.ingestion_pipeline_component.run("association-rule", convert_association_rule, projection, force=force,
+                                                       legacy_namespaces=["association_rules"])
 
-      asso_rule_string =  "Here is an insight of recommendation from data mining process.\n" \
-                          "The data is about association rule of hotels. " \
-                          "Therefore, this data can be used to link as a recommendation system for hotels.\n" \
-                          "The data consist of antecedents and consequents. If user ask or talk about hotels in antecedents, you can recommend the hotels in consequents.\n"                   
-      asso_rule_string += antecedents_string
-      asso_rule_string += consequents_string
 
-      # Append to list
-      asso_rule_string_list.append(asso_rule_string)
-    
-    # Preprocess
-    asso_rule_docs_list = text_to_document(asso_rule_string_list)
-    asso_rule_parsed = parse_documents(asso_rule_docs_list)
-    
-    # Insert data to pinecone
-    self.pinecone_connector_component.store_data(asso_rule_parsed, pinecone_namespace_name)        
-    print(f'[BATCH PROGRESS] Successfully inserted data')
-
-
-  def process_data_tourist_attraction(self) -> None:
-    """
-    Process data tourism places, "migrate" it from mongodb document to pinecone vector
-    """
-    mongo_collection_name = "objek-wisata-v2"
-    pinecone_namespace_name_ntb = "tourist_attractions_ntb"
-    pinecone_namespace_name_ntt = "tourist_attractions_ntt"
-
-    # Get attraction data from mongo
-    attractions = self.mongo_connector_component.get_data(mongo_collection_name, {})
-    print(f"[FETCHED] Fetched {len(attractions)} attractions")
-
-    idx = 0
-    n_batch = 50
-    length_per_batch = (len(attractions)//n_batch)+1
-    while (idx < len(attractions)):
-      # Set batch indices
-      attraction_docs_ntb = []
-      attraction_docs_ntt = []
-      upper_idx = min(idx+length_per_batch, len(attractions))
-      curr_batch_attractions = attractions[idx : upper_idx]
-
-      # Iterate data in the current batch list
-      for attraction in curr_batch_attractions:
-        attraction_string_data, province = attraction_data_to_string_list(attraction)
-        if (attraction_string_data and province):
-          documents_list = text_to_document(attraction_string_data)
-          if (province == "ntt"):
-            attraction_docs_ntt.extend(documents_list)
-          else:
-            attraction_docs_ntb.extend(documents_list)
-      
-      # Parse attraction data and insert to Pinecone
-      if (len(attraction_docs_ntt) > 0):
-        attraction_data_ntt_parsed = parse_documents(attraction_docs_ntt)
-        self.pinecone_connector_component.store_data(attraction_data_ntt_parsed, pinecone_namespace_name_ntt) 
-        print(f"[BATCH PROGRESS] Processed {len(attraction_docs_ntt)} NTT nodes data")
-      
-      if (len(attraction_docs_ntb) > 0):
-        attraction_data_ntb_parsed = parse_documents(attraction_docs_ntb)
-        self.pinecone_connector_component.store_data(attraction_data_ntb_parsed, pinecone_namespace_name_ntb)         
-        print(f"[BATCH PROGRESS] Processed {len(attraction_docs_ntb)} NTB nodes data")
-      
-      print(f'[BATCH PROGRESS] Successfully inserted data idx {idx} to {upper_idx}')
-      
-      # Increment idx
-      idx += length_per_batch
+  async def process_data_tourist_attraction(self, force: bool = False) -> dict:
+    """
+    Process data tourism places, sync it from mongodb document to pinecone vector
+    """
+    return await self.ingestion_pipeline_component.run("objek-wisata-v2", convert_tourist_attraction, force=force, is_keyword_indexed=True,
+                                                       legacy_namespaces=["tourist_attractions_ntt", "tourist_attractions_ntb"])
     
 
-  async def process_labelling_communities(self, limit=None) -> None:
+  async def process_labelling_communities(self, limit: int = None, concurrency: int = None) -> dict:
     """"
       Give label to all communities based on influencers' bios, posts' tags, captions, and comments
     """
-    try:
-      mongo_collection_name = "communities"
-      communities = self.mongo_connector_component.get_data(mongo_collection_name, {})
-      
-      if limit:
-        communities = communities[:limit]
-        print(f"Processing only first {limit} communities")
-      
-      
-      for community in communities: 
-        community_id = community.get("community_id", "unknown")
-        influencers = community.get("influencers", [])
-        posts = community.get("posts", [])
-        
-        # Skip if no data to analyze
-        if not influencers and not posts:
-          print(f"Community {community_id} has no influencers or posts, skipping...")
-          continue
-        
-        # Generate label using LLM
-        label, description = await self._generate_community_label(influencers, posts)
-        print(label, description)
-        
-        # Store to Mongo DB
-        if label and description:
-          # Update community with generated label
-          self.mongo_connector_component.update_one_data(
-            mongo_collection_name,
-            {"community_id": community_id},
-            {"label": label, "description": description}
-          )
-          print(f"Labeled community {community_id}: {label} with description :{description}")
-        else:
-          print(f"Failed to generate label for community {community_id}")
-
-        
-        # Also store to pinecone
-        pinecone_namespace_name = "communities"
-        community_str = f"community_id: {community_id}\n" \
-                        f"label: {label}\n" \
-                        f"description: {description}\n"
-        community_docs = text_to_document([community_str])
-        community_parsed = parse_documents(community_docs)
-        self.pinecone_connector_component.store_data(community_parsed, pinecone_namespace_name)    
-      
-    except Exception as e: 
-      print(f"Error in labelling_communities: {str(e)}")
-      import traceback
-      traceback.print_exc()
-
-
-  async def _generate_community_label(self, influencers: list, posts: list) -> tuple[str]:
-    """
-    Generate a community label based on influencers' biographies, posts' tags, captions, and comments
-    """
-    try:
-      # Prepare context from influencers
-      influencer_context = ""
-      if influencers:
-        influencer_context = "Influencers in this community:\n"
-        for i, influencer in enumerate(influencers[:5]):  # Limit to 5 influencers to avoid too long context
-          username = influencer.get("username", "unknown")
-          biography = influencer.get("biography", "")
-          if biography:
-            influencer_context += f"- {username}: {biography}\n"
-          else:
-            influencer_context += f"- {username}: (no biography)\n"
-      
-      # Prepare context from posts
-      post_context = ""
-      if posts:
-        post_context = "Posts in this community:\n"
-        for i, post in enumerate(posts[:10]):  # Limit to 10 posts to avoid too long context
-          caption = post.get("caption", "")[:200]  # Limit caption length
-          tags = post.get("tags", [])
-          comments = post.get("comments", [])
-          
-          post_context += f"Post {i+1}:\n"
-          if caption:
-            post_context += f"  Caption: {caption}...\n"
-          if tags:
-            post_context += f"  Tags: {', '.join(tags[:10])}\n"  # Limit to 10 tags
-          if comments:
-            comment_preview = ', '.join([comment.get("text", "")[:50] for comment in comments[:3]])  # First 3 comments
-            post_context += f"  Sample Comments: {comment_preview}...\n"
-          post_context += "\n"
-      
-      # Generate prompt for community labeling
-      prompt = self.prompt_generator_component.generate_community_labeling_prompt(influencer_context, post_context)
-      
-      # Get response from LLM
-      response, _ = await self.model_component.answer(prompt, is_direct=True)
-      response_json = json.loads(response)
-      label = response_json['label']
-      description = response_json['description']
-      
-      return (label.strip(), description.strip())
-      
-    except Exception as e:
-      print(f"Error generating community label: {str(e)}")
-      return "", ""
+    return await self.community_labeller_component.run(limit, concurrency)
 
@@ -0,0 +1,131 @@
+from datetime import datetime, timezone, timedelta
+from typing import Optional
+import hashlib
+import numpy as np
+import threading
+
+
+class ChatCategoryClassifier():
+  """
+  Local nearest-centroid classifier of the chat category (general, tourism, other) over the message embeddings.
+  It is trained from the categorizations of the LLM, which are logged with their message embedding in Mongo.
+  The confidence of a prediction is the margin between the similarities to the two nearest centroids.
+  The minimum margin is calibrated on the logged categorizations (leave-one-out) to reach the target precision,
+  predictions below it return None so the LLM categorizes the message instead
+  """
+
+  CATEGORIES: list = ["general", "tourism", "other"]
+  _collection_name: str = "chat_categories"
+  # The classifier is only used once every category has this many logged categorizations
+  _min_samples_per_category: int = 20
+  # Precision of the confident predictions on the logged categorizations
+  _target_precision: float = 0.95
+  # The classifier is retrained after this age, or after this many new categorizations
+  _retrain_interval: timedelta = timedelta(hours=1)
+  _retrain_samples: int = 200
+
+  def __init__(self, mongo_connector: object):
+    """
+    The classifier is trained lazily, for each embedding model
+    """
+    self._mongo_connector = mongo_connector
+    # Per embedding model: {"centroids": np.ndarray, "min_margin": float or None, "trained_at": datetime, "new_samples": int}
+    self._models: dict = {}
+    self._lock = threading.Lock()
+
+  ######## PRIVATE ########
+
+  def _normalize(self, vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
+
+
+  def _calibrate(self, vectors: np.ndarray, labels: np.ndarray, sums: np.ndarray) -> Optional[float]:
+    """
+    Return the minimum margin for the target precision, with leave-one-out centroids so a sample does not vote for itself.
+    None if the target precision is not reachable
+    """
+    dots = vectors @ sums.T
+    sum_norms = np.linalg.norm(sums, axis=1)
+    similarities = dots / sum_norms
+    # Similarity to the own centroid without the sample: x.(S - x) / |S - x|, with |x| = 1
+    own_dots = dots[np.arange(len(labels)), labels]
+    own_norms = np.sqrt(np.maximum(sum_norms[labels] ** 2 - 2 * own_dots + 1, 1e-12))
+    similarities[np.arange(len(labels)), labels] = (own_dots - 1) / own_norms
+
+    sorted_similarities = np.sort(similarities, axis=1)
+    margins = sorted_similarities[:, -1] - sorted_similarities[:, -2]
+    is_correct = similarities.argmax(axis=1) == labels
+
+    # Largest set of the most confident predictions that reaches the target precision
+    order = np.argsort(-margins)
+    precisions = np.cumsum(is_correct[order]) / np.arange(1, len(order) + 1)
+    passing = np.nonzero(precisions >= self._target_precision)[0]
+    if (len(passing) == 0):
+      return None
+    return float(margins[order[passing[-1]]])
+
+
+  def _train(self, embedding_model: str) -> dict:
+    """
+    Train the centroids of the categories from the logged categorizations of the embedding model
+    """
+    documents = self._mongo_connector.get_data(self._collection_name, {"embedding_model": embedding_model}, {"category": 1, "embedding": 1})
+    documents = [document for document in documents if document.get("category") in self.CATEGORIES]
+    model = {"centroids": None, "min_margin": None, "trained_at": datetime.now(timezone.utc), "new_samples": 0}
+    labels = np.array([self.CATEGORIES.index(document["category"]) for document in documents], dtype=np.int64)
+    counts = np.bincount(labels, minlength=len(self.CATEGORIES))
+    if (counts.min() < self._min_samples_per_category):
+      print(f"[CHAT CLASSIFIER] Not enough categorizations to train, counts per category: {dict(zip(self.CATEGORIES, counts.tolist()))}")
+      return model
+
+    vectors = self._normalize(np.array([document["embedding"] for document in documents], dtype=np.float32))
+    sums = np.stack([vectors[labels == i].sum(axis=0) for i in range(len(self.CATEGORIES))])
+    model["centroids"] = self._normalize(sums)
+    model["min_margin"] = self._calibrate(vectors, labels, sums)
+    print(f"[CHAT CLASSIFIER] Trained on {len(documents)} categorizations with minimum margin {model['min_margin']}")
+    return model
+
+
+  def _get_model(self, embedding_model: str) -> dict:
+    with self._lock:
+      model = self._models.get(embedding_model)
+      if (model is None
+          or datetime.now(timezone.utc) - model["trained_at"] > self._retrain_interval
+          or model["new_samples"] >= self._retrain_samples):
+        model = self._train(embedding_model)
+        self._models[embedding_model] = model
+      return model
+
+  ######## PUBLIC ########
+
+  def classify(self, embedding: list[float], embedding_model: str) -> tuple[Optional[str], float]:
+    """
+    Classify the message embedding
+    Returns the category and the margin, the category is None if the prediction is not confident
+    """
+    model = self._get_model(embedding_model)
+    if (model["centroids"] is None or model["min_margin"] is None):
+      return None, 0.0
+    similarities = model["centroids"] @ self._normalize(np.asarray(embedding, dtype=np.float32))
+    sorted_similarities = np.sort(similarities)
+    margin = float(sorted_similarities[-1] - sorted_similarities[-2])
+    if (margin < model["min_margin"]):
+      return None, margin
+    return self.CATEGORIES[int(similarities.argmax())], margin
+
+
+  def log(self, message: str, category: str, embedding: list[float], embedding_model: str) -> None:
+    """
+    Log the categorization of the LLM as training data, the same message is logged once
+    """
+    if (category not in self.CATEGORIES):
+      return
+    message_hash = hashlib.sha256(message.strip().lower().encode("utf-8")).hexdigest()
+    self._mongo_connector.upsert_one_data(
+      self._collection_name,
+      {"message_hash": message_hash, "embedding_model": embedding_model},
+      {"message": message, "category": category, "embedding": list(embedding), "created_at": datetime.now(timezone.utc)})
+    with self._lock:
+      if (embedding_model in self._models):
+        self._models[embedding_model]["new_samples"] += 1
@@ -0,0 +1,131 @@
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.postprocessor.types import BaseNodePostprocessor
+from llama_index.core.schema import NodeWithScore, QueryBundle, TextNode
+from llama_index.core.utils import get_tokenizer
+from typing import ClassVar, List, Optional
+from utils.constant import ASSOCIATION_RULE_PREAMBLE
+import numpy as np
+import re
+import zlib
+
+
+class ContextCompressor(BaseNodePostprocessor):
+  """
+  Post-processing of the retrieved contexts before the generation and the evaluation, in ranking order:
+  1. Near-duplicate removal, by MinHash estimation of the Jaccard similarity of the word shingles
+     (e.g. the same review text retrieved for several hotels)
+  2. Per-source caps, a source being the header line of the node (e.g. "Tanto Hotel Review 3:" of all reviews of Tanto Hotel).
+     Association rules and posts are records of their own, they are not capped
+  3. Token budget, the last fitting node is truncated and the remaining nodes are dropped
+  Usable as a node postprocessor of a query engine, or directly with postprocess_nodes
+  """
+
+  max_tokens: int = Field(description="Token budget of all the contexts")
+  similarity_threshold: float = Field(default=0.8, description="Nodes with at least this estimated Jaccard similarity to a higher-ranked node are removed")
+  max_nodes_per_source: int = Field(default=3, description="Max nodes of a single source")
+  min_truncated_tokens: int = Field(default=64, description="A node that would be truncated below this length is dropped instead")
+
+  # MinHash parameters
+  _n_permutations: ClassVar[int] = 64
+  _shingle_size: ClassVar[int] = 3
+  _prime: ClassVar[int] = (1 << 31) - 1
+  # Same for all association rules, a rule is identified by its antecedents and consequents
+  _association_rule_preamble: ClassVar[str] = ASSOCIATION_RULE_PREAMBLE.strip()
+  # Header lines of nodes that are records of their own, shared by several records (e.g. the posts of a community)
+  _record_header_prefixes: ClassVar[tuple] = ("community id:",)
+
+  _permutations: np.ndarray = PrivateAttr()
+  _tokenizer: object = PrivateAttr()
+
+  def __init__(self, **kwargs):
+    super().__init__(**kwargs)
+    rng = np.random.default_rng(0)
+    self._permutations = rng.integers(1, self._prime, size=(2, self._n_permutations), dtype=np.int64)
+    self._tokenizer = get_tokenizer()
+
+
+  @classmethod
+  def class_name(cls) -> str:
+    return "ContextCompressor"
+
+  ######## PRIVATE ########
+
+  def _split_header(self, text: str) -> tuple[str, str]:
+    """
+    Split the header line (e.g. "Tanto Hotel Review 3:") from the body of a node text.
+    An association rule has no header, its preamble is dropped
+    """
+    text = text.strip()
+    if (text.startswith(self._association_rule_preamble)):
+      return "", text[len(self._association_rule_preamble):].strip()
+    header, _, body = text.partition("\n")
+    return header, body or header
+
+
+  def _get_source(self, text: str) -> Optional[str]:
+    """
+    Source of a node, the header without its numbering, so the chunks of the same kind of the same entity share it.
+    None if the node is a record of its own (an association rule or a post), which is not capped
+    """
+    header, _ = self._split_header(text)
+    source = re.sub(r"\d+", "", header).strip().lower()
+    if (source == "" or source.startswith(self._record_header_prefixes)):
+      return None
+    return source
+
+
+  def _minhash(self, text: str) -> np.ndarray:
+    """
+    MinHash signature of the word shingles of the body, the header is excluded so the same review of two hotels matches
+    """
+    _, body = self._split_header(text)
+    words = re.findall(r"\w+", body.lower())
+    n_shingles = max(1, len(words) - self._shingle_size + 1)
+    shingles = set([" ".join(words[i : i + self._shingle_size]) for i in range(n_shingles)])
+    hashes = np.array([zlib.crc32(shingle.encode("utf-8")) % self._prime for shingle in shingles], dtype=np.int64)
+    a, b = self._permutations
+    return ((a[:, None] * hashes[None, :] + b[:, None]) % self._prime).min(axis=1)
+
+
+  def _truncate(self, node: NodeWithScore, text: str, n_tokens: int, budget: int) -> NodeWithScore:
+    """
+    Truncate the node text to about budget tokens, at a word boundary
+    """
+    truncated_text = text[: int(len(text) * budget / n_tokens)].rsplit(" ", 1)[0] + " ..."
+    return NodeWithScore(node=TextNode(id_=node.node.node_id, text=truncated_text, metadata=node.node.metadata), score=node.score)
+
+
+  def _postprocess_nodes(self, nodes: List[NodeWithScore], query_bundle: Optional[QueryBundle] = None) -> List[NodeWithScore]:
+    signatures = []
+    source_counts = {}
+    remaining_tokens = self.max_tokens
+    result = []
+    for node in nodes:
+      text = node.node.get_content()
+      if (text.strip() == ""):
+        continue
+
+      signature = self._minhash(text)
+      if (any([np.mean(signature == kept_signature) >= self.similarity_threshold for kept_signature in signatures])):
+        continue
+
+      source = self._get_source(text)
+      if (source is not None and source_counts.get(source, 0) >= self.max_nodes_per_source):
+        continue
+
+      n_tokens = len(self._tokenizer(text))
+      if (n_tokens > remaining_tokens):
+        if (remaining_tokens >= self.min_truncated_tokens):
+          result.append(self._truncate(node, text, n_tokens, remaining_tokens))
+          remaining_tokens = 0
+        break
+
+      signatures.append(signature)
+      if (source is not None):
+        source_counts[source] = source_counts.get(source, 0) + 1
+      remaining_tokens -= n_tokens
+      result.append(node)
+
+    if (len(result) < len(nodes)):
+      print(f"[CONTEXT COMPRESSED] {len(nodes)} nodes are compressed to {len(result)} nodes, {self.max_tokens - remaining_tokens} tokens")
+    return result
@@ -0,0 +1,209 @@
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+from collections import OrderedDict
+from array import array
+from typing import Optional
+import hashlib
+import sqlite3
+import threading
+import time
+import re
+
+
+class EmbeddingCache():
+  """
+  Cache of embeddings keyed by the embedding model name and the normalized text.
+  Holds a bounded in-memory LRU and an optional sqlite store that survives restarts
+  """
+
+  # Max embeddings held in memory
+  _max_size: int = 10000
+
+  def __init__(self, db_path: Optional[str] = None, max_size: Optional[int] = None):
+    """
+    Instantiate the cache. The on-disk store is only used if db_path is given
+    """
+    if (max_size is not None):
+      self._max_size = max_size
+    self._memory: OrderedDict = OrderedDict()
+    self._lock = threading.Lock()
+    # Statistics
+    self.hits = 0
+    self.misses = 0
+    self._miss_latency_total = 0.0
+
+    self._connection = None
+    if (db_path):
+      self._connection = sqlite3.connect(db_path, check_same_thread=False)
+      self._connection.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, embedding BLOB)")
+      self._connection.commit()
+      print(f"[EMBEDDING CACHE] Using on-disk embedding cache in {db_path}")
+
+  ######## PRIVATE ########
+
+  def _normalize_text(self, text: str) -> str:
+    """
+    Normalize whitespaces of the text, so texts that only differ in spacing share the same key
+    """
+    return re.sub(r"\s+", " ", text).strip()
+
+
+  def _make_key(self, model_name: str, text: str) -> str:
+    """
+    Make cache key out of the model name and the normalized text
+    """
+    normalized_text = self._normalize_text(text)
+    return hashlib.sha256(f"{model_name}\n{normalized_text}".encode("utf-8")).hexdigest()
+
+
+  def _put_memory(self, key: str, embedding: Embedding) -> None:
+    """
+    Put embedding to the in-memory LRU, evicting the least recently used one if it is full
+    """
+    self._memory[key] = embedding
+    self._memory.move_to_end(key)
+    if (len(self._memory) > self._max_size):
+      self._memory.popitem(last=False)
+
+  ######## PUBLIC ########
+
+  def get(self, model_name: str, text: str) -> Optional[Embedding]:
+    """
+    Return the cached embedding, None if it is not cached
+    """
+    key = self._make_key(model_name, text)
+    with self._lock:
+      if (key in self._memory):
+        self._memory.move_to_end(key)
+        self.hits += 1
+        return self._memory[key]
+
+      if (self._connection is not None):
+        row = self._connection.execute("SELECT embedding FROM embeddings WHERE key = ?", (key,)).fetchone()
+        if (row is not None):
+          embedding = array("d", row[0]).tolist()
+          self._put_memory(key, embedding)
+          self.hits += 1
+          return embedding
+
+      self.misses += 1
+      return None
+
+
+  def put(self, model_name: str, text: str, embedding: Embedding, latency: float = 0.0) -> None:
+    """
+    Store the embedding. latency is the time spent to compute it, used to estimate the time saved
+    """
+    self.put_many(model_name, [(text, embedding)], latency)
+
+
+  def put_many(self, model_name: str, items: list[tuple[str, Embedding]], latency: float = 0.0) -> None:
+    """
+    Store list of (text, embedding). latency is the time spent to compute each embedding
+    """
+    rows = []
+    with self._lock:
+      for text, embedding in items:
+        key = self._make_key(model_name, text)
+        self._put_memory(key, embedding)
+        self._miss_latency_total += latency
+        rows.append((key, array("d", embedding).tobytes()))
+      if (self._connection is not None):
+        self._connection.executemany("INSERT OR REPLACE INTO embeddings (key, embedding) VALUES (?, ?)", rows)
+        self._connection.commit()
+
+
+  def get_stats(self) -> dict:
+    """
+    Return hit and miss counters, as well as the estimated time saved by the cache
+    """
+    with self._lock:
+      average_miss_latency = (self._miss_latency_total / self.misses) if self.misses > 0 else 0.0
+      return {
+        "hits": self.hits,
+        "misses": self.misses,
+        "size": len(self._memory),
+        "average_miss_latency": round(average_miss_latency, 4),
+        "estimated_time_saved": round(self.hits * average_miss_latency, 4),
+      }
+
+
+class CachedEmbedding(BaseEmbedding):
+  """
+  Embedding model wrapper that looks up the EmbeddingCache before calling the wrapped embedding model
+  """
+
+  _embed_model: BaseEmbedding = PrivateAttr()
+  _cache: EmbeddingCache = PrivateAttr()
+
+  def __init__(self, embed_model: BaseEmbedding, cache: EmbeddingCache, **kwargs):
+    super().__init__(model_name=embed_model.model_name,
+                     embed_batch_size=embed_model.embed_batch_size,
+                     **kwargs)
+    self._embed_model = embed_model
+    self._cache = cache
+
+
+  @classmethod
+  def class_name(cls) -> str:
+    return "CachedEmbedding"
+
+  ######## PRIVATE ########
+
+  def _split_cached(self, texts: list[str]) -> tuple[list, list[int]]:
+    """
+    Return the cached embeddings (None if not cached) and the indices of the texts that are not cached
+    """
+    embeddings = [self._cache.get(self.model_name, text) for text in texts]
+    missing_indices = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    return embeddings, missing_indices
+
+
+  def _get_query_embedding(self, query: str) -> Embedding:
+    embedding = self._cache.get(self.model_name, query)
+    if (embedding is None):
+      start_time = time.perf_counter()
+      embedding = self._embed_model.get_query_embedding(query)
+      self._cache.put(self.model_name, query, embedding, time.perf_counter() - start_time)
+    return embedding
+
+
+  async def _aget_query_embedding(self, query: str) -> Embedding:
+    embedding = self._cache.get(self.model_name, query)
+    if (embedding is None):
+      start_time = time.perf_counter()
+      embedding = await self._embed_model.aget_query_embedding(query)
+      self._cache.put(self.model_name, query, embedding, time.perf_counter() - start_time)
+    return embedding
+
+
+  def _get_text_embedding(self, text: str) -> Embedding:
+    return self._get_text_embeddings([text])[0]
+
+
+  async def _aget_text_embedding(self, text: str) -> Embedding:
+    return (await self._aget_text_embeddings([text]))[0]
+
+
+  def _get_text_embeddings(self, texts: list[str]) -> list[Embedding]:
+    embeddings, missing_indices = self._split_cached(texts)
+    if (len(missing_indices) > 0):
+      start_time = time.perf_counter()
+      missing_embeddings = self._embed_model.get_text_embedding_batch([texts[i] for i in missing_indices])
+      latency = (time.perf_counter() - start_time) / len(missing_indices)
+      for i, embedding in zip(missing_indices, missing_embeddings):
+        embeddings[i] = embedding
+      self._cache.put_many(self.model_name, [(texts[i], embeddings[i]) for i in missing_indices], latency)
+    return embeddings
+
+
+  async def _aget_text_embeddings(self, texts: list[str]) -> list[Embedding]:
+    embeddings, missing_indices = self._split_cached(texts)
+    if (len(missing_indices) > 0):
+      start_time = time.perf_counter()
+      missing_embeddings = await self._embed_model.aget_text_embedding_batch([texts[i] for i in missing_indices])
+      latency = (time.perf_counter() - start_time) / len(missing_indices)
+      for i, embedding in zip(missing_indices, missing_embeddings):
+        embeddings[i] = embedding
+      self._cache.put_many(self.model_name, [(texts[i], embeddings[i]) for i in missing_indices], latency)
+    return embeddings
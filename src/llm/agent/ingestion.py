@@ -0,0 +1,376 @@
+from llama_index.core.schema import MetadataMode
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Optional
+import asyncio
+import hashlib
+import multiprocessing
+import time
+import uuid
+
+from utils.function import (hotel_data_to_string_list,
+                            attraction_data_to_string_list,
+                            post_data_to_string_list,
+                            association_rule_data_to_string,
+                            text_to_document,
+                            parse_documents)
+
+
+######## CONVERTERS ########
+# Run in the worker processes, so they are module-level functions.
+# Each converts one Mongo document to list of (pinecone namespace, text)
+
+def convert_hotel(document: dict) -> list[tuple[str, str]]:
+  hotel_string_data, province = hotel_data_to_string_list(document)
+  if (not hotel_string_data or not province):
+    return []
+  return [(f"hotels_{province}", text) for text in hotel_string_data]
+
+
+def convert_tourist_attraction(document: dict) -> list[tuple[str, str]]:
+  attraction_string_data, province = attraction_data_to_string_list(document)
+  if (not attraction_string_data or not province):
+    return []
+  return [(f"tourist_attractions_{province}", text) for text in attraction_string_data]
+
+
+def convert_post(document: dict) -> list[tuple[str, str]]:
+  return [("posts", text) for text in post_data_to_string_list(document)]
+
+
+def convert_association_rule(document: dict) -> list[tuple[str, str]]:
+  return [("association_rules", association_rule_data_to_string(document))]
+
+
+def hash_text(text: str) -> str:
+  """
+  Content hash of a text
+  """
+  return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def make_node_id(collection_name: str, source_id: str, chunk_index: int) -> str:
+  """
+  Deterministic vector ID of the chunk_index-th node of a source document,
+  so re-ingesting a document overwrites its vectors instead of duplicating them
+  """
+  return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{collection_name}:{source_id}:{chunk_index}"))
+
+
+def chunk_document(collection_name: str, source_id: str, namespace_texts: list[tuple[str, str]]) -> list[tuple[str, object]]:
+  """
+  Chunk the texts of a source document into nodes with deterministic IDs
+  Returning format: list of (namespace, node)
+  """
+  namespace_nodes = []
+  for namespace, text in namespace_texts:
+    for node in parse_documents(text_to_document([text])):
+      node.id_ = make_node_id(collection_name, source_id, len(namespace_nodes))
+      namespace_nodes.append((namespace, node))
+  return namespace_nodes
+
+
+def convert_documents(convert_function: Callable,
+                      collection_name: str,
+                      documents: list[dict],
+                      manifests: dict,
+                      force: bool = False,
+                      chunk_unchanged: bool = False) -> dict:
+  """
+  Convert and chunk the documents that changed since their manifest (see IngestionPipeline).
+  Unchanged documents are skipped before chunking, and unchanged nodes of changed documents are not returned for embedding.
+  If chunk_unchanged is True, the nodes of unchanged documents are returned too, to rebuild the keyword index without embedding.
+  Returning format:
+  {
+    manifests: list of new manifest of the changed documents,
+    nodes: {namespace: list of nodes to embed and upsert},
+    stale_nodes: {namespace: list of node IDs that no longer exist},
+    unchanged_nodes: {namespace: list of nodes that do not need embedding}
+  }
+  """
+  result = {"manifests": [], "nodes": {}, "stale_nodes": {}, "unchanged_nodes": {}}
+  for document in documents:
+    source_id = str(document["_id"])
+    old_manifest = manifests.get(source_id, {"hash": None, "nodes": []})
+    namespace_texts = convert_function(document)
+    document_hash = hash_text("\n".join([f"{namespace}\n{text}" for namespace, text in namespace_texts]))
+    if (not force and document_hash == old_manifest["hash"]):
+      if (chunk_unchanged):
+        for namespace, node in chunk_document(collection_name, source_id, namespace_texts):
+          result["unchanged_nodes"].setdefault(namespace, []).append(node)
+      continue
+
+    old_node_hashes = {(node["namespace"], node["id"]): node["hash"] for node in old_manifest["nodes"]}
+    new_nodes = []
+    for namespace, node in chunk_document(collection_name, source_id, namespace_texts):
+      node_hash = hash_text(node.get_content(metadata_mode=MetadataMode.EMBED))
+      new_nodes.append({"namespace": namespace, "id": node.id_, "hash": node_hash})
+      if (force or old_node_hashes.get((namespace, node.id_)) != node_hash):
+        result["nodes"].setdefault(namespace, []).append(node)
+      elif (chunk_unchanged):
+        result["unchanged_nodes"].setdefault(namespace, []).append(node)
+
+    new_node_keys = set([(node["namespace"], node["id"]) for node in new_nodes])
+    for namespace, node_id in old_node_hashes.keys():
+      if ((namespace, node_id) not in new_node_keys):
+        result["stale_nodes"].setdefault(namespace, []).append(node_id)
+    result["manifests"].append({"source_id": source_id, "hash": document_hash, "nodes": new_nodes})
+  return result
+
+
+class IngestionPipeline():
+  """
+  Streaming pipeline to sync data from Mongo to Pinecone:
+  read (Mongo cursor) -> convert and chunk (process pool) -> embed (concurrent batches) -> upsert (parallel).
+  Stages are connected by bounded queues, so a slow stage holds back the previous ones and memory stays constant.
+
+  A manifest keeps the content hash of each source document and of each of its nodes,
+  so only new or changed documents are embedded, and the vectors of removed documents are deleted.
+  The manifest of a document is written after its vectors are upserted, so an interrupted sync resumes where it stopped.
+  The nodes can also be indexed in the keyword index (see KeywordIndex), which is rebuilt without embedding if it is missing
+  """
+
+  _manifest_collection_name: str = "ingestion_manifest"
+
+  # Documents read and converted together
+  _read_batch_size: int = 50
+  # Nodes embedded in one embedding call
+  _embed_batch_size: int = 100
+  # Nodes upserted in one upsert call
+  _upsert_batch_size: int = 100
+  # Workers of each stage
+  _convert_workers: int = 4
+  _embed_workers: int = 4
+  _upsert_workers: int = 4
+  # Max concurrent embedding calls
+  _embed_concurrency: int = 8
+  # Max batches waiting between two stages
+  _queue_size: int = 4
+
+  def __init__(self, agent_component: object):
+    """
+    Instantiate the pipeline
+    """
+    self._agent_component = agent_component
+    self._is_manifest_indexed = False
+
+  ######## MANIFEST ########
+
+  def _get_manifests(self, collection_name: str) -> dict:
+    """
+    Return the manifests of the collection, keyed by source_id
+    """
+    mongo_connector = self._agent_component.mongo_connector_component
+    if (not self._is_manifest_indexed):
+      mongo_connector.create_index(self._manifest_collection_name, [("collection", 1), ("source_id", 1)], unique=True)
+      self._is_manifest_indexed = True
+    manifests = mongo_connector.get_data(self._manifest_collection_name, {"collection": collection_name}, {"source_id": 1, "hash": 1, "nodes": 1})
+    return {manifest["source_id"]: manifest for manifest in manifests}
+
+
+  def _set_manifests(self, collection_name: str, manifests: list[dict]) -> None:
+    """
+    Store the manifests of the synced documents
+    """
+    self._agent_component.mongo_connector_component.upsert_many_data(
+      self._manifest_collection_name,
+      [{"collection": collection_name, "source_id": manifest["source_id"]} for manifest in manifests],
+      [{"hash": manifest["hash"], "nodes": manifest["nodes"]} for manifest in manifests]
+    )
+
+  ######## STAGES ########
+
+  async def _run_workers(self, n_workers: int, in_queue: asyncio.Queue, out_queue: Optional[asyncio.Queue], n_next_workers: int, function: Callable) -> None:
+    """
+    Run n_workers that apply function to the batches of in_queue and put the results to out_queue.
+    None in the queue marks the end, it is passed on to each worker of the next stage
+    """
+    async def worker() -> None:
+      while (True):
+        batch = await in_queue.get()
+        if (batch is None):
+          return
+        result = await function(batch)
+        if (out_queue is not None):
+          await out_queue.put(result)
+
+    await asyncio.gather(*[worker() for _ in range(n_workers)])
+    if (out_queue is not None):
+      for _ in range(n_next_workers):
+        await out_queue.put(None)
+
+
+  async def _read(self, collection_name: str, projection: Optional[dict], out_queue: asyncio.Queue, seen_source_ids: set) -> None:
+    """
+    Stream documents from the Mongo cursor, as batches
+    """
+    iterator = self._agent_component.mongo_connector_component.iterate_data(collection_name, {}, projection, self._read_batch_size)
+    while (True):
+      documents = await asyncio.to_thread(next, iterator, None)
+      if (documents is None):
+        break
+      seen_source_ids.update([str(document["_id"]) for document in documents])
+      await out_queue.put({"n_documents": len(documents), "documents": documents})
+    for _ in range(self._convert_workers):
+      await out_queue.put(None)
+
+
+  async def _embed(self, batch: dict, semaphore: asyncio.Semaphore) -> dict:
+    """
+    Embed the nodes of the batch, in concurrent embedding calls of _embed_batch_size nodes
+    """
+    embed_model = self._agent_component.model_component.corpus_embed_model
+
+    async def embed_nodes(nodes: list) -> None:
+      async with semaphore:
+        texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+        embeddings = await embed_model.aget_text_embedding_batch(texts)
+      for node, embedding in zip(nodes, embeddings):
+        node.embedding = embedding
+
+    await asyncio.gather(*[embed_nodes(nodes[i : i + self._embed_batch_size])
+                           for nodes in batch["nodes"].values()
+                           for i in range(0, len(nodes), self._embed_batch_size)])
+    return batch
+
+
+  async def _upsert(self, batch: dict, is_keyword_indexed: bool) -> dict:
+    """
+    Upsert the embedded nodes of the batch to their namespaces, and delete its stale nodes
+    """
+    pinecone_connector = self._agent_component.pinecone_connector_component
+    for namespace, nodes in batch["nodes"].items():
+      for i in range(0, len(nodes), self._upsert_batch_size):
+        await asyncio.to_thread(pinecone_connector.upsert_nodes, nodes[i : i + self._upsert_batch_size], namespace)
+    for namespace, node_ids in batch["stale_nodes"].items():
+      await asyncio.to_thread(pinecone_connector.delete_nodes, node_ids, namespace)
+
+    if (is_keyword_indexed):
+      keyword_index = self._agent_component.keyword_index_component
+      for namespace, nodes in list(batch["nodes"].items()) + list(batch["unchanged_nodes"].items()):
+        keyword_index.add_nodes(nodes, namespace)
+      for namespace, node_ids in batch["stale_nodes"].items():
+        keyword_index.delete_nodes(node_ids, namespace)
+    return batch
+
+
+  async def _delete_removed(self, collection_name: str, manifests: dict, seen_source_ids: set, is_keyword_indexed: bool) -> tuple[int, int]:
+    """
+    Delete the vectors and the manifests of the documents that are no longer in the collection.
+    Returns the number of removed documents and of deleted nodes
+    """
+    removed_source_ids = [source_id for source_id in manifests.keys() if source_id not in seen_source_ids]
+    if (len(removed_source_ids) == 0):
+      return 0, 0
+    namespace_node_ids = {}
+    for source_id in removed_source_ids:
+      for node in manifests[source_id]["nodes"]:
+        namespace_node_ids.setdefault(node["namespace"], []).append(node["id"])
+    for namespace, node_ids in namespace_node_ids.items():
+      await asyncio.to_thread(self._agent_component.pinecone_connector_component.delete_nodes, node_ids, namespace)
+      if (is_keyword_indexed):
+        self._agent_component.keyword_index_component.delete_nodes(node_ids, namespace)
+    await asyncio.to_thread(self._agent_component.mongo_connector_component.delete_many_data,
+                            self._manifest_collection_name,
+                            {"collection": collection_name, "source_id": {"$in": removed_source_ids}})
+    return len(removed_source_ids), sum([len(node_ids) for node_ids in namespace_node_ids.values()])
+
+  ######## PUBLIC ########
+
+  async def run(self,
+                collection_name: str,
+                convert_function: Callable,
+                projection: Optional[dict] = None,
+                force: bool = False,
+                is_keyword_indexed: bool = False,
+                legacy_namespaces: Optional[list[str]] = None) -> dict:
+    """
+    Sync documents of the Mongo collection to Pinecone, converted by convert_function (see the converters above).
+    If force is True, all documents are re-embedded even if they have not changed.
+    If is_keyword_indexed is True, the nodes are also indexed in the keyword index.
+    legacy_namespaces are the namespaces of the collection, they are purged on the first sync (empty manifest),
+    as the vectors stored before the manifest have random IDs and would be duplicated by the deterministic ones.
+    Returns the statistics of the sync
+    """
+    start_time = time.perf_counter()
+    stats = {
+      "collection": collection_name,
+      "n_documents": 0,
+      "n_changed_documents": 0,
+      "n_removed_documents": 0,
+      "n_embedded_nodes": 0,
+      "n_deleted_nodes": 0,
+    }
+    manifests = await asyncio.to_thread(self._get_manifests, collection_name)
+    print(f"[INGESTION STARTED] Syncing {collection_name}, {len(manifests)} documents in the manifest")
+
+    if (len(manifests) == 0 and legacy_namespaces):
+      for namespace in legacy_namespaces:
+        await asyncio.to_thread(self._agent_component.pinecone_connector_component.delete_namespace, namespace)
+      print(f"[INGESTION STARTED] Purged the legacy namespaces of {collection_name}: {legacy_namespaces}")
+
+    # A namespace synced before without its keyword index (e.g. new machine) has its unchanged nodes indexed too
+    keyword_index = self._agent_component.keyword_index_component if is_keyword_indexed else None
+    manifest_namespaces = set([node["namespace"] for manifest in manifests.values() for node in manifest["nodes"]])
+    chunk_unchanged = is_keyword_indexed and any([not keyword_index.is_namespace_indexed(namespace) for namespace in manifest_namespaces])
+    if (chunk_unchanged):
+      print(f"[INGESTION STARTED] Rebuilding the keyword index of {collection_name}")
+    keyword_namespaces = set()
+
+    read_queue = asyncio.Queue(maxsize=self._queue_size)
+    convert_queue = asyncio.Queue(maxsize=self._queue_size)
+    embed_queue = asyncio.Queue(maxsize=self._queue_size)
+    semaphore = asyncio.Semaphore(self._embed_concurrency)
+    seen_source_ids = set()
+    loop = asyncio.get_running_loop()
+
+    async def convert(batch: dict) -> dict:
+      documents = batch.pop("documents")
+      source_ids = [str(document["_id"]) for document in documents]
+      batch_manifests = {source_id: manifests[source_id] for source_id in source_ids if source_id in manifests}
+      batch.update(await loop.run_in_executor(executor, convert_documents, convert_function, collection_name, documents, batch_manifests, force, chunk_unchanged))
+      return batch
+
+    async def upsert(batch: dict) -> None:
+      await self._upsert(batch, is_keyword_indexed)
+      keyword_namespaces.update(list(batch["nodes"].keys()) + list(batch["unchanged_nodes"].keys()) + list(batch["stale_nodes"].keys()))
+      if (len(batch["manifests"]) > 0):
+        await asyncio.to_thread(self._set_manifests, collection_name, batch["manifests"])
+      stats["n_documents"] += batch["n_documents"]
+      stats["n_changed_documents"] += len(batch["manifests"])
+      stats["n_embedded_nodes"] += sum([len(nodes) for nodes in batch["nodes"].values()])
+      stats["n_deleted_nodes"] += sum([len(node_ids) for node_ids in batch["stale_nodes"].values()])
+      print(f"[INGESTION PROGRESS] {collection_name}: {stats['n_documents']} documents, {stats['n_changed_documents']} changed, " \
+            f"{round(stats['n_documents'] / (time.perf_counter() - start_time), 2)} documents/s")
+
+    # Spawn the workers, so they do not inherit the threads (Mongo, Pinecone clients) of this process
+    with ProcessPoolExecutor(max_workers=self._convert_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+      tasks = [
+        asyncio.create_task(self._read(collection_name, projection, read_queue, seen_source_ids)),
+        asyncio.create_task(self._run_workers(self._convert_workers, read_queue, convert_queue, self._embed_workers, convert)),
+        asyncio.create_task(self._run_workers(self._embed_workers, convert_queue, embed_queue, self._upsert_workers, lambda batch: self._embed(batch, semaphore))),
+        asyncio.create_task(self._run_workers(self._upsert_workers, embed_queue, None, 0, upsert)),
+      ]
+      try:
+        await asyncio.gather(*tasks)
+        # Only after a complete read, so every document that still exists has been seen
+        n_removed_documents, n_deleted_nodes = await self._delete_removed(collection_name, manifests, seen_source_ids, is_keyword_indexed)
+        stats["n_removed_documents"] = n_removed_documents
+        stats["n_deleted_nodes"] += n_deleted_nodes
+        keyword_namespaces.update(manifest_namespaces)
+      except Exception as e:
+        # Stop the other stages, the next run skips the documents that have been synced
+        for task in tasks:
+          task.cancel()
+        print(f"[ERROR INGESTION] {collection_name} stopped after {stats['n_documents']} documents: {e}")
+        raise Exception(e)
+      finally:
+        # The keyword index holds the nodes of the synced documents, also when the sync is interrupted
+        if (is_keyword_indexed):
+          for namespace in keyword_namespaces:
+            keyword_index.save(namespace)
+
+    elapsed_time = time.perf_counter() - start_time
+    stats["elapsed_time"] = round(elapsed_time, 2)
+    stats["documents_per_second"] = round(stats["n_documents"] / elapsed_time, 2) if elapsed_time > 0 else 0.0
+    print(f"[INGESTION DONE] {stats}")
+    return stats
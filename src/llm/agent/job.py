@@ -0,0 +1,132 @@
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Callable, Optional, Tuple
+import asyncio
+import threading
+import uuid
+
+
+class JobRunner():
+  """
+  In-process runner of background jobs.
+  Jobs run on a long-lived event loop, so they outlive the request that submitted them:
+  the serving loop when it is attached (ASGI mode), so the jobs share the async clients of the requests,
+  otherwise a dedicated event loop in a daemon thread
+  """
+
+  # Max finished jobs whose status is kept
+  _max_finished_jobs: int = 200
+
+  def __init__(self):
+    """
+    The event loop is started on the first submitted job
+    """
+    self._jobs: OrderedDict = OrderedDict()
+    # Key of the running jobs to their job_id, used to prevent overlapping runs
+    self._active_keys: dict = {}
+    self._lock = threading.Lock()
+    self._loop = None
+
+  ######## PRIVATE ########
+
+  def attach_loop(self, loop: asyncio.AbstractEventLoop) -> None:
+    """
+    Run the jobs on loop (e.g. the serving loop of the ASGI app), instead of a dedicated event loop.
+    Must be called before the first job is submitted
+    """
+    with self._lock:
+      if (self._loop is not None and self._loop is not loop):
+        raise Exception("Job runner event loop is already started")
+      self._loop = loop
+      print("[JOB RUNNER] Job runner is attached to the serving event loop")
+
+
+  def _get_loop(self) -> asyncio.AbstractEventLoop:
+    """
+    Return the event loop of the runner, starting it if it has not been started
+    """
+    with self._lock:
+      if (self._loop is None):
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, name="job-runner", daemon=True).start()
+        print("[JOB RUNNER] Job runner event loop is started")
+      return self._loop
+
+
+  def _now(self) -> str:
+    """
+    Return current time in ISO format
+    """
+    return datetime.now(timezone.utc).isoformat()
+
+
+  def _remove_finished_jobs(self) -> None:
+    """
+    Remove the oldest finished jobs until the kept history fits
+    """
+    finished_job_ids = [job_id for job_id, job in self._jobs.items() if job["status"] in ["succeeded", "failed"]]
+    for job_id in finished_job_ids[:max(0, len(finished_job_ids) - self._max_finished_jobs)]:
+      del self._jobs[job_id]
+
+
+  async def _run(self, job_id: str, coroutine_function: Callable, args: tuple) -> None:
+    """
+    Run the job and record its status
+    """
+    job = self._jobs[job_id]
+    job["status"] = "running"
+    job["started_at"] = self._now()
+    print(f"[JOB STARTED] Job {job['name']} ({job_id}) is started")
+    try:
+      job["result"] = await coroutine_function(*args)
+      job["status"] = "succeeded"
+      print(f"[JOB SUCCEEDED] Job {job['name']} ({job_id}) is succeeded")
+    except Exception as e:
+      job["status"] = "failed"
+      job["error"] = str(e)
+      print(f"[JOB FAILED] Job {job['name']} ({job_id}) is failed: {e}")
+    finally:
+      job["finished_at"] = self._now()
+      with self._lock:
+        del self._active_keys[job["key"]]
+        self._remove_finished_jobs()
+
+  ######## PUBLIC ########
+
+  def submit(self, key: str, name: str, coroutine_function: Callable, *args) -> Tuple[dict, bool]:
+    """
+    Submit coroutine_function(*args) as a job.
+    Jobs with the same key do not overlap: if a job with the same key is still queued or running,
+    nothing is submitted and that job is returned with False
+    """
+    loop = self._get_loop()
+    with self._lock:
+      if (key in self._active_keys):
+        return dict(self._jobs[self._active_keys[key]]), False
+
+      job_id = str(uuid.uuid4())
+      job = {
+        "job_id": job_id,
+        "key": key,
+        "name": name,
+        "status": "queued",
+        "created_at": self._now(),
+        "started_at": None,
+        "finished_at": None,
+        "result": None,
+        "error": None,
+      }
+      self._jobs[job_id] = job
+      self._active_keys[key] = job_id
+      print(f"[JOB QUEUED] Job {name} ({job_id}) is queued")
+      asyncio.run_coroutine_threadsafe(self._run(job_id, coroutine_function, args), loop)
+      return dict(job), True
+
+
+  def get_job(self, job_id: str) -> Optional[dict]:
+    """
+    Return the status of the job, None if it is not found
+    """
+    with self._lock:
+      job = self._jobs.get(job_id, None)
+      return dict(job) if job is not None else None
@@ -0,0 +1,234 @@
+from llama_index.core.schema import MetadataMode
+from typing import Optional
+import asyncio
+import json
+import os
+import time
+
+from agent.ingestion import hash_text, make_node_id
+from utils.function import text_to_document, parse_documents
+
+
+class CommunityLabeller():
+  """
+  Concurrent labelling of the communities, based on influencers' bios, posts' tags, captions, and comments.
+  Communities are labelled by concurrent LLM calls, bounded by a semaphore.
+  Labels are written in batches: one embedding call and one Pinecone upsert for the community nodes,
+  then one Mongo bulk write for the labels.
+  The hash of the labelling prompt is stored as label_hash, so communities with an up-to-date label are skipped,
+  and a failed run resumes with the communities that have not been labelled.
+  Labels written before label_hash have random vector IDs, so the namespace is purged on the first run (no label_hash yet)
+  """
+
+  _collection_name: str = "communities"
+  _pinecone_namespace_name: str = "communities"
+  # Max concurrent LLM calls
+  _concurrency: int = int(os.getenv("LABELLING_CONCURRENCY", 8))
+  # Labels written together
+  _write_batch_size: int = 50
+  # Influencers and posts given to the LLM, only these are read from Mongo
+  _max_influencers: int = 5
+  _max_posts: int = 10
+
+  def __init__(self, agent_component: object):
+    """
+    Instantiate the labeller
+    """
+    self._agent_component = agent_component
+
+  ######## PRIVATE ########
+
+  def _build_context(self, influencers: list, posts: list) -> tuple[str, str]:
+    """
+    Build the influencer context and the post context of the labelling prompt
+    """
+    # Prepare context from influencers
+    influencer_context = ""
+    if influencers:
+      influencer_context = "Influencers in this community:\n"
+      for influencer in influencers[:self._max_influencers]:
+        username = influencer.get("username", "unknown")
+        biography = influencer.get("biography", "")
+        if biography:
+          influencer_context += f"- {username}: {biography}\n"
+        else:
+          influencer_context += f"- {username}: (no biography)\n"
+
+    # Prepare context from posts
+    post_context = ""
+    if posts:
+      post_context = "Posts in this community:\n"
+      for i, post in enumerate(posts[:self._max_posts]):
+        caption = post.get("caption", "")[:200]  # Limit caption length
+        tags = post.get("tags", [])
+        comments = post.get("comments", [])
+
+        post_context += f"Post {i+1}:\n"
+        if caption:
+          post_context += f"  Caption: {caption}...\n"
+        if tags:
+          post_context += f"  Tags: {', '.join(tags[:10])}\n"  # Limit to 10 tags
+        if comments:
+          comment_preview = ', '.join([comment.get("text", "")[:50] for comment in comments[:3]])  # First 3 comments
+          post_context += f"  Sample Comments: {comment_preview}...\n"
+        post_context += "\n"
+
+    return influencer_context, post_context
+
+
+  async def _generate_label(self, prompt: str) -> tuple[str, str]:
+    """
+    Generate the label and the description of a community from the labelling prompt
+    """
+    try:
+      response, _ = await self._agent_component.model_component.answer(prompt, is_direct=True)
+      response_json = json.loads(response)
+      return (response_json['label'].strip(), response_json['description'].strip())
+    except Exception as e:
+      print(f"[ERROR COMMUNITY LABEL] Error generating community label: {e}")
+      return "", ""
+
+
+  async def _label_community(self, community: dict, stats: dict) -> Optional[dict]:
+    """
+    Label one community. Returns its label, None if it is skipped or failed
+    """
+    community_id = community.get("community_id", "unknown")
+    influencers = community.get("influencers", [])
+    posts = community.get("posts", [])
+
+    # Skip if no data to analyze
+    if not influencers and not posts:
+      print(f"[COMMUNITY LABEL SKIPPED] Community {community_id} has no influencers or posts")
+      stats["n_skipped"] += 1
+      return None
+
+    influencer_context, post_context = self._build_context(influencers, posts)
+    prompt = self._agent_component.prompt_generator_component.generate_community_labeling_prompt(influencer_context, post_context)
+    label_hash = hash_text(prompt)
+    # Skip if the community has been labelled from the same prompt
+    if (community.get("label") and community.get("label_hash") == label_hash):
+      stats["n_skipped"] += 1
+      return None
+
+    label, description = await self._generate_label(prompt)
+    if (not label or not description):
+      print(f"[ERROR COMMUNITY LABEL] Failed to generate label for community {community_id}")
+      stats["n_failed"] += 1
+      return None
+
+    print(f"[COMMUNITY LABELLED] Community {community_id}: {label} with description: {description}")
+    return {"community_id": community_id, "label": label, "description": description, "label_hash": label_hash}
+
+
+  async def _write_labels(self, labels: list[dict]) -> None:
+    """
+    Store the labels in Pinecone, in one embedding call and one upsert, then in Mongo, in one bulk write.
+    Mongo is written last, so the labels are only marked up-to-date after their vectors are stored
+    """
+    nodes = []
+    for label in labels:
+      community_str = f"community_id: {label['community_id']}\n" \
+                      f"label: {label['label']}\n" \
+                      f"description: {label['description']}\n"
+      for chunk_index, node in enumerate(parse_documents(text_to_document([community_str]))):
+        # Deterministic ID, so relabelling overwrites the vector of the community
+        node.id_ = make_node_id(self._collection_name, str(label['community_id']), chunk_index)
+        nodes.append(node)
+
+    embeddings = await self._agent_component.model_component.corpus_embed_model.aget_text_embedding_batch(
+      [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+    )
+    for node, embedding in zip(nodes, embeddings):
+      node.embedding = embedding
+    await asyncio.to_thread(self._agent_component.pinecone_connector_component.upsert_nodes, nodes, self._pinecone_namespace_name)
+
+    await asyncio.to_thread(
+      self._agent_component.mongo_connector_component.update_many_data,
+      self._collection_name,
+      [{"community_id": label['community_id']} for label in labels],
+      [{"label": label['label'], "description": label['description'], "label_hash": label['label_hash']} for label in labels]
+    )
+
+  def _is_first_run(self) -> bool:
+    """
+    Check if no community has been labelled with label_hash yet
+    """
+    iterator = self._agent_component.mongo_connector_component.iterate_data(self._collection_name, {"label_hash": {"$exists": True}}, {"_id": 1}, 1)
+    return next(iterator, None) is None
+
+  ######## PUBLIC ########
+
+  async def run(self, limit: Optional[int] = None, concurrency: Optional[int] = None) -> dict:
+    """
+    Label the communities, only the first limit communities if limit is given.
+    Returns the statistics of the labelling
+    """
+    start_time = time.perf_counter()
+    stats = {"n_communities": 0, "n_labelled": 0, "n_skipped": 0, "n_failed": 0}
+    semaphore = asyncio.Semaphore(concurrency or self._concurrency)
+    write_lock = asyncio.Lock()
+    pending_labels = []
+    tasks = set()
+
+    # Legacy label vectors would be duplicated by the deterministic ones, and returned by the similarity search of decide_action
+    if (await asyncio.to_thread(self._is_first_run)):
+      await asyncio.to_thread(self._agent_component.pinecone_connector_component.delete_namespace, self._pinecone_namespace_name)
+      print(f"[LABELLING STARTED] Purged the legacy label vectors of {self._pinecone_namespace_name}")
+
+    async def flush() -> None:
+      nonlocal pending_labels
+      async with write_lock:
+        labels, pending_labels = pending_labels, []
+        if (len(labels) == 0):
+          return
+        try:
+          await self._write_labels(labels)
+          stats["n_labelled"] += len(labels)
+        except Exception as e:
+          # Not marked up-to-date, so they are labelled again on the next run
+          print(f"[ERROR COMMUNITY LABEL] Failed to write {len(labels)} labels: {e}")
+          stats["n_failed"] += len(labels)
+        elapsed_time = time.perf_counter() - start_time
+        print(f"[LABELLING PROGRESS] {stats['n_labelled']} labelled, {stats['n_skipped']} skipped, {stats['n_failed']} failed, " \
+              f"{round(stats['n_labelled'] / elapsed_time, 2)} communities/s")
+
+    async def label(community: dict) -> None:
+      try:
+        result = await self._label_community(community, stats)
+        if (result is not None):
+          pending_labels.append(result)
+          if (len(pending_labels) >= self._write_batch_size):
+            await flush()
+      finally:
+        semaphore.release()
+
+    # Only the influencers and posts that are given to the LLM are read
+    projection = {
+      "community_id": 1, "label": 1, "label_hash": 1,
+      "influencers": {"$slice": self._max_influencers},
+      "posts": {"$slice": self._max_posts},
+    }
+    iterator = self._agent_component.mongo_connector_component.iterate_data(self._collection_name, {}, projection)
+    while (limit is None or stats["n_communities"] < limit):
+      communities = await asyncio.to_thread(next, iterator, None)
+      if (communities is None):
+        break
+      if (limit is not None):
+        communities = communities[:limit - stats["n_communities"]]
+      for community in communities:
+        # Bound the communities in flight, so the reader does not run ahead of the LLM calls
+        await semaphore.acquire()
+        task = asyncio.create_task(label(community))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        stats["n_communities"] += 1
+
+    await asyncio.gather(*tasks)
+    await flush()
+
+    elapsed_time = time.perf_counter() - start_time
+    stats["elapsed_time"] = round(elapsed_time, 2)
+    stats["communities_per_second"] = round(stats["n_labelled"] / elapsed_time, 2) if elapsed_time > 0 else 0.0
+    print(f"[LABELLING DONE] {stats}")
+    return stats
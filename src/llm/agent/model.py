@@ -2,10 +2,16 @@ from llama_index.embeddings.openai import OpenAIEmbedding
 from llama_index.llms.openai import OpenAI
 from llama_index.core import  VectorStoreIndex
 from llama_index.core.agent import ReActAgent
+from llama_index.core.query_engine import RetrieverQueryEngine
+from llama_index.core.schema import NodeWithScore, QueryBundle
 from llama_index.core.tools import QueryEngineTool, ToolMetadata
+from agent.context import ContextCompressor
+from agent.embedding import EmbeddingCache, CachedEmbedding
+from connector.keyword import KeywordIndex, HybridRetriever
 from typing import Tuple, Optional
 from dotenv import load_dotenv
 load_dotenv()
+import asyncio
 import os
 
 class Model():
@@ -14,6 +20,9 @@ class Model():
   """
   _llm_model_name: str = "gpt-4o-mini"
   _embed_model_name: str = "text-embedding-3-small"
+  # Async clients are bound to the event loop they are first used on. In ASGI mode the requests and the jobs share the serving loop,
+  # in Flask mode every request runs on its own event loop (and the jobs on another one), so the clients are not reused between calls
+  _reuse_client: bool = os.getenv("LLM_SERVER_MODE", "flask").lower() == "asgi"
 
   """
   Mutable variable in the model. Can be changed through Configurator component
@@ -23,20 +32,44 @@ class Model():
   _max_token : int = 4096
   _max_iteration: int = 10
 
-  """
-  Constant variable in the model. Should not be changed when the model is operating
-  """
-  _tools: dict[list] = {}
-
+  # Answer mode of the agentic system:
+  # "retrieve" retrieves from all the tools concurrently and generates the answer in one LLM call,
+  # "react" lets the ReAct agent call the tools (one LLM synthesis per tool call), for hard queries
+  ANSWER_MODES: list = ["retrieve", "react"]
+  _answer_mode: str = os.getenv("ANSWER_MODE", "retrieve").lower()
+  # Dampens the weight of the top ranks when fusing the results of the tools
+  _rrf_k: int = 60
+  # Max retrieved nodes given to the generation in retrieve mode
+  _max_retrieved_nodes: int = 20
 
   def __init__(self, 
-               persona_component: object):
+               persona_component: object,
+               embedding_cache: Optional[EmbeddingCache] = None,
+               keyword_index: Optional[KeywordIndex] = None):
     """
     Initialization of the LLM and the embedding model
     """
+    if (self._answer_mode not in self.ANSWER_MODES):
+      raise Exception(f"Unknown answer mode: {self._answer_mode}. Available modes: {self.ANSWER_MODES}")
     self._persona_component = persona_component
     self.llm_model = None
     self.embed_model  = None
+    self.corpus_embed_model = None
+    # Tools for agentic system, keyed by tool_user_id
+    self._tools: dict[list] = {}
+    # Cache of constructed retrieval system, keyed by (namespace, top_k) and (namespace, metadata_name)
+    # Only valid for the current llm_model, embed_model, top_k and max_token
+    self._query_engine_cache: dict = {}
+    self._tool_cache: dict = {}
+    # Embedding cache is keyed by the embedding model name, so it is kept across set_model
+    # and can be shared by several models
+    if (embedding_cache is None):
+      embedding_cache = EmbeddingCache(db_path=os.getenv("EMBEDDING_CACHE_PATH"))
+    self._embedding_cache = embedding_cache
+    # Keyword index of the namespaces, the retrieval of an indexed namespace is hybrid (see HybridRetriever)
+    self._keyword_index = keyword_index
+    # Retrieved contexts are deduplicated, capped per source and fitted in max_token before the generation, the evaluation gets the same contexts
+    self._context_compressor = ContextCompressor(max_tokens=self._max_token)
 
   ######## SETUP ########
 
@@ -44,9 +77,12 @@ class Model():
     """
     Config the performance of the model
     """
+    if (config_data[1] != self._top_k or config_data[2] != self._max_token):
+      self.refresh_retrieval_cache()
     self._temperature = config_data[0]
     self._top_k = config_data[1]
     self._max_token = config_data[2]
+    self._context_compressor.max_tokens = self._max_token
     self._max_iteration = config_data[3]
     self.display_config()
 
@@ -64,9 +100,16 @@ class Model():
     self.llm_model = OpenAI(model=self._llm_model_name,
                             api_key=os.getenv("OPENAI_API_KEY"),
                             temperature=self._temperature,
-                            system_prompt=system_prompt)
-    self.embed_model  = OpenAIEmbedding(model=self._embed_model_name,
-                                        api_key=os.getenv("OPENAI_API_KEY"))
+                            system_prompt=system_prompt,
+                            reuse_client=self._reuse_client)
+    # Bulk embedding of the corpus (ingestion, labelling) bypasses the embedding cache,
+    # so it does not evict the cached queries, nor fill the on-disk store and the statistics
+    self.corpus_embed_model = OpenAIEmbedding(model=self._embed_model_name,
+                                              api_key=os.getenv("OPENAI_API_KEY"),
+                                              reuse_client=self._reuse_client)
+    self.embed_model  = CachedEmbedding(self.corpus_embed_model, self._embedding_cache)
+    # Cached query engines hold the previous llm_model and embed_model
+    self.refresh_retrieval_cache()
     print(f"[MODEL SET] Model is set with llm_model: {self._llm_model_name} and embed_model: {self._embed_model_name}")
 
   ######## PRIVATE ########
@@ -91,7 +134,7 @@ class Model():
       self._tools[tool_user_id] = [tool]
   
 
-  def _setup_tool(self, query_engine, metadata_name, metadata_description, tool_user_id: str) -> None:
+  def _setup_tool(self, query_engine, metadata_name, metadata_description, tool_user_id: str) -> QueryEngineTool:
     """
     Setup tools for agentic system and query engine
     """
@@ -101,8 +144,52 @@ class Model():
       metadata=metadata
     )
     self._add_tool(tool_user_id, tool)
+    return tool
+
+
+  async def _retrieve_nodes(self, query: str, tools: list) -> Optional[list[tuple[str, object]]]:
+    """
+    Retrieve the nodes of all the tools concurrently, without LLM synthesis.
+    The query is embedded once and shared by all the retrievers.
+    Nodes are deduplicated and ranked by reciprocal rank fusion, as the scores of the tools are not comparable,
+    then compressed (see ContextCompressor)
+    Returning format: list of (tool name, node), None if there is no tool to retrieve from
+    """
+    retriever_tools = [tool for tool in tools if hasattr(tool.query_engine, "retriever")]
+    if (len(retriever_tools) == 0):
+      return None
+    query_bundle = QueryBundle(query_str=query, embedding=await self.embed_model.aget_query_embedding(query))
+    # Vector stores query synchronously, so each retrieval runs in its own thread
+    results = await asyncio.gather(*[asyncio.to_thread(tool.query_engine.retriever.retrieve, query_bundle) for tool in retriever_tools])
+
+    nodes = {}
+    scores = {}
+    for tool, tool_nodes in zip(retriever_tools, results):
+      for rank, node in enumerate(tool_nodes):
+        # Same document in several namespaces (or chunks) is keyed by its content
+        key = node.node.get_content().strip()
+        nodes.setdefault(key, (tool.metadata.name, node.node))
+        scores[key] = scores.get(key, 0.0) + 1 / (self._rrf_k + rank + 1)
+    ranked_keys = sorted(scores.keys(), key=lambda key: scores[key], reverse=True)
+    tool_names = {nodes[key][1].node_id: nodes[key][0] for key in ranked_keys}
+    compressed_nodes = self._context_compressor.postprocess_nodes([NodeWithScore(node=nodes[key][1], score=scores[key]) for key in ranked_keys])
+    return [(tool_names[node.node.node_id], node.node) for node in compressed_nodes[:self._max_retrieved_nodes]]
 
 
+  def _construct_retrieved_prompt(self, prompt: str, retrieved_nodes: Optional[list[tuple[str, object]]]) -> str:
+    """
+    Append the retrieved documents to the prompt, replacing the tool calls.
+    The prompt is unchanged if no tool was retrieved from (e.g. a general chat)
+    """
+    if (retrieved_nodes is None):
+      return prompt
+    if (len(retrieved_nodes) == 0):
+      return prompt + "\n\nThe tools have been used for you, but no related documents are found. Answer with what you know, and be honest if you are unsure.\n"
+    documents = "\n".join([f"Document {i+1} (from {tool_name}): {node.get_content()}" for i, (tool_name, node) in enumerate(retrieved_nodes)])
+    return prompt + "\n\nThe tools have been used for you, here are the retrieved documents:\n" \
+                    f"---------------------\n{documents}\n---------------------\n" \
+                    "Answer the query based on the retrieved documents. Do not make up facts that are not in the documents.\n"
+
   ######## PUBLIC ########
 
   def get_config(self) -> dict:
@@ -132,6 +219,47 @@ class Model():
         print(f"[REFRESH TOOLS] Tools list has been refreshed for {tool_user_id}")
 
 
+  def refresh_retrieval_cache(self) -> None:
+    """
+    Reset query engines and tools that has been cached before
+    """
+    self._query_engine_cache = {}
+    self._tool_cache = {}
+    print(f"[REFRESH RETRIEVAL CACHE] Cached query engines and tools have been refreshed")
+
+
+  def _is_missing_keyword_index(self, query_engine, namespace: str) -> bool:
+    """
+    Check if the query engine was constructed before the keyword index of its namespace was available,
+    so it has to be reconstructed as hybrid
+    """
+    return (self._keyword_index is not None 
+            and not isinstance(query_engine.retriever, HybridRetriever) 
+            and self._keyword_index.is_namespace_indexed(namespace))
+
+
+  def get_cached_query_engine(self, namespace: str, top_k: int):
+    """
+    Return cached query engine for certain namespace, None if it has not been constructed (or is outdated)
+    """
+    query_engine = self._query_engine_cache.get((namespace, top_k), None)
+    if (query_engine is not None and self._is_missing_keyword_index(query_engine, namespace)):
+      return None
+    return query_engine
+
+
+  def load_cached_tool(self, namespace: str, metadata_name: str, metadata_description: str, tool_user_id: str) -> bool:
+    """
+    Register cached tool for certain namespace to the tool_user_id tools.
+    Returns False if the tool has not been constructed
+    """
+    tool = self._tool_cache.get((namespace, metadata_name, metadata_description), None)
+    if (tool is None or self._is_missing_keyword_index(tool.query_engine, namespace)):
+      return False
+    self._add_tool(tool_user_id, tool)
+    return True
+
+
   def display_tools_count(self) -> None:
     """
     Display all tools
@@ -152,28 +280,43 @@ class Model():
     print(f"Top K: {self._top_k}")
     print(f"Max Token: {self._max_token}")
     print(f"Max Iteration: {self._max_iteration}")
+    print(f"Answer Mode: {self._answer_mode}")
 
 
   def construct_retrieval_system( self, 
                                   vector_store, 
                                   storage_context,
-                                  top_k : int):
+                                  top_k : int,
+                                  namespace: Optional[str] = None):
       """
       Returns query engine as retrieval system
+      If namespace is given, the query engine is cached and reused for the same namespace and top_k.
+      If the namespace has a keyword index, the vector search results are fused with the keyword search results
       """
+      if (namespace is not None):
+        query_engine = self.get_cached_query_engine(namespace, top_k)
+        if (query_engine is not None):
+          return query_engine
+
       vector_index = VectorStoreIndex.from_vector_store(
         vector_store=vector_store, 
         storage_context=storage_context, 
         embed_model=self.embed_model
       )
-      query_engine = vector_index.as_query_engine(
+      retriever = vector_index.as_retriever(similarity_top_k=top_k)
+      if (namespace is not None and self._keyword_index is not None and self._keyword_index.is_namespace_indexed(namespace)):
+        retriever = HybridRetriever(retriever, self._keyword_index, namespace, top_k)
+      query_engine = RetrieverQueryEngine.from_args(
+        retriever,
         llm=self.llm_model,
         embed_model=self.embed_model,
-        similarity_top_k=top_k,
         llm_kwargs={"max_tokens": self._max_token},
+        node_postprocessors=[self._context_compressor],
         response_mode="compact",
         return_source_nodes=True
       )
+      if (namespace is not None):
+        self._query_engine_cache[(namespace, top_k)] = query_engine
       return query_engine
     
 
@@ -182,12 +325,16 @@ class Model():
                       storage_context, 
                       metadata_name, 
                       metadata_description, 
-                      tool_user_id: str):
+                      tool_user_id: str,
+                      namespace: Optional[str] = None):
       """
       Load data from pinecone based on the vector store and storage_context
+      If namespace is given, the constructed tool is cached and reused for the same namespace
       """
-      query_engine = self.construct_retrieval_system(vector_store, storage_context, self._top_k)
-      self._setup_tool(query_engine, metadata_name, metadata_description, tool_user_id)
+      query_engine = self.construct_retrieval_system(vector_store, storage_context, self._top_k, namespace)
+      tool = self._setup_tool(query_engine, metadata_name, metadata_description, tool_user_id)
+      if (namespace is not None):
+        self._tool_cache[(namespace, metadata_name, metadata_description)] = tool
 
 
   async def answer(self, 
@@ -196,16 +343,32 @@ class Model():
                    verbose: bool = True,
                    allow_direct_answer: bool = True,
                    tool_user_id: str = "",
+                   mode: Optional[str] = None,
+                   query: Optional[str] = None,
                   ) -> Tuple[Optional[str], Optional[list]]:
     """
     Answer the prompt using the llm_model or agentic system
     If is_direct is True, it will use the llm_model directly.
+    Otherwise, mode is the answer mode of the agentic system (see ANSWER_MODES), defaults to the configured one.
+    query is the text to retrieve with in retrieve mode, defaults to the prompt
     """
+    mode = mode or self._answer_mode
+    if (mode not in self.ANSWER_MODES):
+      raise Exception(f"Unknown answer mode: {mode}. Available modes: {self.ANSWER_MODES}")
     try:
       if (is_direct):
          response = await self.llm_model.acomplete(prompt)
          result = response.text
          return result, None
+      elif (mode == "retrieve"):
+        tools = self._tools.get(tool_user_id, [])
+        retrieved_nodes = await self._retrieve_nodes(query or prompt, tools)
+        if (verbose):
+          print(f"[MODEL ANSWER RETRIEVE] Retrieved {len(retrieved_nodes or [])} nodes from {len(tools)} tools")
+        response = await self.llm_model.acomplete(self._construct_retrieved_prompt(prompt, retrieved_nodes), max_tokens=self._max_token)
+        result = response.text
+        contexts = [node.get_content() for _, node in retrieved_nodes or []]
+        return result, contexts
       else:
         tools = self._tools.get(tool_user_id, [])
         agent = ReActAgent.from_tools(
@@ -217,7 +380,8 @@ class Model():
         )
         response = await agent.aquery(prompt)
         result = response.response
-        contexts = [node.node.text for node in response.source_nodes]
+        # Source nodes are already compressed by each tool before its synthesis, they are the contexts the answer is built from
+        contexts = [node.node.get_content() for node in response.source_nodes]
         return result, contexts
     except Exception as e:
       print(f"[ERROR MODEL ANSWER] Error occured while processing answer: {e}")
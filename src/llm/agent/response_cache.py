@@ -0,0 +1,100 @@
+import numpy as np
+import threading
+import time
+from typing import Optional
+
+
+class ResponseCache():
+  """
+  Semantic cache of chat answers that have passed the evaluation.
+  Answers are keyed by the message embedding and scoped (e.g. per user and persona),
+  so a new message that is similar enough to a cached one can reuse its answer
+  """
+
+  # Minimum cosine similarity for a message to reuse a cached answer
+  _similarity_threshold: float = 0.95
+  # Time to live (in seconds) of a cached answer
+  _ttl: int = 6 * 60 * 60
+  # Max cached answers for each scope
+  _max_entries_per_scope: int = 500
+
+  def __init__(self):
+    """
+    Use dictionary as cache store, each scope holds a list of entries
+    """
+    self._entries: dict = {}
+    self._lock = threading.Lock()
+    # Statistics
+    self.hits = 0
+    self.misses = 0
+
+  ######## PRIVATE ########
+
+  def _normalize(self, embedding: list[float]) -> np.ndarray:
+    """
+    Normalize embedding so the dot product is the cosine similarity
+    """
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+  def _remove_expired(self, scope: str) -> None:
+    """
+    Remove expired entries of the scope
+    """
+    current_time = time.monotonic()
+    self._entries[scope] = [entry for entry in self._entries.get(scope, [])
+                            if current_time - entry["created_at"] <= self._ttl]
+
+  ######## PUBLIC ########
+
+  def lookup(self, scope: str, embedding: list[float]) -> Optional[str]:
+    """
+    Return the cached answer of the most similar message in the scope, None if nothing is similar enough
+    """
+    with self._lock:
+      self._remove_expired(scope)
+      entries = self._entries[scope]
+      if (len(entries) == 0):
+        self.misses += 1
+        return None
+
+      query_vector = self._normalize(embedding)
+      similarities = np.stack([entry["embedding"] for entry in entries]) @ query_vector
+      best_idx = int(np.argmax(similarities))
+      if (similarities[best_idx] < self._similarity_threshold):
+        self.misses += 1
+        return None
+
+      self.hits += 1
+      print(f"[RESPONSE CACHE HIT] Similarity {round(float(similarities[best_idx]), 4)} with cached message: {entries[best_idx]['message']}")
+      return entries[best_idx]["answer"]
+
+
+  def store(self, scope: str, embedding: list[float], message: str, answer: str) -> None:
+    """
+    Store an answer to the scope, dropping the oldest entry if the scope is full
+    """
+    with self._lock:
+      self._remove_expired(scope)
+      self._entries[scope].append({
+        "embedding": self._normalize(embedding),
+        "message": message,
+        "answer": answer,
+        "created_at": time.monotonic()
+      })
+      if (len(self._entries[scope]) > self._max_entries_per_scope):
+        self._entries[scope].pop(0)
+
+
+  def get_stats(self) -> dict:
+    """
+    Return hit and miss counters
+    """
+    with self._lock:
+      return {
+        "hits": self.hits,
+        "misses": self.misses,
+        "size": sum([len(entries) for entries in self._entries.values()]),
+      }
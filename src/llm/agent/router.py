@@ -0,0 +1,243 @@
+from datetime import datetime, timezone, timedelta
+from typing import Optional
+import re
+import threading
+
+from utils.function import get_province_from_location
+
+
+class ProvinceRouter():
+  """
+  Local router of tourism messages: detects the province (ntt, ntb) and the entity type (hotel, attraction) of a message,
+  so only the namespaces that matter are loaded as RAG tools.
+  Provinces are detected with a gazetteer of place names (from the hotel and attraction locations) and of hotel and attraction names,
+  entity types with keywords and the matched names. Recent messages are used when the message itself has no signal.
+  Ambiguous messages fall back to fan-out (all provinces and entity types).
+  The gazetteer is built in the background, from the start and then every _gazetteer_ttl, so the chat requests never scan the collections.
+  Until the first build is done, only the seed place names are used
+  """
+
+  _provinces: list = ["ntt", "ntb"]
+  _entity_types: list = ["hotel", "attraction"]
+  # Seed place names, completed by the gazetteer
+  _province_aliases: dict = {
+    "ntt": ["ntt", "nusa tenggara timur", "east nusa tenggara", "flores", "sumba", "timor", "alor", "rote", "labuan bajo", "komodo", "kupang"],
+    "ntb": ["ntb", "nusa tenggara barat", "west nusa tenggara", "lombok", "sumbawa", "mataram", "gili", "senggigi", "rinjani", "bima"],
+  }
+  _entity_type_keywords: dict = {
+    "hotel": ["hotel", "hotels", "resort", "villa", "homestay", "hostel", "inn", "penginapan", "menginap", "nginap", "kamar", "room", "stay",
+              "losmen", "guesthouse", "cottage", "bungalow", "check", "checkin", "checkout"],
+    "attraction": ["wisata", "pantai", "beach", "pulau", "island", "gunung", "mountain", "danau", "lake", "terjun", "waterfall", "destinasi",
+                   "destination", "attraction", "museum", "bukit", "hill", "snorkeling", "diving", "trekking", "tour", "trip", "jalan", "liburan",
+                   "taman", "park", "goa", "cave", "desa", "village", "kampung"],
+  }
+  # Hotel recommendations come from the association rules
+  _recommendation_keywords: list = ["rekomendasi", "recommend", "recommendation", "rekomen", "saran", "suggest", "mirip", "similar", "selain", "alternatif", "alternative"]
+  # Words that do not identify a place or a name
+  _stopwords: set = set(["indonesia", "kabupaten", "kab", "kota", "kecamatan", "kec", "desa", "kelurahan", "jalan", "jl", "jln", "no", "rt", "rw",
+                         "the", "a", "an", "of", "and", "at", "by", "di", "dan", "yang", "ke"])
+  # Place names are kept if this ratio of their occurrences is in one province
+  _min_place_purity: float = 0.9
+  # Recent messages used when the message has no signal
+  _memory_window: int = 4
+  _max_ngram: int = 5
+  # Gazetteer is rebuilt after this age, so new hotels and attractions are picked up
+  _gazetteer_ttl: timedelta = timedelta(days=1)
+
+  def __init__(self, mongo_connector: object):
+    """
+    Start building the gazetteer in the background, the seed place names are used meanwhile
+    """
+    self._mongo_connector = mongo_connector
+    self._generic_tokens = self._stopwords.union(*[set(keywords) for keywords in self._entity_type_keywords.values()])
+    # Phrase -> {"provinces": set, "entity_types": set}
+    self._gazetteer: dict = self._build_seed_gazetteer()
+    self._built_at: Optional[datetime] = None
+    self._lock = threading.Lock()
+    self._is_building = False
+    self._build_in_background()
+
+  ######## PRIVATE ########
+
+  def _tokenize(self, text: str) -> list[str]:
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+  def _normalize(self, text: str) -> str:
+    return " ".join([token for token in self._tokenize(text) if token not in self._stopwords])
+
+
+  def _add_entry(self, gazetteer: dict, phrase: str, province: Optional[str] = None, entity_type: Optional[str] = None) -> None:
+    """
+    Add the phrase to the gazetteer, unless it is too short or generic (e.g. a property named "The Homestay"),
+    which would pin every message containing it to one province
+    """
+    if (len(phrase) < 3 or all([token in self._generic_tokens for token in phrase.split()])):
+      return
+    entry = gazetteer.setdefault(phrase, {"provinces": set(), "entity_types": set()})
+    if (province is not None):
+      entry["provinces"].add(province)
+    if (entity_type is not None):
+      entry["entity_types"].add(entity_type)
+
+
+  def _build_seed_gazetteer(self) -> dict:
+    """
+    Build the gazetteer of the province aliases
+    """
+    gazetteer = {}
+    for province, aliases in self._province_aliases.items():
+      for alias in aliases:
+        self._add_entry(gazetteer, alias, province=province)
+    return gazetteer
+
+
+  def _build_gazetteer(self) -> dict:
+    """
+    Build the gazetteer from the province aliases, the parts of the hotel and attraction locations, and their names
+    """
+    gazetteer = self._build_seed_gazetteer()
+
+    sources = [
+      ("hotel", "hotel-v2", {"name": 1, "title": 1, "location": 1}),
+      ("attraction", "objek-wisata-v2", {"title": 1, "locationText": 1, "location": 1}),
+    ]
+    place_provinces = {}
+    for entity_type, collection_name, projection in sources:
+      for document in self._mongo_connector.get_data(collection_name, {}, projection):
+        location = document.get("locationText") or document.get("location")
+        if (not isinstance(location, str)):
+          continue
+        province = get_province_from_location(location, is_verbose=False)
+        if (province is None):
+          continue
+
+        # Location parts (village, district, regency, city) are place names
+        for part in location.split(","):
+          place = self._normalize(part)
+          if (place and not any([char.isdigit() for char in place])):
+            place_provinces.setdefault(place, {}).setdefault(province, 0)
+            place_provinces[place][province] += 1
+
+        name = document.get("name") or document.get("title")
+        if (isinstance(name, str)):
+          self._add_entry(gazetteer, self._normalize(name), province=province, entity_type=entity_type)
+          # Name without the type words (e.g. "tanto" of "tanto hotel"), only if it is specific enough
+          core_tokens = [token for token in self._normalize(name).split() if token not in self._entity_type_keywords[entity_type]]
+          if (len(core_tokens) >= 2):
+            self._add_entry(gazetteer, " ".join(core_tokens), province=province, entity_type=entity_type)
+
+    for place, province_counts in place_provinces.items():
+      total = sum(province_counts.values())
+      for province, count in province_counts.items():
+        if (count / total >= self._min_place_purity):
+          self._add_entry(gazetteer, place, province=province)
+
+    print(f"[PROVINCE ROUTER] Gazetteer is built with {len(gazetteer)} phrases")
+    return gazetteer
+
+
+  def _rebuild(self) -> None:
+    try:
+      gazetteer = self._build_gazetteer()
+      with self._lock:
+        self._gazetteer = gazetteer
+        self._built_at = datetime.now(timezone.utc)
+    except Exception as e:
+      print(f"[ERROR PROVINCE ROUTER] Error occured while building the gazetteer: {e}")
+    finally:
+      self._is_building = False
+
+
+  def _build_in_background(self) -> None:
+    """
+    Build the gazetteer on a background thread, unless a build is already running
+    """
+    with self._lock:
+      if (self._is_building):
+        return
+      self._is_building = True
+    threading.Thread(target=self._rebuild, name="province-router", daemon=True).start()
+
+
+  def _get_gazetteer(self) -> dict:
+    """
+    Return the current gazetteer, a missing (e.g. failed build) or expired one is rebuilt in the background meanwhile
+    """
+    if (self._built_at is None or datetime.now(timezone.utc) - self._built_at > self._gazetteer_ttl):
+      self._build_in_background()
+    return self._gazetteer
+
+
+  def _detect(self, text: str) -> tuple[set, set, bool]:
+    """
+    Detect the provinces, the entity types, and the recommendation intent of a text
+    """
+    gazetteer = self._get_gazetteer()
+    tokens = self._tokenize(text)
+    provinces = set()
+    entity_types = set()
+    for n in range(1, self._max_ngram + 1):
+      for i in range(len(tokens) - n + 1):
+        entry = gazetteer.get(" ".join(tokens[i : i + n]))
+        if (entry is not None):
+          provinces |= entry["provinces"]
+          entity_types |= entry["entity_types"]
+
+    token_set = set(tokens)
+    for entity_type, keywords in self._entity_type_keywords.items():
+      if (token_set & set(keywords)):
+        entity_types.add(entity_type)
+    is_recommendation = len(token_set & set(self._recommendation_keywords)) > 0
+    return provinces, entity_types, is_recommendation
+
+  ######## PUBLIC ########
+
+  def route(self, message: str, previous_messages: list[dict] = []) -> dict:
+    """
+    Route the message to the namespaces to load.
+    See the Class Memory for the template of the previous messages
+    Returning format:
+    {
+      provinces: list of province,
+      entity_types: list of entity type,
+      namespaces: list of namespace,
+      is_fanout: bool, True if neither the province nor the entity type is determined
+    }
+    """
+    provinces, entity_types, is_recommendation = self._detect(message)
+
+    # Use the recent user messages for what the message does not tell, e.g. "how much is it?"
+    if (len(provinces) == 0 or len(entity_types) == 0):
+      recent_messages = [previous_message['content'] for previous_message in previous_messages if previous_message['role'] == "user"]
+      for recent_message in reversed(recent_messages[-self._memory_window:]):
+        recent_provinces, recent_entity_types, _ = self._detect(recent_message)
+        if (len(provinces) == 0 and len(recent_provinces) > 0):
+          provinces = recent_provinces
+        if (len(entity_types) == 0 and len(recent_entity_types) > 0):
+          entity_types = recent_entity_types
+        if (len(provinces) > 0 and len(entity_types) > 0):
+          break
+
+    # Fan out what is still undetermined
+    provinces = [province for province in self._provinces if province in provinces] or list(self._provinces)
+    entity_types = [entity_type for entity_type in self._entity_types if entity_type in entity_types] or list(self._entity_types)
+    is_fanout = len(provinces) == len(self._provinces) and len(entity_types) == len(self._entity_types)
+
+    namespaces = []
+    for province in provinces:
+      if ("hotel" in entity_types):
+        namespaces.append(f"hotels_{province}")
+      if ("attraction" in entity_types):
+        namespaces.append(f"tourist_attractions_{province}")
+    if (is_fanout or ("hotel" in entity_types and is_recommendation)):
+      namespaces.append("association_rules")
+
+    return {"provinces": provinces, "entity_types": entity_types, "namespaces": namespaces, "is_fanout": is_fanout}
+
+
+  def refresh(self) -> None:
+    """
+    Rebuild the gazetteer in the background, e.g. after new hotels or attractions are ingested
+    """
+    self._build_in_background()
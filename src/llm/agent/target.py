@@ -0,0 +1,165 @@
+from collections import deque
+from datetime import datetime, timezone, timedelta
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from typing import Optional
+import threading
+
+
+class TargetSelector():
+  """
+  Target selection index for the actions (like, comment, follow).
+  Holds a ready queue of unengaged targets for each (user_id, action, community_id), so picking a target is O(1).
+  Queues are built once from the community and the engagements, updated as actions succeed,
+  and persisted in Mongo so they survive restarts
+  """
+
+  _collection_name: str = "target_queues"
+  # Queues are unique on these fields
+  _queue_index_keys: list = [("user_id", 1), ("action", 1), ("community_id", 1)]
+  # Array in the community document that holds the targets of each action, and the fields kept in the queue
+  _target_arrays: dict = {
+    "like": ("posts", ["id"]),
+    "comment": ("posts", ["id"]),
+    "follow": ("influencers", ["id", "username"]),
+  }
+  # Queues are rebuilt after this age, so new posts and influencers of the community are picked up
+  _queue_ttl: timedelta = timedelta(days=1)
+
+  def __init__(self, mongo_connector: object):
+    """
+    Queues are loaded lazily, keyed by (user_id, action, community_id)
+    """
+    self._mongo_connector = mongo_connector
+    self._queues: dict = {}
+    self._lock = threading.Lock()
+    self._is_index_ensured = False
+
+  ######## PRIVATE ########
+
+  def _queue_filter(self, user_id: str, action: str, community_id: int) -> dict:
+    """
+    Return the filter of the persisted queue
+    """
+    return {"user_id": str(user_id), "action": action, "community_id": community_id}
+
+
+  def _ensure_index(self) -> None:
+    """
+    Create the unique index of the queues if it does not exist, so a queue is loaded by an index lookup and persisted once.
+    Queues can be rebuilt, so duplicated queues (persisted before the index) that prevent it are dropped
+    """
+    if (self._is_index_ensured):
+      return
+    try:
+      self._mongo_connector.create_index(self._collection_name, self._queue_index_keys, unique=True)
+    except OperationFailure as e:
+      if (e.code != 11000):
+        raise
+      print(f"[TARGET QUEUE INDEX] Duplicated queues are dropped to create the unique index: {e}")
+      self._mongo_connector.delete_many_data(self._collection_name, {})
+      self._mongo_connector.create_index(self._collection_name, self._queue_index_keys, unique=True)
+    self._is_index_ensured = True
+
+
+  def _is_expired(self, built_at: datetime) -> bool:
+    """
+    Check if the queue built at built_at should be rebuilt
+    """
+    if (built_at.tzinfo is None):
+      built_at = built_at.replace(tzinfo=timezone.utc)
+    return datetime.now(timezone.utc) - built_at > self._queue_ttl
+
+
+  def _build_queue(self, user_id: str, action: str, community_id: int) -> tuple[deque, datetime]:
+    """
+    Build the queue of targets in the community that user_id has not engaged with, and persist it
+    """
+    array_field, fields = self._target_arrays[action]
+    projection = {f"{array_field}.{field}": 1 for field in fields}
+    communities = self._mongo_connector.get_data("communities", {"community_id": community_id}, projection)
+    targets = communities[0].get(array_field, []) if len(communities) > 0 else []
+
+    engagements = self._mongo_connector.get_data("engagements", self._queue_filter(user_id, action, community_id), {"target_id": 1})
+    engaged_target_ids = set([engagement['target_id'] for engagement in engagements])
+
+    queue = deque([{field: target[field] for field in fields}
+                   for target in targets if target['id'] not in engaged_target_ids])
+    built_at = datetime.now(timezone.utc)
+    try:
+      self._mongo_connector.upsert_one_data(self._collection_name,
+                                            self._queue_filter(user_id, action, community_id),
+                                            {"targets": list(queue), "built_at": built_at})
+    except DuplicateKeyError:
+      # A concurrent build inserted the queue first, it is updated instead
+      self._mongo_connector.update_one_data(self._collection_name,
+                                            self._queue_filter(user_id, action, community_id),
+                                            {"targets": list(queue), "built_at": built_at})
+    print(f"[TARGET QUEUE BUILT] {len(queue)} targets to {action} in community {community_id} for user_id {user_id}")
+    return queue, built_at
+
+
+  def _get_queue(self, user_id: str, action: str, community_id: int) -> deque:
+    """
+    Return the queue from memory, from Mongo if it is not loaded, or build it if it is not persisted or is expired
+    """
+    key = (str(user_id), action, community_id)
+    with self._lock:
+      queue, built_at = self._queues.get(key, (None, None))
+    if (queue is not None and not self._is_expired(built_at)):
+      return queue
+
+    self._ensure_index()
+    documents = self._mongo_connector.get_data(self._collection_name, self._queue_filter(user_id, action, community_id))
+    if (len(documents) > 0 and not self._is_expired(documents[0]['built_at'])):
+      queue, built_at = deque(documents[0]['targets']), documents[0]['built_at']
+    else:
+      queue, built_at = self._build_queue(user_id, action, community_id)
+
+    with self._lock:
+      self._queues[key] = (queue, built_at)
+    return queue
+
+  ######## PUBLIC ########
+
+  def next_target(self, user_id: str, action: str, community_ids: list[int]) -> Optional[dict]:
+    """
+    Return the next target to do action on, in the order of community_ids.
+    The target stays in the queue until it is marked as done
+    Returning format:
+    {
+      community_id: int,
+      target: dict
+    }
+    None if there is no target left
+    """
+    for community_id in community_ids:
+      queue = self._get_queue(user_id, action, community_id)
+      if (len(queue) > 0):
+        return {"community_id": community_id, "target": queue[0]}
+    return None
+
+
+  def mark_done(self, user_id: str, action: str, community_id: int, target_id) -> None:
+    """
+    Remove the target from the queue after the action succeeds, and mark the engagement
+    """
+    queue = self._get_queue(user_id, action, community_id)
+    with self._lock:
+      if (len(queue) > 0 and queue[0]['id'] == target_id):
+        queue.popleft()
+      else:
+        for target in list(queue):
+          if (target['id'] == target_id):
+            queue.remove(target)
+    self._mongo_connector.pull_from_array(self._collection_name,
+                                          self._queue_filter(user_id, action, community_id),
+                                          "targets", {"id": target_id})
+    self._mongo_connector.mark_engagement(user_id, action, target_id, community_id)
+
+
+  def refresh(self) -> None:
+    """
+    Drop the loaded queues, so they are reloaded from Mongo
+    """
+    with self._lock:
+      self._queues = {}
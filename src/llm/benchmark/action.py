@@ -0,0 +1,87 @@
+"""
+Microbenchmark of the action decision: the previous hmmlearn implementation (one CategoricalHMM per iteration)
+against the batched NumPy Viterbi of ActionGenerator.
+Both decode a most likely path, but equally likely paths (exact ties, which these probabilities produce) may be
+broken differently, as the prefix scans of the NumPy Viterbi sum the log probabilities in another order than hmmlearn.
+So the log probability of the decoded paths is compared instead of the whole sequences, and the final states
+(which decide the actions) that differ, always between equally likely paths, are counted.
+
+Run from src/llm:
+  python -m benchmark.action --lengths 10 100 1000 --repeat 20
+"""
+from generator.action import ActionGenerator
+from hmmlearn.hmm import CategoricalHMM
+import argparse
+import contextlib
+import io
+import numpy as np
+import random
+import time
+
+
+def hmmlearn_state_sequences(action_generator: ActionGenerator, obs_idx: np.ndarray, n_iterations: int) -> np.ndarray:
+  """
+  Decode the state sequence of each iteration the way it was done before, with one CategoricalHMM per iteration
+  """
+  state_sequences = []
+  for iteration in range(n_iterations):
+    model = CategoricalHMM(n_components=len(action_generator.hidden_states), n_iter=100, random_state=42)
+    model.startprob_ = action_generator.START_PROB
+    model.transmat_ = action_generator._transition_matrix(iteration)
+    model.emissionprob_ = action_generator.EMISSION_PROB
+    state_sequences.append(model.predict(obs_idx.reshape(-1, 1)))
+  return np.stack(state_sequences)
+
+
+def path_log_probability(action_generator: ActionGenerator, obs_idx: np.ndarray, transition_matrix: np.ndarray, state_sequence: np.ndarray) -> float:
+  """
+  Return the log probability of the observations and the state sequence
+  """
+  log_probability = np.log(action_generator.START_PROB[state_sequence[0]] * action_generator.EMISSION_PROB[state_sequence[0], obs_idx[0]])
+  for t in range(1, len(obs_idx)):
+    log_probability += np.log(transition_matrix[state_sequence[t - 1], state_sequence[t]] * action_generator.EMISSION_PROB[state_sequence[t], obs_idx[t]])
+  return log_probability
+
+
+def measure(function, repeat: int) -> float:
+  """
+  Return the average time (in milliseconds) of function
+  """
+  start_time = time.perf_counter()
+  for _ in range(repeat):
+    function()
+  return (time.perf_counter() - start_time) / repeat * 1000
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description="Benchmark hmmlearn and batched NumPy Viterbi action decision")
+  parser.add_argument("--lengths", type=int, nargs="+", default=[10, 100, 1000])
+  parser.add_argument("--iterations", type=int, default=5)
+  parser.add_argument("--repeat", type=int, default=20)
+  args = parser.parse_args()
+
+  action_generator = ActionGenerator()
+  for length in args.lengths:
+    observations = [random.choice(action_generator.observation_symbols[:3]) for _ in range(length - 1)]
+    observations.insert(0, "morning_time")
+    obs_idx = np.array([action_generator.observation_symbols.index(o) for o in observations])
+    transition_matrices = np.stack([action_generator._transition_matrix(iteration) for iteration in range(args.iterations)])
+
+    hmmlearn_sequences = hmmlearn_state_sequences(action_generator, obs_idx, args.iterations)
+    viterbi_sequences = action_generator.viterbi(obs_idx, transition_matrices)
+    is_optimal = all([np.isclose(path_log_probability(action_generator, obs_idx, transition_matrices[i], hmmlearn_sequences[i]),
+                                 path_log_probability(action_generator, obs_idx, transition_matrices[i], viterbi_sequences[i]))
+                      for i in range(args.iterations)])
+    n_tied_final_states = int((hmmlearn_sequences[:, -1] != viterbi_sequences[:, -1]).sum())
+    hmmlearn_time = measure(lambda: hmmlearn_state_sequences(action_generator, obs_idx, args.iterations), args.repeat)
+    viterbi_time = measure(lambda: action_generator.viterbi(obs_idx, transition_matrices), args.repeat)
+    # decide_actions also includes the mapping and the logging of the state sequences
+    with contextlib.redirect_stdout(io.StringIO()):
+      decide_actions_time = measure(lambda: action_generator.decide_actions(observations, args.iterations), args.repeat)
+    print(f"[BENCHMARK LENGTH {length}] hmmlearn: {hmmlearn_time:.3f} ms, batched viterbi: {viterbi_time:.3f} ms, "
+          f"decide_actions: {decide_actions_time:.3f} ms, speedup: {hmmlearn_time / viterbi_time:.1f}x, same path probability: {is_optimal}, "
+          f"tied final states broken differently: {n_tied_final_states}/{args.iterations}")
+
+
+if __name__ == "__main__":
+  main()
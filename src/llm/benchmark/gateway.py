@@ -0,0 +1,117 @@
+"""
+Benchmark of the input gateway serving modes (Flask vs ASGI) against a stubbed agent.
+The stubbed agent simulates the LLM latency with asyncio.sleep, so the benchmark only measures
+how well each serving mode overlaps concurrent requests.
+
+Run from src/llm:
+  python -m benchmark.gateway --requests 200 --concurrency 50 --latency 0.2
+"""
+from gateway.input import InputGateway
+from werkzeug.serving import make_server
+import argparse
+import asyncio
+import httpx
+import multiprocessing
+import socket
+import time
+import uvicorn
+
+
+class StubAgent():
+  """
+  Agent stub that answers chat after a fixed latency
+  """
+  def __init__(self, latency: float):
+    self._latency = latency
+
+  async def use_user(self, user_id: str) -> None:
+    return None
+
+  async def action_reply_chat(self, chat_message: str, sender_id: str) -> str:
+    await asyncio.sleep(self._latency)
+    return f"Reply to {sender_id}: {chat_message}"
+
+
+def serve_flask(host: str, port: int, latency: float) -> None:
+  """
+  Serve the Flask app on threaded werkzeug server
+  """
+  gateway = InputGateway(StubAgent(latency), host=host, port=port)
+  make_server(host, port, gateway.app, threaded=True).serve_forever()
+
+
+def serve_asgi(host: str, port: int, latency: float) -> None:
+  """
+  Serve the ASGI app on uvicorn
+  """
+  gateway = InputGateway(StubAgent(latency), host=host, port=port)
+  uvicorn.run(gateway.asgi_app, host=host, port=port, log_level="warning")
+
+
+def start_server(target, host: str, port: int, latency: float) -> multiprocessing.Process:
+  """
+  Start the server in its own process, so the load driver does not compete with it for the GIL
+  """
+  process = multiprocessing.Process(target=target, args=(host, port, latency), daemon=True)
+  process.start()
+  # Wait until the server accepts connections
+  while (True):
+    try:
+      socket.create_connection((host, port), timeout=0.5).close()
+      return process
+    except OSError:
+      time.sleep(0.1)
+
+
+async def drive_load(url: str, n_requests: int, concurrency: int) -> dict:
+  """
+  Send n_requests chat requests with the given concurrency, returning the throughput and latencies
+  """
+  semaphore = asyncio.Semaphore(concurrency)
+  latencies = []
+  errors = 0
+  # Werkzeug closes the connection after each request, so keep-alive is also disabled for uvicorn
+  limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=0)
+  async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+    async def send(i: int) -> None:
+      nonlocal errors
+      async with semaphore:
+        start_time = time.perf_counter()
+        response = await client.post(f"{url}/chat", json={"chat_message": f"Hello {i}", "sender_id": str(i), "user_id": "1"})
+        latencies.append(time.perf_counter() - start_time)
+        if (response.status_code != 200):
+          errors += 1
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*[send(i) for i in range(n_requests)])
+    elapsed_time = time.perf_counter() - start_time
+
+  latencies.sort()
+  return {
+    "requests_per_second": round(n_requests / elapsed_time, 2),
+    "p50_latency": round(latencies[len(latencies) // 2], 4),
+    "p95_latency": round(latencies[int(len(latencies) * 0.95) - 1], 4),
+    "errors": errors,
+  }
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description="Benchmark Flask and ASGI serving modes of the input gateway")
+  parser.add_argument("--requests", type=int, default=200)
+  parser.add_argument("--concurrency", type=int, default=50)
+  parser.add_argument("--latency", type=float, default=0.2, help="Simulated agent latency in seconds")
+  parser.add_argument("--host", type=str, default="127.0.0.1")
+  parser.add_argument("--port", type=int, default=8765)
+  args = parser.parse_args()
+
+  for mode, target in [("flask", serve_flask), ("asgi", serve_asgi)]:
+    process = start_server(target, args.host, args.port, args.latency)
+    try:
+      result = asyncio.run(drive_load(f"http://{args.host}:{args.port}", args.requests, args.concurrency))
+    finally:
+      process.terminate()
+      process.join()
+    print(f"[BENCHMARK {mode.upper()}] {result}")
+
+if __name__ == "__main__":
+  main()
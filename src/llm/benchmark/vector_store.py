@@ -0,0 +1,69 @@
+"""
+Microbenchmark of the local vector store: exact and approximate (IVF) search latency, and the recall of IVF against exact search.
+Vectors are synthetic clustered embeddings, so no embedding model or Pinecone index is needed.
+
+Run from src/llm:
+  python -m benchmark.vector_store --sizes 1000 10000 50000 --dim 1536
+"""
+from connector.local import LocalVectorStore
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores.types import VectorStoreQuery
+import argparse
+import contextlib
+import io
+import numpy as np
+import tempfile
+import time
+
+
+def make_vectors(rng: np.random.Generator, n_vectors: int, dim: int, n_clusters: int) -> np.ndarray:
+  """
+  Return clustered vectors, like embeddings of a corpus about a few topics
+  """
+  centers = rng.normal(size=(n_clusters, dim))
+  return (centers[rng.integers(0, n_clusters, n_vectors)] + 0.5 * rng.normal(size=(n_vectors, dim))).astype(np.float32)
+
+
+def search(vector_store: LocalVectorStore, queries: np.ndarray, top_k: int) -> tuple[list, float]:
+  """
+  Return the ids found for each query, and the average search time (in milliseconds)
+  """
+  ids = []
+  start_time = time.perf_counter()
+  for query in queries:
+    ids.append(vector_store.query(VectorStoreQuery(query_embedding=query.tolist(), similarity_top_k=top_k)).ids)
+  return ids, (time.perf_counter() - start_time) / len(queries) * 1000
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description="Benchmark exact and IVF search of the local vector store")
+  parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+  parser.add_argument("--dim", type=int, default=1536)
+  parser.add_argument("--queries", type=int, default=100)
+  parser.add_argument("--top-k", type=int, default=10)
+  args = parser.parse_args()
+
+  rng = np.random.default_rng(0)
+  for size in args.sizes:
+    vectors = make_vectors(rng, size, args.dim, n_clusters=max(1, size // 100))
+    queries = vectors[rng.integers(0, size, args.queries)] + 0.1 * rng.normal(size=(args.queries, args.dim))
+    with tempfile.TemporaryDirectory() as path:
+      vector_store = LocalVectorStore(path, search_mode="exact")
+      for start in range(0, size, 1000):
+        vector_store.add([TextNode(id_=str(i), text=str(i), embedding=vectors[i].tolist()) for i in range(start, min(size, start + 1000))])
+      exact_ids, exact_time = search(vector_store, queries, args.top_k)
+
+      vector_store = LocalVectorStore(path, search_mode="ivf")
+      with contextlib.redirect_stdout(io.StringIO()):
+        start_time = time.perf_counter()
+        vector_store.build_index()
+        build_time = time.perf_counter() - start_time
+      ivf_ids, ivf_time = search(vector_store, queries, args.top_k)
+
+    recall = np.mean([len(set(exact) & set(ivf)) / len(exact) for exact, ivf in zip(exact_ids, ivf_ids)])
+    print(f"[BENCHMARK SIZE {size}] exact: {exact_time:.3f} ms, ivf: {ivf_time:.3f} ms, "
+          f"ivf recall@{args.top_k}: {recall:.3f}, ivf build: {build_time:.2f} s")
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,219 @@
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle, TextNode
+from typing import List, Optional
+import json
+import math
+import os
+import re
+import threading
+
+from dotenv import load_dotenv
+load_dotenv()
+
+
+class KeywordIndex():
+  """
+  Local inverted keyword index with BM25 scoring, one index per namespace.
+  Complements the vector search for exact names (e.g. "Tanto Hotel"), whose rare terms are scored highly by BM25.
+  Each namespace is persisted as a JSON file of its node texts, keyed by the node IDs of the vector store,
+  and is reloaded when the file is changed by another process (e.g. process.py)
+  """
+
+  # BM25 parameters
+  _k1: float = 1.2
+  _b: float = 0.75
+
+  def __init__(self):
+    """
+    Instantiate the index directory, namespaces are loaded lazily
+    """
+    self._path = os.getenv("KEYWORD_INDEX_PATH") or "keyword_index"
+    os.makedirs(self._path, exist_ok=True)
+    # Per namespace: {"texts": {node_id: text}, "lengths": {node_id: n_terms}, "postings": {term: {node_id: tf}}, "total_length": int, "mtime": float}
+    self._namespaces: dict = {}
+    self._lock = threading.RLock()
+
+  ######## PRIVATE ########
+
+  def _tokenize(self, text: str) -> list[str]:
+    return re.findall(r"\w+", text.lower())
+
+
+  def _file(self, namespace: str) -> str:
+    return os.path.join(self._path, f"{namespace.replace(os.sep, '_')}.json")
+
+
+  def _new_namespace(self) -> dict:
+    return {"texts": {}, "lengths": {}, "postings": {}, "total_length": 0, "mtime": None}
+
+
+  def _add_text(self, index: dict, node_id: str, text: str) -> None:
+    if (node_id in index["texts"]):
+      self._remove_text(index, node_id)
+    terms = self._tokenize(text)
+    index["texts"][node_id] = text
+    index["lengths"][node_id] = len(terms)
+    index["total_length"] += len(terms)
+    term_frequencies = {}
+    for term in terms:
+      term_frequencies[term] = term_frequencies.get(term, 0) + 1
+    for term, frequency in term_frequencies.items():
+      index["postings"].setdefault(term, {})[node_id] = frequency
+
+
+  def _remove_text(self, index: dict, node_id: str) -> None:
+    text = index["texts"].pop(node_id, None)
+    if (text is None):
+      return
+    index["total_length"] -= index["lengths"].pop(node_id)
+    for term in set(self._tokenize(text)):
+      postings = index["postings"].get(term, {})
+      postings.pop(node_id, None)
+      if (len(postings) == 0):
+        index["postings"].pop(term, None)
+
+
+  def _get_namespace(self, namespace: str) -> Optional[dict]:
+    """
+    Return the index of the namespace, (re)loaded from its file if it is not loaded or the file has changed.
+    None if the namespace is not indexed
+    """
+    with self._lock:
+      index = self._namespaces.get(namespace)
+      try:
+        mtime = os.path.getmtime(self._file(namespace))
+      except FileNotFoundError:
+        return index
+      if (index is not None and index["mtime"] == mtime):
+        return index
+
+      with open(self._file(namespace), "r", encoding="utf-8") as f:
+        texts = json.load(f)
+      index = self._new_namespace()
+      for node_id, text in texts.items():
+        self._add_text(index, node_id, text)
+      index["mtime"] = mtime
+      self._namespaces[namespace] = index
+      return index
+
+  ######## PUBLIC ########
+
+  def is_namespace_indexed(self, namespace: str) -> bool:
+    """
+    Check if the namespace has a keyword index
+    """
+    return self._get_namespace(namespace) is not None
+
+
+  def add_nodes(self, nodes: list, namespace: str) -> None:
+    """
+    Add nodes to the index of the namespace, nodes with an existing ID replace it
+    """
+    with self._lock:
+      index = self._get_namespace(namespace)
+      if (index is None):
+        index = self._namespaces.setdefault(namespace, self._new_namespace())
+      for node in nodes:
+        self._add_text(index, node.node_id, node.get_content())
+
+
+  def delete_nodes(self, node_ids: list[str], namespace: str) -> None:
+    """
+    Delete nodes by their IDs from the index of the namespace
+    """
+    with self._lock:
+      index = self._get_namespace(namespace)
+      if (index is None):
+        return
+      for node_id in node_ids:
+        self._remove_text(index, node_id)
+
+
+  def save(self, namespace: str) -> None:
+    """
+    Persist the index of the namespace
+    """
+    with self._lock:
+      index = self._namespaces.get(namespace)
+      if (index is None):
+        return
+      with open(f"{self._file(namespace)}.tmp", "w", encoding="utf-8") as f:
+        json.dump(index["texts"], f)
+      os.replace(f"{self._file(namespace)}.tmp", self._file(namespace))
+      index["mtime"] = os.path.getmtime(self._file(namespace))
+      print(f"[KEYWORD INDEX SAVED] Saved {len(index['texts'])} nodes of {namespace}")
+
+
+  def search(self, namespace: str, query: str, top_k: int) -> list[tuple[str, str, float]]:
+    """
+    Return the top_k nodes of the namespace by BM25 score of the query
+    Returning format: list of (node_id, text, score)
+    """
+    with self._lock:
+      index = self._get_namespace(namespace)
+      if (index is None or len(index["texts"]) == 0):
+        return []
+      n_nodes = len(index["texts"])
+      average_length = index["total_length"] / n_nodes
+      scores = {}
+      for term in set(self._tokenize(query)):
+        postings = index["postings"].get(term)
+        if (postings is None):
+          continue
+        idf = math.log(1 + (n_nodes - len(postings) + 0.5) / (len(postings) + 0.5))
+        for node_id, frequency in postings.items():
+          length_norm = self._k1 * (1 - self._b + self._b * index["lengths"][node_id] / average_length)
+          scores[node_id] = scores.get(node_id, 0.0) + idf * frequency * (self._k1 + 1) / (frequency + length_norm)
+      top_node_ids = sorted(scores.keys(), key=lambda node_id: scores[node_id], reverse=True)[:top_k]
+      return [(node_id, index["texts"][node_id], scores[node_id]) for node_id in top_node_ids]
+
+
+class HybridRetriever(BaseRetriever):
+  """
+  Retriever that fuses the vector search results with the keyword search results by reciprocal rank fusion:
+  score(node) = sum of 1 / (rrf_k + rank) over the result lists it is in.
+  Nodes in both lists are ranked first, so a node that matches the exact name and the meaning of the query wins
+  """
+
+  # Dampens the weight of the top ranks, 60 is the usual constant
+  _rrf_k: int = 60
+
+  def __init__(self, vector_retriever: BaseRetriever, keyword_index: KeywordIndex, namespace: str, top_k: int):
+    super().__init__()
+    self.vector_retriever = vector_retriever
+    self._keyword_index = keyword_index
+    self._namespace = namespace
+    self._top_k = top_k
+
+
+  def fuse(self, vector_nodes: List[NodeWithScore], query: str) -> List[NodeWithScore]:
+    """
+    Fuse the vector search results with the keyword search results of the query, returns the top_k fused nodes
+    """
+    keyword_results = self._keyword_index.search(self._namespace, query, self._top_k)
+    nodes = {}
+    scores = {}
+    for rank, node in enumerate(vector_nodes):
+      nodes[node.node.node_id] = node.node
+      scores[node.node.node_id] = scores.get(node.node.node_id, 0.0) + 1 / (self._rrf_k + rank + 1)
+    for rank, (node_id, text, _) in enumerate(keyword_results):
+      nodes.setdefault(node_id, TextNode(id_=node_id, text=text))
+      scores[node_id] = scores.get(node_id, 0.0) + 1 / (self._rrf_k + rank + 1)
+    top_node_ids = sorted(scores.keys(), key=lambda node_id: scores[node_id], reverse=True)[:self._top_k]
+    return [NodeWithScore(node=nodes[node_id], score=scores[node_id]) for node_id in top_node_ids]
+
+
+  def retrieve_with_threshold(self, query: str, min_vector_score: float) -> List[NodeWithScore]:
+    """
+    Retrieve, only fusing the vector search results with at least min_vector_score similarity
+    """
+    vector_nodes = [node for node in self.vector_retriever.retrieve(query) if node.score >= min_vector_score]
+    return self.fuse(vector_nodes, query)
+
+
+  def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+    return self.fuse(self.vector_retriever.retrieve(query_bundle), query_bundle.query_str)
+
+
+  async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+    return self.fuse(await self.vector_retriever.aretrieve(query_bundle), query_bundle.query_str)
@@ -0,0 +1,467 @@
+from llama_index.core import StorageContext, VectorStoreIndex
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.types import (BasePydanticVectorStore,
+                                                  FilterCondition,
+                                                  FilterOperator,
+                                                  MetadataFilters,
+                                                  VectorStoreQuery,
+                                                  VectorStoreQueryResult)
+from llama_index.core.vector_stores.utils import node_to_metadata_dict, metadata_dict_to_node
+from pydantic import PrivateAttr
+from typing import Any, List, Optional, Sequence, Tuple
+import json
+import numpy as np
+import os
+import shutil
+import threading
+
+from dotenv import load_dotenv
+load_dotenv()
+
+
+class LocalVectorStore(BasePydanticVectorStore):
+  """
+  Vector store of one namespace, persisted in a local directory:
+  - vectors.f32: append-only float32 matrix of the normalized embeddings, memory-mapped for search
+  - nodes.jsonl: append-only log of the added and deleted nodes, replayed on load
+  - ivf.npz: inverted file index (k-means centroids and the rows of each list), for approximate search
+  Deleted and updated rows are tombstoned, and the files are compacted when there are too many of them.
+  Similarity is cosine, same as the Pinecone index
+  """
+
+  stores_text: bool = True
+  flat_metadata: bool = False
+
+  # Approximate search is used from this number of vectors, exact search below it
+  _ivf_min_vectors: int = 20000
+  # Lists probed in approximate search
+  _n_probe: int = 8
+  # Vectors sampled to train the k-means centroids, per list
+  _ivf_train_sample_per_list: int = 64
+  _ivf_train_iterations: int = 10
+  # The index is retrained when the rows added after the training exceed this ratio
+  _ivf_retrain_ratio: float = 0.1
+  # Files are compacted when the deleted rows exceed this ratio
+  _compact_ratio: float = 0.25
+
+  _path: str = PrivateAttr()
+  _search_mode: str = PrivateAttr()
+  _lock: Any = PrivateAttr()
+  _dim: Optional[int] = PrivateAttr(default=None)
+  _vectors: Optional[np.ndarray] = PrivateAttr(default=None)
+  _row_ids: list = PrivateAttr(default_factory=list)
+  _row_metadata: list = PrivateAttr(default_factory=list)
+  _id_to_row: dict = PrivateAttr(default_factory=dict)
+  _n_deleted: int = PrivateAttr(default=0)
+  _alive_mask: Optional[np.ndarray] = PrivateAttr(default=None)
+  _ivf: Optional[dict] = PrivateAttr(default=None)
+
+  def __init__(self, path: str, search_mode: str = "auto", **kwargs: Any):
+    """
+    Open the vector store in path. search_mode is "exact", "ivf", or "auto" (ivf from _ivf_min_vectors vectors)
+    """
+    super().__init__(**kwargs)
+    self._path = path
+    self._search_mode = search_mode
+    self._lock = threading.RLock()
+    os.makedirs(path, exist_ok=True)
+    self._load()
+
+
+  @classmethod
+  def class_name(cls) -> str:
+    return "LocalVectorStore"
+
+
+  @property
+  def client(self) -> Any:
+    return None
+
+  ######## FILES ########
+
+  def _file(self, name: str) -> str:
+    return os.path.join(self._path, name)
+
+
+  def _load(self) -> None:
+    """
+    Replay the node log and memory-map the vectors
+    """
+    self._row_ids, self._row_metadata, self._id_to_row, self._n_deleted = [], [], {}, 0
+    if (os.path.exists(self._file("nodes.jsonl"))):
+      with open(self._file("nodes.jsonl"), "r", encoding="utf-8") as f:
+        for line in f:
+          record = json.loads(line)
+          if (record["op"] == "add"):
+            self._dim = record["dim"]
+            self._append_row(record["id"], record["metadata"])
+          else:
+            self._delete_row(record["id"])
+    self._truncate_orphan_vectors()
+    self._map_vectors()
+
+    self._ivf = None
+    if (os.path.exists(self._file("ivf.npz"))):
+      with np.load(self._file("ivf.npz")) as ivf:
+        self._ivf = {key: ivf[key] for key in ivf.files}
+
+
+  def _truncate_orphan_vectors(self) -> None:
+    """
+    Truncate the vectors written without their log record (interrupted write),
+    so the next added rows are aligned with their log records
+    """
+    expected_size = len(self._row_ids) * (self._dim or 0) * np.dtype(np.float32).itemsize
+    if (os.path.exists(self._file("vectors.f32")) and os.path.getsize(self._file("vectors.f32")) > expected_size):
+      with open(self._file("vectors.f32"), "r+b") as f:
+        f.truncate(expected_size)
+      print(f"[LOCAL VECTOR STORE] Truncated orphan vectors of {self._path}")
+
+
+  def _map_vectors(self) -> None:
+    """
+    Memory-map the rows that are in the node log
+    """
+    n_rows = len(self._row_ids)
+    if (n_rows == 0 or self._dim is None):
+      self._vectors = None
+      return
+    self._vectors = np.memmap(self._file("vectors.f32"), dtype=np.float32, mode="r", shape=(n_rows, self._dim))
+
+
+  def _append_row(self, node_id: str, metadata: dict) -> None:
+    if (node_id in self._id_to_row):
+      self._delete_row(node_id)
+    self._id_to_row[node_id] = len(self._row_ids)
+    self._row_ids.append(node_id)
+    self._row_metadata.append(metadata)
+    self._alive_mask = None
+
+
+  def _delete_row(self, node_id: str) -> None:
+    row = self._id_to_row.pop(node_id, None)
+    if (row is not None):
+      self._row_ids[row] = None
+      self._row_metadata[row] = None
+      self._n_deleted += 1
+      self._alive_mask = None
+
+
+  def _get_alive_mask(self) -> np.ndarray:
+    """
+    Return the mask of the rows that are not deleted
+    """
+    if (self._alive_mask is None):
+      self._alive_mask = np.array([node_id is not None for node_id in self._row_ids], dtype=bool)
+    return self._alive_mask
+
+
+  def _write_delete_log(self, node_ids: list[str]) -> None:
+    with open(self._file("nodes.jsonl"), "a", encoding="utf-8") as f:
+      for node_id in node_ids:
+        if (node_id in self._id_to_row):
+          f.write(json.dumps({"op": "delete", "id": node_id}) + "\n")
+          self._delete_row(node_id)
+    self._compact_if_needed()
+
+
+  def _compact_if_needed(self) -> None:
+    """
+    Rewrite the files without the deleted rows, when there are too many of them
+    """
+    n_rows = len(self._row_ids)
+    if (n_rows == 0 or self._n_deleted <= self._compact_ratio * n_rows):
+      return
+    alive_rows = [row for row, node_id in enumerate(self._row_ids) if node_id is not None]
+    vectors = np.array(self._vectors[alive_rows]) if self._vectors is not None else np.empty((0, self._dim or 0), dtype=np.float32)
+    with open(self._file("vectors.f32.tmp"), "wb") as f:
+      vectors.tofile(f)
+    with open(self._file("nodes.jsonl.tmp"), "w", encoding="utf-8") as f:
+      for row in alive_rows:
+        f.write(json.dumps({"op": "add", "id": self._row_ids[row], "dim": self._dim, "metadata": self._row_metadata[row]}) + "\n")
+    self._vectors = None
+    os.replace(self._file("vectors.f32.tmp"), self._file("vectors.f32"))
+    os.replace(self._file("nodes.jsonl.tmp"), self._file("nodes.jsonl"))
+    # Row numbers changed, the index is retrained on the next search
+    if (os.path.exists(self._file("ivf.npz"))):
+      os.remove(self._file("ivf.npz"))
+    self._load()
+    print(f"[LOCAL VECTOR STORE] Compacted {self._path} to {len(alive_rows)} vectors")
+
+  ######## INDEX ########
+
+  def _is_ivf_used(self) -> bool:
+    if (self._search_mode == "exact"):
+      return False
+    if (self._search_mode == "ivf"):
+      return True
+    return len(self._id_to_row) >= self._ivf_min_vectors
+
+
+  def build_index(self) -> None:
+    """
+    Train the inverted file index: spherical k-means on a sample of the vectors, then assign every vector to its nearest centroid
+    """
+    with self._lock:
+      if (self._vectors is None):
+        return
+      alive_rows = np.flatnonzero(self._get_alive_mask())
+      n_lists = max(1, int(np.sqrt(len(alive_rows))))
+      rng = np.random.default_rng(0)
+      sample_rows = np.sort(rng.choice(alive_rows, min(len(alive_rows), n_lists * self._ivf_train_sample_per_list), replace=False))
+      sample = np.asarray(self._vectors[sample_rows])
+
+      centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+      for _ in range(self._ivf_train_iterations):
+        assignments = (sample @ centroids.T).argmax(axis=1)
+        for list_idx in range(n_lists):
+          members = sample[assignments == list_idx]
+          # Empty lists keep their centroid
+          if (len(members) > 0):
+            centroid = members.sum(axis=0)
+            centroids[list_idx] = centroid / max(np.linalg.norm(centroid), 1e-12)
+
+      n_rows = len(self._row_ids)
+      assignments = np.empty(n_rows, dtype=np.int64)
+      for start in range(0, n_rows, 65536):
+        assignments[start : start + 65536] = (np.asarray(self._vectors[start : start + 65536]) @ centroids.T).argmax(axis=1)
+      list_rows = np.argsort(assignments, kind="stable")
+      list_offsets = np.searchsorted(assignments[list_rows], np.arange(n_lists + 1))
+      self._ivf = {"centroids": centroids, "list_rows": list_rows, "list_offsets": list_offsets, "n_indexed_rows": np.array(n_rows)}
+      np.savez(self._file("ivf.npz"), **self._ivf)
+      print(f"[LOCAL VECTOR STORE] Built index of {self._path} with {n_lists} lists over {n_rows} vectors")
+
+
+  def _candidate_rows(self, query_embedding: np.ndarray) -> Optional[np.ndarray]:
+    """
+    Return the rows to score in approximate search: the rows of the _n_probe nearest lists,
+    and the rows added after the index was trained. None for exact search
+    """
+    if (not self._is_ivf_used()):
+      return None
+    n_rows = len(self._row_ids)
+    if (self._ivf is None or n_rows - int(self._ivf["n_indexed_rows"]) > self._ivf_retrain_ratio * n_rows):
+      self.build_index()
+    centroids, list_rows, list_offsets = self._ivf["centroids"], self._ivf["list_rows"], self._ivf["list_offsets"]
+    n_probe = min(self._n_probe, len(centroids))
+    probed_lists = np.argpartition(-(centroids @ query_embedding), n_probe - 1)[:n_probe]
+    candidate_rows = [list_rows[list_offsets[list_idx] : list_offsets[list_idx + 1]] for list_idx in probed_lists]
+    candidate_rows.append(np.arange(int(self._ivf["n_indexed_rows"]), n_rows))
+    return np.concatenate(candidate_rows)
+
+  ######## FILTERS ########
+
+  def _match_filters(self, metadata: dict, filters: MetadataFilters) -> bool:
+    """
+    Check if the metadata matches the filters, only exact match (==, !=) and membership (in, nin) are supported
+    """
+    matches = []
+    for metadata_filter in filters.filters:
+      if (isinstance(metadata_filter, MetadataFilters)):
+        matches.append(self._match_filters(metadata, metadata_filter))
+        continue
+      value = metadata.get(metadata_filter.key)
+      if (metadata_filter.operator == FilterOperator.EQ):
+        matches.append(value == metadata_filter.value)
+      elif (metadata_filter.operator == FilterOperator.NE):
+        matches.append(value != metadata_filter.value)
+      elif (metadata_filter.operator == FilterOperator.IN):
+        matches.append(value in metadata_filter.value)
+      elif (metadata_filter.operator == FilterOperator.NIN):
+        matches.append(value not in metadata_filter.value)
+      else:
+        raise ValueError(f"Metadata filter operator {metadata_filter.operator} is not supported by the local vector store")
+    if (filters.condition == FilterCondition.OR):
+      return any(matches)
+    return all(matches)
+
+
+  def _get_filter_mask(self, filters: Optional[MetadataFilters]) -> np.ndarray:
+    """
+    Return the mask of the rows that are not deleted and match the filters
+    """
+    alive_mask = self._get_alive_mask()
+    if (filters is None):
+      return alive_mask
+    return alive_mask & np.array([metadata is not None and self._match_filters(metadata, filters) for metadata in self._row_metadata], dtype=bool)
+
+  ######## VECTOR STORE ########
+
+  def add(self, nodes: Sequence[BaseNode], **kwargs: Any) -> List[str]:
+    """
+    Add embedded nodes, nodes with an existing ID replace it
+    """
+    if (len(nodes) == 0):
+      return []
+    embeddings = np.array([node.get_embedding() for node in nodes], dtype=np.float32)
+    embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    with self._lock:
+      if (self._dim is None):
+        self._dim = embeddings.shape[1]
+      self._truncate_orphan_vectors()
+      # Vectors first, so a logged row always has its vector
+      with open(self._file("vectors.f32"), "ab") as f:
+        embeddings.tofile(f)
+      with open(self._file("nodes.jsonl"), "a", encoding="utf-8") as f:
+        for node in nodes:
+          metadata = node_to_metadata_dict(node, remove_text=False, flat_metadata=self.flat_metadata)
+          f.write(json.dumps({"op": "add", "id": node.node_id, "dim": self._dim, "metadata": metadata}) + "\n")
+          self._append_row(node.node_id, metadata)
+      self._map_vectors()
+      self._compact_if_needed()
+    return [node.node_id for node in nodes]
+
+
+  def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+    """
+    Delete the nodes of the ref_doc_id document
+    """
+    with self._lock:
+      node_ids = [node_id for node_id, metadata in zip(self._row_ids, self._row_metadata)
+                  if node_id is not None and metadata.get("ref_doc_id", metadata.get("doc_id")) == ref_doc_id]
+      self._write_delete_log(node_ids)
+
+
+  def delete_nodes(self, node_ids: Optional[List[str]] = None, filters: Optional[Any] = None, **delete_kwargs: Any) -> None:
+    """
+    Delete the nodes by their IDs, or the nodes that match the metadata filters (and the IDs, if both are given)
+    """
+    with self._lock:
+      if (filters is not None):
+        filtered_ids = [self._row_ids[row] for row in np.flatnonzero(self._get_filter_mask(filters))]
+        node_ids = filtered_ids if node_ids is None else list(set(node_ids) & set(filtered_ids))
+      self._write_delete_log(node_ids or [])
+
+
+  def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+    """
+    Return the top k most similar nodes to the query embedding, that match the metadata filters if given
+    """
+    with self._lock:
+      if (self._vectors is None or len(self._id_to_row) == 0):
+        return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+      query_embedding = np.array(query.query_embedding, dtype=np.float32)
+      query_embedding /= max(np.linalg.norm(query_embedding), 1e-12)
+      candidate_rows = self._candidate_rows(query_embedding)
+      vectors, row_ids, row_metadata, alive_mask = self._vectors, self._row_ids, self._row_metadata, self._get_filter_mask(query.filters)
+
+    if (candidate_rows is None):
+      candidate_rows = np.arange(len(alive_mask))
+      scores = vectors @ query_embedding
+    else:
+      # Sorted, so the memory-mapped rows are read in file order
+      candidate_rows = np.sort(candidate_rows)
+      scores = np.asarray(vectors[candidate_rows]) @ query_embedding
+    is_alive = alive_mask[candidate_rows]
+    scores = np.where(is_alive, scores, -np.inf)
+
+    top_k = min(query.similarity_top_k, int(is_alive.sum()))
+    if (top_k == 0):
+      return VectorStoreQueryResult(nodes=[], similarities=[], ids=[])
+    top_idx = np.argpartition(-scores, top_k - 1)[:top_k]
+    top_idx = top_idx[np.argsort(-scores[top_idx])]
+    top_rows = candidate_rows[top_idx]
+    return VectorStoreQueryResult(
+      nodes=[metadata_dict_to_node(row_metadata[row]) for row in top_rows],
+      similarities=[float(score) for score in scores[top_idx]],
+      ids=[row_ids[row] for row in top_rows]
+    )
+
+
+  def get_stats(self) -> dict:
+    """
+    Return the statistics of the vector store
+    """
+    with self._lock:
+      return {
+        "vector_count": len(self._id_to_row),
+        "deleted_count": self._n_deleted,
+        "dimension": self._dim,
+        "is_ivf_used": self._is_ivf_used(),
+        "ivf_lists": len(self._ivf["centroids"]) if self._ivf is not None else 0,
+      }
+
+
+class LocalConnector():
+  """
+  Connecting component to the local vector store: drop-in for PineconeConnector, with one LocalVectorStore per namespace.
+  Used when VECTOR_STORE_BACKEND is "local", e.g. to run without the hosted service or to run load tests offline
+  """
+
+  def __init__(self, agent_component: object):
+    """
+    Instantiate the vector stores directory
+    """
+    self._agent_component = agent_component
+    self._path = os.getenv("LOCAL_VECTOR_STORE_PATH") or "local_vector_store"
+    self._search_mode = os.getenv("LOCAL_VECTOR_SEARCH_MODE") or "auto"
+    os.makedirs(self._path, exist_ok=True)
+    # Opened vector stores, keyed by namespace
+    self._vector_stores: dict = {}
+    self._vector_stores_lock = threading.Lock()
+
+
+  def _namespace_path(self, namespace: str) -> str:
+    return os.path.join(self._path, namespace.replace(os.sep, "_"))
+
+
+  def get_vector_store(self, namespace: str) -> Tuple[LocalVectorStore, StorageContext]:
+    """
+    Get vector store and storage context for certain namespace
+    """
+    with self._vector_stores_lock:
+      vector_store = self._vector_stores.get(namespace)
+      if (vector_store is None):
+        vector_store = LocalVectorStore(self._namespace_path(namespace), search_mode=self._search_mode)
+        self._vector_stores[namespace] = vector_store
+    storage_context = StorageContext.from_defaults(vector_store=vector_store)
+    return vector_store, storage_context
+
+
+  def store_data(self, nodes, namespace_name: str) -> None:
+    """
+    Store processed data to certain storage_context
+    """
+    _, storage_context = self.get_vector_store(namespace_name)
+    VectorStoreIndex(nodes,
+                     storage_context=storage_context,
+                     embed_model=self._agent_component.model_component.corpus_embed_model)
+
+
+  def upsert_nodes(self, nodes, namespace_name: str) -> None:
+    """
+    Upsert nodes that have been embedded to certain namespace
+    """
+    vector_store, _ = self.get_vector_store(namespace_name)
+    vector_store.add(nodes)
+
+
+  def delete_nodes(self, node_ids: list[str], namespace_name: str) -> None:
+    """
+    Delete nodes by their IDs from certain namespace
+    """
+    vector_store, _ = self.get_vector_store(namespace_name)
+    vector_store.delete_nodes(node_ids)
+
+
+  def delete_namespace(self, namespace_name: str) -> None:
+    """
+    Delete all the vectors of certain namespace, if it exists
+    """
+    with self._vector_stores_lock:
+      self._vector_stores.pop(namespace_name, None)
+      shutil.rmtree(self._namespace_path(namespace_name), ignore_errors=True)
+
+
+  def get_index_stats(self) -> None:
+    """
+    Display status of the vector stores
+    """
+    print({namespace: self.get_vector_store(namespace)[0].get_stats() for namespace in sorted(os.listdir(self._path))})
+
+
+  def is_namespace_exist(self, namespace_name: str) -> bool:
+    """
+    Check if a certain namespace exist
+    """
+    return os.path.exists(os.path.join(self._namespace_path(namespace_name), "nodes.jsonl"))
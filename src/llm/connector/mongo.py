@@ -1,5 +1,9 @@
 import pymongo
 import os
+from datetime import datetime, timezone
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from typing import Iterator, Optional
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -9,23 +13,46 @@ class MongoConnector():
   """
   Connecting component to MongoDB : DocumentDB from Data Mining
   """
+
+  # Collection of the engagements (like, follow, comment) done by each user, unique on (user_id, action, target_id)
+  _engagement_collection_name: str = "engagements"
+
   def __init__(self): 
     """
     Instantiate the database client
     """
     self.client = pymongo.MongoClient(os.getenv("MONGO_CONNECTION_STRING"))
     self.database = self.client[os.getenv("MONGO_DB_NAME")]
+    self._is_engagement_index_ensured = False
 
 
-  def get_data(self, collection_name: str, filters: dict = {}) -> list[dict]:
+  def get_data(self, collection_name: str, filters: dict = {}, projection: Optional[dict] = None) -> list[dict]:
     """
     Get data from mongo db with filters as parameters
+    If projection is given, only the projected fields are returned
     """
     collection = self.database[collection_name]
-    json_documents = collection.find(filters)
+    json_documents = collection.find(filters, projection)
     return list(json_documents)
   
 
+  def iterate_data(self, collection_name: str, filters: dict = {}, projection: Optional[dict] = None, batch_size: int = 100) -> Iterator[list[dict]]:
+    """
+    Stream data from mongo db in the order of _id, yielding list of batch_size documents
+    Only one batch is held in memory at a time
+    """
+    collection = self.database[collection_name]
+    cursor = collection.find(filters, projection, batch_size=batch_size).sort("_id", pymongo.ASCENDING)
+    batch = []
+    for document in cursor:
+      batch.append(document)
+      if (len(batch) >= batch_size):
+        yield batch
+        batch = []
+    if (len(batch) > 0):
+      yield batch
+  
+
   def get_one_data(self, collection_name: str, filters: dict = {}) -> list[dict]:
     """
     Get data from mongo db with filters as parameters, return the first one
@@ -42,3 +69,143 @@ class MongoConnector():
       selection_filter,
       {"$set": update_set}
     )
+
+
+  def update_many_data(self, collection_name: str, selection_filters: list[dict], update_sets: list[dict]) -> None:
+    """
+    Update many data in mongodb in one bulk write, each selection_filters[i] with update_sets[i]
+    """
+    if (len(selection_filters) == 0):
+      return
+    collection = self.database[collection_name]
+    operations = [UpdateOne(selection_filter, {"$set": update_set}) 
+                  for selection_filter, update_set in zip(selection_filters, update_sets)]
+    collection.bulk_write(operations, ordered=False)
+
+
+  def upsert_one_data(self, collection_name: str, selection_filter: dict, update_set : dict) -> None:
+    """
+    Update one data in mongodb, insert it if it does not exist
+    """
+    collection = self.database[collection_name]
+    collection.update_one(
+      selection_filter,
+      {"$set": update_set},
+      upsert=True
+    )
+
+
+  def upsert_many_data(self, collection_name: str, selection_filters: list[dict], update_sets: list[dict]) -> None:
+    """
+    Update many data in mongodb in one bulk write, each selection_filters[i] with update_sets[i], 
+    insert them if they do not exist
+    """
+    if (len(selection_filters) == 0):
+      return
+    collection = self.database[collection_name]
+    operations = [UpdateOne(selection_filter, {"$set": update_set}, upsert=True) 
+                  for selection_filter, update_set in zip(selection_filters, update_sets)]
+    collection.bulk_write(operations, ordered=False)
+
+
+  def delete_many_data(self, collection_name: str, filters: dict) -> int:
+    """
+    Delete data in mongodb matching filters, returns the number of deleted data
+    """
+    collection = self.database[collection_name]
+    return collection.delete_many(filters).deleted_count
+
+
+  def create_index(self, collection_name: str, keys: list[tuple], unique: bool = False) -> None:
+    """
+    Create index on the keys of the collection, no-op if it already exists
+    """
+    collection = self.database[collection_name]
+    collection.create_index(keys, unique=unique)
+
+
+  def pull_from_array(self, collection_name: str, selection_filter: dict, array_field: str, condition) -> None:
+    """
+    Remove the array elements matching condition in one document
+    """
+    collection = self.database[collection_name]
+    collection.update_one(
+      selection_filter,
+      {"$pull": {array_field: condition}}
+    )
+
+
+  def get_array_element(self, collection_name: str, selection_filter: dict, array_field: str, element_filter: dict) -> Optional[dict]:
+    """
+    Return the first array element matching element_filter in one document, without loading the rest of the array
+    """
+    collection = self.database[collection_name]
+    document = collection.find_one(selection_filter, {"_id": 0, array_field: {"$elemMatch": element_filter}})
+    if (document is None or len(document.get(array_field, [])) == 0):
+      return None
+    return document[array_field][0]
+
+
+  ######## ENGAGEMENT ########
+
+  def ensure_engagement_index(self) -> None:
+    """
+    Create the unique index of the engagements collection if it does not exist
+    """
+    if (self._is_engagement_index_ensured):
+      return
+    self.database[self._engagement_collection_name].create_index(
+      [("user_id", pymongo.ASCENDING), ("action", pymongo.ASCENDING), ("target_id", pymongo.ASCENDING)],
+      unique=True,
+      name="user_action_target"
+    )
+    self._is_engagement_index_ensured = True
+
+
+  def mark_engagements(self, engagements: list[dict]) -> int:
+    """
+    Mark list of engagements, each with user_id, action, target_id, and community_id.
+    Engagements that have been marked are skipped. Returns the number of newly marked engagements
+    """
+    if (len(engagements) == 0):
+      return 0
+    self.ensure_engagement_index()
+    operations = []
+    for engagement in engagements:
+      key = {
+        "user_id": str(engagement["user_id"]),
+        "action": engagement["action"],
+        "target_id": engagement["target_id"],
+      }
+      operations.append(UpdateOne(
+        key,
+        {"$setOnInsert": {**key, "community_id": engagement["community_id"], "created_at": datetime.now(timezone.utc)}},
+        upsert=True
+      ))
+    try:
+      result = self.database[self._engagement_collection_name].bulk_write(operations, ordered=False)
+      return result.upserted_count
+    except BulkWriteError as e:
+      # Concurrent upserts of the same engagements are duplicates, other errors are raised
+      if (any([error["code"] != 11000 for error in e.details["writeErrors"]]) or e.details.get("writeConcernErrors")):
+        raise
+      return e.details["nUpserted"]
+
+
+  def mark_engagement(self, user_id: str, action: str, target_id, community_id: int) -> bool:
+    """
+    Mark that user_id has done action to target_id.
+    Returns False if it has been marked before
+    """
+    self.ensure_engagement_index()
+    key = {"user_id": str(user_id), "action": action, "target_id": target_id}
+    try:
+      result = self.database[self._engagement_collection_name].update_one(
+        key,
+        {"$setOnInsert": {**key, "community_id": community_id, "created_at": datetime.now(timezone.utc)}},
+        upsert=True
+      )
+      return result.upserted_id is not None
+    except DuplicateKeyError:
+      # Concurrent upsert of the same engagement
+      return False
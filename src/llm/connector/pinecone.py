@@ -3,7 +3,10 @@ from llama_index.vector_stores.pinecone import PineconeVectorStore
 from typing import Tuple
 
 from pinecone import Pinecone
+from pinecone.exceptions import NotFoundException
 import os
+import threading
+import time
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -13,13 +16,54 @@ class PineconeConnector():
   """
   Connecting component to Pinecone : VectorDB for LLM and RAG
   """
-  def __init__(self, model_component: object): 
+
+  # Time to live (in seconds) of the cached namespace catalog
+  _namespace_ttl: int = 300
+  # Max IDs in one delete request
+  _delete_batch_size: int = 1000
+
+  def __init__(self, agent_component: object): 
     """
     Instantiate the database client
     """
-    self._model_component = model_component
+    self._agent_component = agent_component
     self.client = Pinecone(api_key=(os.getenv("PINECONE_API_KEY")))
     self.index = self.client.Index(os.getenv("PINECONE_INDEX"))
+    # Cached namespace catalog, refreshed in the background when it is older than the TTL
+    self._namespaces: set = set()
+    # Namespaces created by this process that the index stats have not caught up with yet
+    self._created_namespaces: set = set()
+    self._namespaces_refreshed_at: float = None
+    self._namespaces_lock = threading.Lock()
+    self._is_refreshing_namespaces = False
+
+
+  def _refresh_namespaces(self) -> None:
+    """
+    Fetch the namespace catalog from the index stats.
+    Created namespaces are kept until the stats see them, afterwards the stats are trusted (e.g. deletion by another process)
+    """
+    try:
+      namespaces = set(self.index.describe_index_stats()['namespaces'].keys())
+      with self._namespaces_lock:
+        self._created_namespaces -= namespaces
+        self._namespaces = namespaces | self._created_namespaces
+        self._namespaces_refreshed_at = time.monotonic()
+    except Exception as e:
+      print(f"[ERROR REFRESH NAMESPACES] Error occured while refreshing namespace catalog: {e}")
+    finally:
+      self._is_refreshing_namespaces = False
+
+
+  def _refresh_namespaces_in_background(self) -> None:
+    """
+    Refresh the namespace catalog on a background thread, unless a refresh is already running
+    """
+    with self._namespaces_lock:
+      if (self._is_refreshing_namespaces):
+        return
+      self._is_refreshing_namespaces = True
+    threading.Thread(target=self._refresh_namespaces, daemon=True).start()
 
 
   def get_vector_store(self, namespace: str) -> Tuple[VectorStoreIndex, StorageContext]:
@@ -38,7 +82,45 @@ class PineconeConnector():
     _, storage_context = self.get_vector_store(namespace_name)
     VectorStoreIndex(nodes, 
                      storage_context=storage_context, 
-                     embed_model=self._model_component.embed_model)
+                     embed_model=self._agent_component.model_component.corpus_embed_model)
+    # The namespace is created on the first insert
+    with self._namespaces_lock:
+      self._created_namespaces.add(namespace_name)
+      self._namespaces.add(namespace_name)
+
+
+  def upsert_nodes(self, nodes, namespace_name: str) -> None:
+    """
+    Upsert nodes that have been embedded to certain namespace
+    """
+    vector_store, _ = self.get_vector_store(namespace_name)
+    vector_store.add(nodes)
+    # The namespace is created on the first insert
+    with self._namespaces_lock:
+      self._created_namespaces.add(namespace_name)
+      self._namespaces.add(namespace_name)
+
+
+  def delete_nodes(self, node_ids: list[str], namespace_name: str) -> None:
+    """
+    Delete nodes by their IDs from certain namespace
+    """
+    for i in range(0, len(node_ids), self._delete_batch_size):
+      self.index.delete(ids=node_ids[i : i + self._delete_batch_size], namespace=namespace_name)
+
+
+  def delete_namespace(self, namespace_name: str) -> None:
+    """
+    Delete all the vectors of certain namespace, if it exists.
+    The cached catalog may be stale, so the delete is always sent
+    """
+    try:
+      self.index.delete(delete_all=True, namespace=namespace_name)
+    except NotFoundException:
+      print(f"[DELETE NAMESPACE] Namespace {namespace_name} does not exist")
+    with self._namespaces_lock:
+      self._created_namespaces.discard(namespace_name)
+      self._namespaces.discard(namespace_name)
 
 
   def get_index_stats(self) -> None:
@@ -51,6 +133,13 @@ class PineconeConnector():
   def is_namespace_exist(self, namespace_name: str) -> bool:
     """
     Check if a certain namespace exist
+    The namespace catalog is cached. The first call fetches it directly, 
+    afterwards a stale catalog is served while it is refreshed in the background
     """
-    namespaces_data = self.index.describe_index_stats()['namespaces']
-    return namespace_name in namespaces_data
+    if (self._namespaces_refreshed_at is None):
+      with self._namespaces_lock:
+        self._is_refreshing_namespaces = True
+      self._refresh_namespaces()
+    elif (time.monotonic() - self._namespaces_refreshed_at > self._namespace_ttl):
+      self._refresh_namespaces_in_background()
+    return namespace_name in self._namespaces
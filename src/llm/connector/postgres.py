@@ -1,62 +1,125 @@
 import os
+import asyncio
 import psycopg2
+import psycopg2.extensions
+import threading
+from psycopg2.pool import ThreadedConnectionPool
 from datetime import datetime, timezone, timedelta
 from zoneinfo import ZoneInfo
+from typing import Optional
 
 from dotenv import load_dotenv
 load_dotenv()
 
 
+class PreparedConnection(psycopg2.extensions.connection):
+  """
+  Connection that keeps track of the statements that have been prepared in its session
+  """
+  def __init__(self, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.prepared_statements = set()
+
+
 class PostgresConnector():
   """
   Connecting component to PostgreSQL: RDBMS for bot data
   """
-  def __init__(self): 
+
+  # Size of the connection pool
+  _min_connections: int = 1
+  _max_connections: int = int(os.getenv("POSTGRES_POOL_SIZE", 10))
+
+  # Server-side prepared statements, keyed by statement name
+  _statements: dict = {
+    "get_username": "SELECT username FROM bot_user WHERE id = $1",
+    "get_persona_data": "SELECT persona FROM bot_user WHERE id = $1",
+    "get_config_data": "SELECT temperature, top_k, max_token, max_iteration FROM bot_configuration WHERE user_id = $1",
+    "get_scheduled_post_data": "SELECT id, image_url, caption, user_id, tourism_object_id FROM bot_scheduledpost " \
+                               "WHERE scheduled_time <= $1 AND is_posted = FALSE",
+    "mark_posts_as_posted": "UPDATE bot_scheduledpost SET is_posted = TRUE, updated_at = $2 WHERE id = $1",
+  }
+
+  def __init__(self):
     """
-    Instantiate the database client
+    Instantiate the database connection pool
     """
-    self.connection = psycopg2.connect(
-          os.getenv("DB_PRODUCTION_URL")
-          # host=os.getenv("POSTGRES_HOST"),      
-          # port=os.getenv("POSTGRES_PORT"),           
-          # database=os.getenv("POSTGRES_DB_NAME"),    
-          # user=os.getenv("POSTGRES_USER"),     
-          # password=os.getenv("POSTGRES_PASSWORD")  
+    self.pool = ThreadedConnectionPool(
+          self._min_connections,
+          self._max_connections,
+          os.getenv("DB_PRODUCTION_URL"),
+          connection_factory=PreparedConnection
+          # host=os.getenv("POSTGRES_HOST"),
+          # port=os.getenv("POSTGRES_PORT"),
+          # database=os.getenv("POSTGRES_DB_NAME"),
+          # user=os.getenv("POSTGRES_USER"),
+          # password=os.getenv("POSTGRES_PASSWORD")
       )
-    self.cursor = self.connection.cursor()
+    # The pool raises instead of waiting when it is exhausted, so the callers (e.g. the aget_* threads) wait for a free connection here
+    self._connection_semaphore = threading.BoundedSemaphore(self._max_connections)
+
+  ######## PRIVATE ########
+
+  def _execute(self, statement_name: str, params: tuple, fetch: Optional[str] = None):
+    """
+    Execute the prepared statement on a connection checked out from the pool, in its own transaction.
+    The statement is prepared the first time it is used on the connection.
+    fetch is either "one", "all", or None.
+    The connection is discarded on error, so no broken transaction or session state is reused.
+    Blocks until a connection of the pool is free
+    """
+    self._connection_semaphore.acquire()
+    try:
+      connection = self.pool.getconn()
+    except Exception as e:
+      self._connection_semaphore.release()
+      raise e
+    is_failed = False
+    try:
+      with connection:
+        with connection.cursor() as cursor:
+          if (statement_name not in connection.prepared_statements):
+            cursor.execute(f"PREPARE {statement_name} AS {self._statements[statement_name]}")
+            connection.prepared_statements.add(statement_name)
+          placeholders = ", ".join(["%s"] * len(params))
+          cursor.execute(f"EXECUTE {statement_name} ({placeholders})", params)
+          if (fetch == "one"):
+            return cursor.fetchone()
+          elif (fetch == "all"):
+            return cursor.fetchall()
+          return None
+    except Exception as e:
+      is_failed = True
+      raise e
+    finally:
+      self.pool.putconn(connection, close=is_failed)
+      self._connection_semaphore.release()
+
+  ######## PUBLIC ########
 
-  
   def get_username(self, user_id: str) -> tuple:
     """
     Get username based on the user_id
     """
     try:
-      table_name = "bot_user"
-      column_name = "username"
-      self.cursor.execute(f"SELECT {column_name} FROM {table_name} WHERE id={user_id}")
-      data = self.cursor.fetchone()[0]
+      data = self._execute("get_username", (user_id,), fetch="one")[0]
       return data
     except Exception as e:
       print(f"[ERROR POSTGRES] {e}")
-      self.connection.rollback()
-      return None 
-  
+      return None
+
 
   def get_persona_data(self, user_id: str) -> tuple:
     """
     Get persona data based on the user_id
     """
     try:
-      table_name = "bot_user"
-      column_name = "persona"
-      self.cursor.execute(f"SELECT {column_name} FROM {table_name} WHERE id={user_id}")
-      data = self.cursor.fetchone()[0]
+      data = self._execute("get_persona_data", (user_id,), fetch="one")[0]
       return data
     except Exception as e:
       print(f"[ERROR POSTGRES] {e}")
-      self.connection.rollback()
-      return None 
-  
+      return None
+
 
   def get_config_data(self, user_id: str) -> tuple:
     """
@@ -64,78 +127,81 @@ class PostgresConnector():
     Make sure to not change the order of the data returned
     """
     try:
-      table_name = "bot_configuration"
-      column_names = "temperature, top_k, max_token, max_iteration"
-      self.cursor.execute(f"SELECT {column_names} FROM {table_name} WHERE user_id={user_id}")
-      data = self.cursor.fetchone()
+      data = self._execute("get_config_data", (user_id,), fetch="one")
       return data
     except Exception as e:
       print(f"[ERROR POSTGRES] {e}")
-      self.connection.rollback()
-      return None 
-  
+      return None
+
 
   def get_scheduled_post_data(self) -> tuple:
-      """
-      Get scheduled post data that is ready to post:
-      - id
-      - img_url
-      - caption_message
-      - user_id 
-      - tourism_object_id 
-
-      That is
-      - scheduled_time is before current time (GMT+7)
-      - is_posted is False
-      """
-      try:
-          table_name = "bot_scheduledpost"
-          column_names = "id, image_url, caption, user_id, tourism_object_id"
-          
-          # Get current time in GMT+7
-          current_time_gmt7 = datetime.now(ZoneInfo("Asia/Jakarta"))
-          print(f"[CURRENT TIME] {current_time_gmt7}")
-
-          # Use parameterized query to prevent SQL injection
-          query = f"""
-              SELECT {column_names}
-              FROM {table_name}
-              WHERE scheduled_time <= %s
-                AND is_posted = FALSE;
-          """
-          self.cursor.execute(query, (current_time_gmt7,))
-          data = self.cursor.fetchall()
-          return data
-      except Exception as e:
-          print(f"[ERROR POSTGRES] {e}")
-          self.connection.rollback()
-          return None
-      
+    """
+    Get scheduled post data that is ready to post:
+    - id
+    - img_url
+    - caption_message
+    - user_id
+    - tourism_object_id
+
+    That is
+    - scheduled_time is before current time (GMT+7)
+    - is_posted is False
+    """
+    try:
+      # Get current time in GMT+7
+      current_time_gmt7 = datetime.now(ZoneInfo("Asia/Jakarta"))
+      print(f"[CURRENT TIME] {current_time_gmt7}")
+
+      data = self._execute("get_scheduled_post_data", (current_time_gmt7,), fetch="all")
+      return data
+    except Exception as e:
+      print(f"[ERROR POSTGRES] {e}")
+      return None
+
 
   def mark_posts_as_posted(self, id: str) -> None:
-      """
-      Set is_posted = TRUE for id post
-      """
-      try:
-          table_name = "bot_scheduledpost"
-          # Update mark
-          query = f"""
-              UPDATE {table_name}
-              SET is_posted = TRUE
-              WHERE id = %s;
-          """
-          self.cursor.execute(query, (id,))
-
-          # Update updated_on
-          current_time = datetime.now(ZoneInfo("Asia/Jakarta"))
-          query = f"""
-              UPDATE {table_name}
-              SET updated_at = %s
-              WHERE id = %s;
-          """
-          self.cursor.execute(query, (current_time, id))
-          self.connection.commit()
-          print(f"[MARK IS POSTED] Marked posts as posted for id={id}")
-      except Exception as e:
-          print(f"[ERROR MARK IS POSTED] {e}")
-          self.connection.rollback()
\ No newline at end of file
+    """
+    Set is_posted = TRUE for id post, as well as its updated_at
+    """
+    try:
+      current_time = datetime.now(ZoneInfo("Asia/Jakarta"))
+      self._execute("mark_posts_as_posted", (id, current_time))
+      print(f"[MARK IS POSTED] Marked posts as posted for id={id}")
+    except Exception as e:
+      print(f"[ERROR MARK IS POSTED] {e}")
+
+  ######## ASYNC ########
+
+  async def aget_username(self, user_id: str) -> tuple:
+    """
+    Async version of get_username, run in a worker thread so the event loop is not blocked
+    """
+    return await asyncio.to_thread(self.get_username, user_id)
+
+
+  async def aget_persona_data(self, user_id: str) -> tuple:
+    """
+    Async version of get_persona_data
+    """
+    return await asyncio.to_thread(self.get_persona_data, user_id)
+
+
+  async def aget_config_data(self, user_id: str) -> tuple:
+    """
+    Async version of get_config_data
+    """
+    return await asyncio.to_thread(self.get_config_data, user_id)
+
+
+  async def aget_scheduled_post_data(self) -> tuple:
+    """
+    Async version of get_scheduled_post_data
+    """
+    return await asyncio.to_thread(self.get_scheduled_post_data)
+
+
+  async def amark_posts_as_posted(self, id: str) -> None:
+    """
+    Async version of mark_posts_as_posted
+    """
+    return await asyncio.to_thread(self.mark_posts_as_posted, id)
@@ -1,5 +1,8 @@
 from llama_index.core.evaluation import FaithfulnessEvaluator, RelevancyEvaluator
+from typing import Tuple
+import asyncio
 import json
+import time
 
 
 class Evaluator():
@@ -8,6 +11,14 @@ class Evaluator():
   It uses various evaluators such as faithfulness and relevancy to assess the agent's responses.
   """
 
+  # Aspects that are allowed to fail, see `is_passable`
+  PASSABLE_ASPECTS = ["naturalness"]
+
+  # Evaluation modes
+  # separate : each aspect is evaluated by its own evaluator (one LLM call per aspect)
+  # combined : all aspects are scored in a single structured-JSON LLM call
+  EVALUATION_MODES = ["separate", "combined"]
+
   def __init__(self, model_component: object, persona_component: object):
     """
     Initialize the evaluators for faithfulness and relevancy.
@@ -68,31 +79,135 @@ class Evaluator():
     return {"passing": int(naturalness['score']) >= 3, "reason": naturalness['reason'], "score": naturalness['score']}
   
 
-  async def evaluate_response(self, query: str, response: str, contexts: list[str], evaluation_aspect: list[str]) -> dict:
+  async def _evaluate_combined(self, query: str, response: str, contexts: list[str], evaluation_aspect: list[str]) -> dict:
     """
-    Evaluate response for each evaluation aspects given
+    Evaluate all the aspects in a single LLM call.
+    Returns the result of each aspect in the same format as the separate evaluators.
     """
-    evaluation_result = {"evaluation_passing": True}
+    # Prepare the criteria for each aspect
+    criteria = {
+      "faithfulness": "- faithfulness: The response is supported by the given contexts. " \
+                      "Any information in the response that is not stated in or cannot be inferred from the contexts is a hallucination and fails this aspect. \n",
+      "relevancy":    "- relevancy: The response is in line with the query and the contexts, and it actually answers or fulfills the query. \n",
+      "naturalness":  "- naturalness: The response is human-like, fluent, coherent, and easy to read. " \
+                      "Rate it on a scale of 1 to 5 (1 = Very unnatural while 5 = Very natural). " \
+                      "You also need to mind the naturalness of the response compared to the persona. \n",
+    }
+    output_format = {
+      "faithfulness": "\"faithfulness\": {\"passing\": boolean, \"reason\": str}",
+      "relevancy":    "\"relevancy\": {\"passing\": boolean, \"reason\": str}",
+      "naturalness":  "\"naturalness\": {\"score\": int, \"reason\": str}",
+    }
 
-    # Evaluate each aspect in evaluation aspect
+    prompt =  "You are evaluating a generated response on several aspects at once. \n" \
+              "Evaluation criteria:\n"
+    for aspect in evaluation_aspect:
+      prompt += criteria[aspect]
+    prompt += "\n"
+    if ("naturalness" in evaluation_aspect):
+      prompt += f"Here is the persona:\n {self._persona_compnent.get_persona_str()} \n\n"
+    prompt += f"Here is the query: {query}\n"
+    if ("faithfulness" in evaluation_aspect or "relevancy" in evaluation_aspect):
+      prompt += "Here are the contexts:\n"
+      for i, context in enumerate(contexts):
+        prompt += f"Context {i+1}: {context}\n"
+      prompt += "\n"
+    prompt += "Also provide the reason of your evaluation for each aspect. \n" \
+              "Return your answer in this JSON format, without any extra explanation or text.: \n" \
+              "{\n"
+    prompt += ",\n".join([output_format[aspect] for aspect in evaluation_aspect])
+    prompt += "\n}\n" \
+              "\n" \
+              f"This is the response you need to evaluate: {response}"
+    answer, _ = await self._model_component.answer(prompt, is_direct=True)
+    # Parse answer
+    combined_evaluation = json.loads(answer)
 
-    if ("faithfulness" in evaluation_aspect):
-      current_evaluation = await self._evaluate_faithfulness(query, response, contexts)
-      for key, val in current_evaluation.items():
-        evaluation_result[f"faithfulness_{key}"] = val
-      evaluation_result["evaluation_passing"] = evaluation_result["evaluation_passing"] and current_evaluation["passing"]
+    aspect_results = {}
+    for aspect in evaluation_aspect:
+      current_evaluation = combined_evaluation[aspect]
+      if (aspect == "naturalness"):
+        aspect_results[aspect] = {"passing": int(current_evaluation['score']) >= 3, "reason": current_evaluation['reason'], "score": current_evaluation['score']}
+      else:
+        aspect_results[aspect] = {"passing": bool(current_evaluation['passing']), "reason": current_evaluation['reason']}
+    return aspect_results
 
-    if ("relevancy" in evaluation_aspect):
-      current_evaluation = await self._evaluate_relevancy(query, response, contexts)
-      for key, val in current_evaluation.items():
-        evaluation_result[f"relevancy_{key}"] = val
-      evaluation_result["evaluation_passing"] = evaluation_result["evaluation_passing"] and current_evaluation["passing"]
 
-    if ("naturalness" in evaluation_aspect):
+  async def _evaluate_aspect(self, aspect: str, query: str, response: str, contexts: list[str]) -> Tuple[str, dict, float]:
+    """
+    Evaluate a single aspect, returning the aspect name, its result, and the elapsed time in seconds
+    """
+    start_time = time.perf_counter()
+    if (aspect == "faithfulness"):
+      current_evaluation = await self._evaluate_faithfulness(query, response, contexts)
+    elif (aspect == "relevancy"):
+      current_evaluation = await self._evaluate_relevancy(query, response, contexts)
+    elif (aspect == "naturalness"):
       current_evaluation = await self._evaluate_naturalness(response)
+    else:
+      raise Exception(f"Unknown evaluation aspect: {aspect}")
+    return aspect, current_evaluation, time.perf_counter() - start_time
+
+
+  async def _evaluate_separate(self, query: str, response: str, contexts: list[str], evaluation_aspect: list[str], short_circuit: bool, evaluation_time: dict) -> dict:
+    """
+    Evaluate all the aspects concurrently, each with its own evaluator.
+    If short_circuit is True, the remaining aspects are cancelled as soon as an aspect that is not passable fails,
+    since the response cannot pass anymore.
+    """
+    aspect_results = {}
+    tasks = [asyncio.create_task(self._evaluate_aspect(aspect, query, response, contexts)) 
+             for aspect in evaluation_aspect]
+    pending = set(tasks)
+    try:
+      while (len(pending) > 0):
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        is_hard_failure = False
+        for task in done:
+          aspect, current_evaluation, elapsed_time = task.result()
+          aspect_results[aspect] = current_evaluation
+          evaluation_time[aspect] = round(elapsed_time, 3)
+          if (not current_evaluation["passing"] and aspect not in self.PASSABLE_ASPECTS):
+            is_hard_failure = True
+        
+        if (is_hard_failure and short_circuit and len(pending) > 0):
+          cancelled_aspects = [aspect for aspect, task in zip(evaluation_aspect, tasks) if task in pending]
+          print(f"[EVALUATION SHORT CIRCUIT] Cancelling remaining aspects: {cancelled_aspects}")
+          break
+    finally:
+      # Make sure no evaluation keeps running on failure or short circuit
+      for task in pending:
+        task.cancel()
+    return aspect_results
+
+
+  async def evaluate_response(self, query: str, response: str, contexts: list[str], evaluation_aspect: list[str], short_circuit: bool = True, mode: str = "separate") -> dict:
+    """
+    Evaluate response for each evaluation aspects given.
+    In separate mode, all aspects are evaluated concurrently (see `_evaluate_separate`).
+    In combined mode, all aspects are evaluated in a single LLM call, trading some judging fidelity for fewer LLM calls.
+    """
+    evaluation_result = {"evaluation_passing": True}
+    evaluation_time = {}
+
+    if (mode == "separate"):
+      aspect_results = await self._evaluate_separate(query, response, contexts, evaluation_aspect, short_circuit, evaluation_time)
+    elif (mode == "combined"):
+      start_time = time.perf_counter()
+      aspect_results = await self._evaluate_combined(query, response, contexts, evaluation_aspect)
+      evaluation_time["combined"] = round(time.perf_counter() - start_time, 3)
+    else:
+      raise Exception(f"Unknown evaluation mode: {mode}. Available modes: {self.EVALUATION_MODES}")
+
+    # Keep the order of the evaluation aspects in the result
+    for aspect in evaluation_aspect:
+      if (aspect not in aspect_results):
+        continue
+      current_evaluation = aspect_results[aspect]
       for key, val in current_evaluation.items():
-        evaluation_result[f"naturalness_{key}"] = val
+        evaluation_result[f"{aspect}_{key}"] = val
       evaluation_result["evaluation_passing"] = evaluation_result["evaluation_passing"] and current_evaluation["passing"]
+    evaluation_result["evaluation_time"] = evaluation_time
     
     return evaluation_result
 
@@ -101,8 +216,9 @@ class Evaluator():
     """
     Check if the evaluation result is passable (only naturalness is allowed to fail)
     """
+    passable_keys = ["evaluation_passing"] + [f"{aspect}_passing" for aspect in self.PASSABLE_ASPECTS]
     for key, val in evaluation_result.items():
-      if ("_passing" in key and key != "naturalness_passing"):
+      if ("_passing" in key and key not in passable_keys):
         if (not val):
           return False
     return True
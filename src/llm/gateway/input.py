@@ -1,20 +1,47 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from werkzeug.http import http_date
+from datetime import date
+from typing import Tuple
+import asyncio
+import contextlib
+import json
 import os
+import re
+import uvicorn
 from dotenv import load_dotenv
 load_dotenv()
 
 
+class AsgiJSONResponse(JSONResponse):
+  """
+  JSON response for the ASGI app, rendered the same way as Flask jsonify
+  """
+  def _default(self, value: object) -> str:
+    if (isinstance(value, date)):
+      return http_date(value)
+    return str(value)
+
+  def render(self, content: object) -> bytes:
+    return json.dumps(content, default=self._default, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
 class InputGateway():
   """
   Input gateway for other module
   """
-  def __init__(self, 
-               agent_component: object, 
-               host : str = os.getenv("LLM_MODULE_HOST"), 
+  def __init__(self,
+               agent_component: object,
+               host : str = os.getenv("LLM_MODULE_HOST"),
                port : str = os.getenv("LLM_MODULE_PORT")):
     """
-    Instantiate Flask as the framework for the API and the gateway
+    Instantiate Flask as the framework for the API and the gateway.
+    The same routes are also served as an ASGI app (Starlette), which runs on one long-lived event loop
     """
     self.app = Flask(__name__)
     # CORS(self.app, origins=[os.getenv("FRONTEND_URL")])
@@ -23,14 +50,15 @@ class InputGateway():
     self.host = host
     self.port = port
     self.setup_routes()
+    self.asgi_app = self.setup_asgi_app()
 
     print("[REGISTERED ROUTES]:")
     for rule in self.app.url_map.iter_rules():
         print(f"{rule.endpoint}: {rule.methods} -> {rule}")
 
-    
-  def _check_data_validity(self, 
-                           data: dict, 
+
+  def _check_data_validity(self,
+                           data: dict,
                            fields_to_check : list) -> bool:
     """
     Check validity of the data, making sure that the data and the fields inside the data are not empty
@@ -42,208 +70,331 @@ class InputGateway():
         return False, f"Missing {field} field!"
     return True, ""
 
+
+  async def _use_request_user(self, user_id: str = None) -> None:
+    """
+    Use the context of the user_id carried by the request.
+    If the request does not carry user_id, the default user is used
+    """
+    if (user_id is not None):
+      await self._agent_component.use_user(user_id)
+
   ######## SETUP INPUT ########
-  
-  def setup_routes(self) -> None:
+
+  def _get_routes(self) -> list[tuple]:
     """
-    Setup routing for the API
+    Return the routes of the API as (path, method, handler).
     Is used for input from other module (External-trigger Action)
-    
+    Each handler receives the request data (path and query parameters for GET, JSON body for POST)
+
     Returning format:
     {
       response : str
     }
+
+    Every request may carry optional user_id field (query parameter for GET)
+    to be served with the context of that user instead of the default user
+    """
+    return [
+      ("/status", "GET", self.get_status),
+      ("/jobs/<job_id>", "GET", self.get_job),
+      ("/user", "POST", self.set_user),
+      ("/persona", "POST", self.set_persona),
+      ("/config", "POST", self.set_config),
+      ("/action", "POST", self.respond_action),
+      ("/check_schedule", "POST", self.respond_check_schedule),
+      ("/chat", "POST", self.respond_chat),
+      ("/post", "POST", self.respond_schedule_post),
+      ("/caption", "POST", self.respond_generate_caption),
+    ]
+
+
+  def setup_routes(self) -> None:
+    """
+    Setup routing for the API in Flask
+    """
+    for path, method, handler in self._get_routes():
+      self.app.add_url_rule(path, endpoint=handler.__name__, view_func=self._to_flask_view(handler), methods=[method])
+
+
+  def _to_flask_view(self, handler):
+    """
+    Wrap the handler as Flask view
+    """
+    async def view(**path_params):
+      if (request.method == "GET"):
+        data = {**request.args.to_dict(), **path_params}
+      else:
+        data = request.get_json(silent=True)
+      async with self._agent_component.request_scope():
+        response, status_code = await handler(data)
+      return jsonify(response), status_code
+    return view
+
+
+  def setup_asgi_app(self) -> Starlette:
+    """
+    Setup routing for the API in ASGI app
+    """
+    # Path parameters are written in Flask format (<name>), convert them to Starlette format ({name})
+    routes = [Route(re.sub(r"<(\w+)>", r"{\1}", path), endpoint=self._to_asgi_endpoint(handler), methods=[method], name=handler.__name__)
+              for path, method, handler in self._get_routes()]
+    return Starlette(routes=routes,
+                     middleware=[Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])],
+                     lifespan=self._asgi_lifespan)
+
+
+  @contextlib.asynccontextmanager
+  async def _asgi_lifespan(self, app: Starlette):
+    """
+    Run the background jobs on the serving event loop, so they share the async clients (LLM, embedding, HTTP) of the requests
+    """
+    self._agent_component.job_runner_component.attach_loop(asyncio.get_running_loop())
+    yield
+
+
+  def _to_asgi_endpoint(self, handler):
+    """
+    Wrap the handler as ASGI endpoint
+    """
+    async def endpoint(request):
+      if (request.method == "GET"):
+        data = {**dict(request.query_params), **request.path_params}
+      else:
+        try:
+          data = await request.json()
+        except Exception:
+          data = None
+      async with self._agent_component.request_scope():
+        response, status_code = await handler(data)
+      return AsgiJSONResponse(response, status_code=status_code)
+    return endpoint
+
+  #####################
+  ######## GET ########
+  #####################
+
+  async def get_status(self, data: dict) -> Tuple[dict, int]:
+    """
+    Get current status of the bot
+    """
+    try:
+      await self._use_request_user(data.get('user_id', None))
+      user = await self._agent_component.get_user()
+      config = self._agent_component.get_config()
+      persona = self._agent_component.get_persona()
+      memory = self._agent_component.get_memory()
+      observation_elm = await self._agent_component.get_observation_elm()
+      cache = self._agent_component.get_cache_stats()
+      latency = self._agent_component.get_latency_stats()
+
+      return {"response": {
+                "user" : user,
+                "config": config,
+                "persona": persona,
+                "memory": memory,
+                "observation": observation_elm,
+                "cache": cache,
+                "latency": latency,
+              }}, 200
+    except Exception as error:
+      return {"error": str(error)}, 400
+
+
+  async def get_job(self, data: dict) -> Tuple[dict, int]:
+    """
+    Get status of a background job, submitted by /action or /check_schedule
+    """
+    try:
+      job = self._agent_component.get_job(data['job_id'])
+      if (job is None):
+        return {"error": f"Job {data['job_id']} is not found!"}, 404
+      return {"response": job}, 200
+    except Exception as error:
+      return {"error": str(error)}, 400
+
+  ######################
+  ######## POST ########
+  ######################
+
+  ######## SETUP & OTHER ########
+
+  async def set_user(self, data: dict) -> Tuple[dict, int]:
+    """
+    Set user_id to the agent
+    Field format :
+    {
+      user_id : str
+    }
+    """
+    try:
+      is_valid, error_message = self._check_data_validity(data, ['user_id'])
+      if (not is_valid):
+        return {"error": error_message}, 400
+
+      # Proceed to process
+      user_id = data['user_id']
+      await self._agent_component.set_user(user_id)
+      return {"response": True}, 200
+    except Exception as error:
+      return {"error": str(error)}, 400
+
+
+  async def set_persona(self, data: dict) -> Tuple[dict, int]:
+    """
+    Respond to change persona input from dashboard
+    """
+    try:
+      data = data or {}
+      await self._use_request_user(data.get('user_id', None))
+      await self._agent_component.set_persona()
+      return {"response": True}, 200
+    except Exception as error:
+      return {"error": str(error)}, 400
+
+
+  async def set_config(self, data: dict) -> Tuple[dict, int]:
+    """
+    Respond to change model configuration input from dashboard
+    """
+    try:
+      data = data or {}
+      await self._use_request_user(data.get('user_id', None))
+      await self._agent_component.set_config()
+      return {"response": True}, 200
+    except Exception as error:
+      return {"error": str(error)}, 400
+
+
+  ######## SCHEDULED FOR CRON ########
+
+  def _job_response(self, job: dict, is_created: bool) -> Tuple[dict, int]:
+    """
+    Respond to a submitted job with 202, or 409 if the same job is still running
+    """
+    if (not is_created):
+      return {"error": f"Job {job['name']} is still {job['status']}", "job_id": job['job_id']}, 409
+    return {"response": {"job_id": job['job_id'], "status": job['status']}}, 202
+
+
+  async def respond_action(self, data: dict) -> Tuple[dict, int]:
+    """
+    Respond to external scheduler to start doing action.
+    The action runs as a background job, check its status in /jobs/<job_id>
+    """
+    try:
+      data = data or {}
+      await self._use_request_user(data.get('user_id', None))
+      job, is_created = self._agent_component.submit_decide_action()
+      return self._job_response(job, is_created)
+    except Exception as error:
+      return {"error": str(error)}, 400
+
+
+  async def respond_check_schedule(self, data: dict) -> Tuple[dict, int]:
+    """
+    Respond to external scheduler to check schedule for scheduled_post.
+    The check runs as a background job, check its status in /jobs/<job_id>
+    """
+    try:
+      job, is_created = self._agent_component.submit_check_schedule()
+      return self._job_response(job, is_created)
+    except Exception as error:
+      return {"error": str(error)}, 400
+
+  ######## ACTIONS INPUT ########
+
+  async def respond_chat(self, data: dict) -> Tuple[dict, int]:
+    """
+    Respond to input chat from user, returning the reply to the inputted message
+    Field format :
+    {
+      chat_message : str,
+      sender_id: str,
+      user_id: str (optional)
+    }
+    """
+    try:
+      is_valid, error_message = self._check_data_validity(data, ['chat_message', 'sender_id'])
+      if (not is_valid):
+        return {"error": error_message}, 400
+
+      # Proceed to process
+      await self._use_request_user(data.get('user_id', None))
+      chat_message = data['chat_message']
+      sender_id = data['sender_id']
+      response = await self._agent_component.action_reply_chat(chat_message, sender_id)
+      return {"response": response}, 200
+    except Exception as error:
+      return {"error": str(error)}, 400
+
+
+  async def respond_schedule_post(self, data: dict) -> Tuple[dict, int]:
+    """
+    Respond to schedule post input from dashboard, will be scheduled
+    Field format :
+    {
+      image_url: str,
+      caption_message: str,
+      user_id: str (optional)
+    }
+    """
+    try:
+      is_valid, error_message = self._check_data_validity(data, ["image_url", "caption_message"])
+      if (not is_valid):
+        return {"error": error_message}, 400
+
+      # Proceed to process
+      await self._use_request_user(data.get('user_id', None))
+      img_url = data['image_url']
+      caption_message= data['caption_message']
+      # Process and schedule the post
+      schedule_time, reason = await self._agent_component.action_schedule_post(img_url, caption_message)
+      # Handle if none
+      if (schedule_time is None or reason is None):
+        raise Exception("None scheduled time")
+
+      return {"scheduled_time": schedule_time, "reason": reason}, 200
+    except Exception as error:
+      return {"error": str(error)}, 400
+
+
+  async def respond_generate_caption(self, data: dict) -> Tuple[dict, int]:
+    """
+    Respond to post input from dashboard, returning the caption for the post
+    Field format :
+    {
+      image_description: str,
+      caption_keywords : list[str],
+      additional_context: str (optional),
+      user_id: str (optional)
+    }
+    """
+    try:
+      is_valid, error_message = self._check_data_validity(data, ["image_description", "caption_keywords"])
+      if (not is_valid):
+        return {"error": error_message}, 400
+
+      # Proceed to process
+      await self._use_request_user(data.get('user_id', None))
+      img_description = data['image_description']
+      caption_keywords = data['caption_keywords']
+      additional_context = data.get('additional_context', None)
+      # Process and schedule the action post
+      caption_message = await self._agent_component.action_generate_caption(img_description, caption_keywords, additional_context)
+
+      return {"response": caption_message}, 200
+    except Exception as error:
+      return {"error": str(error)}, 400
+
+
+  def run(self, mode: str = os.getenv("LLM_SERVER_MODE", "flask")) -> None:
+    """
+    Run the system in specific ip and port
+    mode "flask" runs the Flask server, where every async request runs on its own event loop.
+    mode "asgi" runs the ASGI app on uvicorn, where all requests share one long-lived event loop
     """
-      
-    #####################
-    ######## GET ########
-    #####################
-
-    @self.app.route('/status', methods=['GET'])
-    def get_status():
-      """
-      Get current status of the bot
-      """
-      try:
-        user = self._agent_component.get_user()
-        config = self._agent_component.get_config()
-        persona = self._agent_component.get_persona()
-        memory = self._agent_component.get_memory()
-        observation_elm = self._agent_component.get_observation_elm()
-
-        return jsonify({"response": { 
-                          "user" : user,
-                          "config": config,
-                          "persona": persona,
-                          "memory": memory,
-                          "observation": observation_elm,
-                        }}), 200
-      except Exception as error: 
-        return jsonify({"error": str(error)}), 400
-      
-    ######################
-    ######## POST ########
-    ######################
-
-    ######## SETUP & OTHER ########
-
-    @self.app.route("/user", methods=['POST'])
-    async def set_user():
-      """
-      Set user_id to the agent
-      Field format : 
-      {
-        user_id : str
-      }
-      """
-      try:
-        data = request.get_json()
-        is_valid, error_message = self._check_data_validity(data, ['user_id'])
-        if (not is_valid):
-          return jsonify({"error": error_message}), 400
-        
-        # Proceed to process
-        user_id = data['user_id']
-        await self._agent_component.set_user(user_id)
-        return jsonify({"response": True}), 200
-      except Exception as error: 
-        return jsonify({"error": str(error)}), 400
-
-    @self.app.route("/persona", methods=['POST'])
-    def set_persona():
-      """
-      Respond to change persona input from dashboard
-      """
-      try:
-        self._agent_component.set_persona()
-        return jsonify({"response": True}), 200
-      except Exception as error: 
-        return jsonify({"error": str(error)}), 400
-
-    @self.app.route("/config", methods=['POST'])
-    def set_config():
-      """
-      Respond to change model configuration input from dashboard
-      """
-      try:
-        self._agent_component.set_config()
-        return jsonify({"response": True}), 200
-      except Exception as error: 
-        return jsonify({"error": str(error)}), 400
-      
-
-    ######## SCHEDULED FOR CRON ########
-
-    @self.app.route("/action", methods=['POST'])
-    async def respond_action():
-      """
-      Respond to external scheduler to start doing action
-      """
-      try:
-        await self._agent_component.decide_action()
-        return jsonify({"response": True}), 200
-      except Exception as error: 
-        return jsonify({"error": str(error)}), 400
-
-    @self.app.route("/check_schedule", methods=['POST'])
-    async def respond_check_schedule():
-      """
-      Respond to external scheduler to check schedule for scheduled_post
-      """
-      try:
-        await self._agent_component.check_schedule()
-        return jsonify({"response": True}), 200
-      except Exception as error: 
-        return jsonify({"error": str(error)}), 400
-
-    ######## ACTIONS INPUT ########
-
-    @self.app.route("/chat", methods=['POST'])
-    async def respond_chat():
-      """
-      Respond to input chat from user, returning the reply to the inputted message
-      Field format : 
-      {
-        chat_message : str,
-        sender_id: str
-      }
-      """
-      try:
-        data = request.get_json()
-        is_valid, error_message = self._check_data_validity(data, ['chat_message', 'sender_id'])
-        if (not is_valid):
-          return jsonify({"error": error_message}), 400
-
-        # Proceed to process
-        chat_message = data['chat_message']
-        sender_id = data['sender_id']
-        response = await self._agent_component.action_reply_chat(chat_message, sender_id)
-        return jsonify({"response": response}), 200
-      except Exception as error: 
-        return jsonify({"error": str(error)}), 400
-      
-    @self.app.route("/post", methods=['POST'])
-    async def respond_schedule_post():
-      """
-      Respond to schedule post input from dashboard, will be scheduled
-      Field format : 
-      {
-        image_url: str, 
-        caption_message: str, 
-      }
-      """
-      try:
-        data = request.get_json()
-        is_valid, error_message = self._check_data_validity(data, ["image_url", "caption_message"])
-        if (not is_valid):
-          return jsonify({"error": error_message}), 400
-        
-        # Proceed to process
-        img_url = data['image_url']
-        caption_message= data['caption_message']
-        # Process and schedule the post
-        schedule_time, reason = await self._agent_component.action_schedule_post(img_url, caption_message)
-        # Handle if none
-        if (schedule_time is None or reason is None):
-          raise Exception("None scheduled time")
-
-        return jsonify({"scheduled_time": schedule_time, "reason": reason}), 200
-      except Exception as error: 
-        return jsonify({"error": str(error)}), 400
-
-    @self.app.route("/caption", methods=['POST'])
-    async def respond_generate_caption():
-      """
-      Respond to post input from dashboard, returning the caption for the post
-      Field format : 
-      {
-        image_description: str, 
-        caption_keywords : list[str],
-        additional_context: str (optional)
-      }
-      """
-      try:
-        data = request.get_json()
-        is_valid, error_message = self._check_data_validity(data, ["image_description", "caption_keywords"])
-        if (not is_valid):
-          return jsonify({"error": error_message}), 400
-        
-        # Proceed to process
-        img_description = data['image_description']
-        caption_keywords = data['caption_keywords']
-        additional_context = data.get('additional_context', None)
-        # Process and schedule the action post
-        caption_message = await self._agent_component.action_generate_caption(img_description, caption_keywords, additional_context)
-
-        return jsonify({"response": caption_message}), 200
-      except Exception as error: 
-        return jsonify({"error": str(error)}), 400
-    
-
-  def run(self) -> None:
-    """
-    Run the system in specific ip and port 
-    """
-    self.app.run(host=self.host, port=self.port)
-
-  
\ No newline at end of file
+    if (mode == "asgi"):
+      uvicorn.run(self.asgi_app, host=self.host, port=int(self.port))
+    else:
+      self.app.run(host=self.host, port=self.port)
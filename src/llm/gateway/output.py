@@ -1,5 +1,11 @@
-import requests
+import asyncio
+import bisect
+import httpx
 import os
+import random
+import threading
+import time
+import weakref
 from typing import Optional
 from dotenv import load_dotenv
 load_dotenv()
@@ -8,6 +14,22 @@ class OutputGateway():
   """
   Output gateway to other module
   """
+
+  # Timeout (in seconds) of a call, and per-path overrides for slower endpoints
+  _timeout: float = 30.0
+  _path_timeouts: dict = {
+    "/api/post/": 120.0,
+  }
+  # Retries of a call after 5xx/429 response or connection failure, with exponential backoff and jitter
+  _max_retries: int = 3
+  _backoff_base: float = 0.5
+  _backoff_max: float = 8.0
+  _retry_status_codes: list[int] = [429, 500, 502, 503, 504]
+  # Max concurrent calls to each path
+  _max_concurrency: int = 4
+  # Upper bounds (in seconds) of the latency histogram buckets, the last bucket is unbounded
+  _latency_buckets: list[float] = [0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+
   def __init__(self, agent: object):
     """
     Instantiate output gateway to call the API of other module
@@ -17,22 +39,118 @@ class OutputGateway():
     self.headers = {
       'Content-Type' : 'application/json'
     }
+    # Keep-alive client and semaphores are bound to an event loop, so they are held per event loop
+    # and dropped together with their event loop
+    self._clients = weakref.WeakKeyDictionary()
+    self._semaphores = weakref.WeakKeyDictionary()
+    # Latency histogram per path
+    self._latencies: dict = {}
+    self._lock = threading.Lock()
 
+  ######## PRIVATE ########
 
-  def request_follow(self, username: str) -> bool:
+  def _get_client(self) -> httpx.AsyncClient:
+    """
+    Return the keep-alive client of the running event loop
+    """
+    loop = asyncio.get_running_loop()
+    client = self._clients.get(loop, None)
+    if (client is None):
+      client = httpx.AsyncClient(base_url=self.base_url or "", headers=self.headers)
+      self._clients[loop] = client
+    return client
+
+
+  def _get_semaphore(self, path: str) -> asyncio.Semaphore:
+    """
+    Return the semaphore limiting concurrent calls to the path in the running event loop
+    """
+    loop = asyncio.get_running_loop()
+    semaphores = self._semaphores.setdefault(loop, {})
+    if (path not in semaphores):
+      semaphores[path] = asyncio.Semaphore(self._max_concurrency)
+    return semaphores[path]
+
+
+  def _get_backoff(self, attempt: int, response: Optional[httpx.Response]) -> float:
+    """
+    Return the delay before the next attempt: Retry-After if it is given, otherwise exponential backoff with full jitter
+    """
+    if (response is not None and response.headers.get("Retry-After", "").isdigit()):
+      return min(float(response.headers["Retry-After"]), self._backoff_max)
+    return random.uniform(0, min(self._backoff_max, self._backoff_base * (2 ** attempt)))
+
+
+  def _record_latency(self, path: str, latency: float) -> None:
+    """
+    Record the latency of a call to the histogram of the path
+    """
+    with self._lock:
+      if (path not in self._latencies):
+        self._latencies[path] = {"count": 0, "total": 0.0, "buckets": [0] * (len(self._latency_buckets) + 1)}
+      histogram = self._latencies[path]
+      histogram["count"] += 1
+      histogram["total"] += latency
+      histogram["buckets"][bisect.bisect_left(self._latency_buckets, latency)] += 1
+
+
+  async def _request(self, method: str, path: str, data: dict) -> httpx.Response:
+    """
+    Send request to the path, retrying on 5xx/429 response and connection failure.
+    Only failures to connect are retried, since the request may have been processed on other failures (e.g. read timeout)
+    """
+    timeout = self._path_timeouts.get(path, self._timeout)
+    async with self._get_semaphore(path):
+      attempt = 0
+      while (True):
+        response = None
+        start_time = time.perf_counter()
+        try:
+          response = await self._get_client().request(method, path, json=data, timeout=timeout)
+          if (response.status_code not in self._retry_status_codes or attempt >= self._max_retries):
+            return response
+          print(f"[RETRY REQUEST] {method} {path} responded with status code {response.status_code}")
+        except httpx.ConnectError as e:
+          if (attempt >= self._max_retries):
+            raise e
+          print(f"[RETRY REQUEST] {method} {path} failed to connect: {e}")
+        finally:
+          self._record_latency(path, time.perf_counter() - start_time)
+
+        await asyncio.sleep(self._get_backoff(attempt, response))
+        attempt += 1
+
+  ######## PUBLIC ########
+
+  def get_stats(self) -> dict:
+    """
+    Return the latency histogram of each path
+    """
+    with self._lock:
+      bucket_labels = [f"<={bound}" for bound in self._latency_buckets] + [f">{self._latency_buckets[-1]}"]
+      return {
+        path: {
+          "count": histogram["count"],
+          "average_latency": round(histogram["total"] / histogram["count"], 4),
+          "buckets": dict(zip(bucket_labels, histogram["buckets"])),
+        }
+        for path, histogram in self._latencies.items()
+      }
+
+
+  async def request_follow(self, username: str) -> bool:
     """
     Hit follow api in automation module
     """
     try:
       path = "/api/follow/"
-      url = f"{self.base_url}{path}"
       data = {
           "target_username": username,
           "user_id": self._agent_component.user_id
       }
 
       # Check response
-      response = requests.post(url, json=data)
+      response = await self._request("POST", path, data)
       if (response.status_code == 200):
         return True
       else:
@@ -43,22 +161,21 @@ class OutputGateway():
     except Exception as e:
       print(f"[ERROR REQUEST FOLLOW] Error occured in requesting action `follow` to {username}: {e}")
       return False
-  
-  
-  def request_like(self, post_id: str) -> bool:
+
+
+  async def request_like(self, post_id: str) -> bool:
     """
     Hit like api in automation module
     """
     try:
       path = "/api/like/"
-      url = f"{self.base_url}{path}"
       data = {
           "media_id": post_id,
           "user_id": self._agent_component.user_id
       }
 
       # Check response
-      response = requests.post(url, json=data)
+      response = await self._request("POST", path, data)
       if (response.status_code == 200):
         return True
       else:
@@ -69,15 +186,14 @@ class OutputGateway():
     except Exception as e:
       print(f"[ERROR REQUEST LIKE] Error occured in requesting action `like` to {post_id}: {e}")
       return False
-  
 
-  def request_comment(self, post_id: str, comment_message:str) -> bool:
+
+  async def request_comment(self, post_id: str, comment_message:str) -> bool:
     """
     Hit comment api in automation module
     """
     try:
       path = "/api/comment/"
-      url = f"{self.base_url}{path}"
       data = {
           "media_id": post_id,
           "comment": comment_message,
@@ -85,7 +201,7 @@ class OutputGateway():
       }
 
       # Check response
-      response = requests.post(url, json=data)
+      response = await self._request("POST", path, data)
       if (response.status_code == 200):
         return True
       else:
@@ -96,15 +212,14 @@ class OutputGateway():
     except Exception as e:
       print(f"[ERROR REQUEST COMMENT] Error occured in requesting action `comment` to {post_id}: {e}")
       return False
-  
 
-  def request_post(self, img_url: str, caption_message:str, user_id: int, tourism_object_id: int) -> bool:
+
+  async def request_post(self, img_url: str, caption_message:str, user_id: int, tourism_object_id: int) -> bool:
     """
     Hit comment api in automation module
     """
     try:
       path = "/api/post/"
-      url = f"{self.base_url}{path}"
       data = {
           "image_path": img_url,
           "caption": caption_message,
@@ -113,7 +228,7 @@ class OutputGateway():
       }
 
       # Check response
-      response = requests.post(url, json=data)
+      response = await self._request("POST", path, data)
       if (response.status_code == 200):
         return True
       else:
@@ -123,21 +238,20 @@ class OutputGateway():
     except Exception as e:
       print(f"[ERROR REQUEST POST] Error occured in requesting action `post`: {e}")
       return False
-    
 
-  def request_statistics(self, user_id: int) -> Optional[tuple]:
+
+  async def request_statistics(self, user_id: int) -> Optional[tuple]:
     """
     Hit statistics api in automation module
     """
     try:
       path = "/api/stats/"
-      url = f"{self.base_url}{path}"
       data = {
           "user_id": user_id,
       }
 
       # Check response
-      response = requests.get(url, json=data)
+      response = await self._request("GET", path, data)
       if (response.status_code == 200):
         response_data = response.json()['data']
         print(f"[STATISTICS DATA] {response_data}")
@@ -150,4 +264,4 @@ class OutputGateway():
 
     except Exception as e:
       print(f"[ERROR REQUEST STATISTICS] Error occured in requesting action `statistics`: {e}")
-      return None
\ No newline at end of file
+      return None
@@ -1,6 +1,5 @@
 import numpy as np
 import random
-from hmmlearn.hmm import CategoricalHMM
 from utils.constant import HMM_HIDDEN_STATES, HMM_OBSERVATION_LIST
 from datetime import datetime, timezone, timedelta
 from typing import Tuple
@@ -12,14 +11,49 @@ class ActionGenerator:
     Possible actions: 'like', 'follow', 'comment', 'none'
     """
 
+    # Starting probability of each hidden state
+    START_PROB = np.array([0.40, 0.40, 0.2])
+    # Emission probability of each observation symbol for each hidden state
+    EMISSION_PROB = np.array([
+        # new_com, new_fol, liked, morning, afternoon, night
+        [0.20,    0.30,    0.20,    0.12,    0.10,    0.08],   # growth
+        [0.30,    0.20,    0.20,    0.08,    0.12,    0.10],   # engagement
+        [0.20,    0.20,    0.30,    0.10,    0.10,    0.10],   # idle
+    ])
+    # Action policy of each hidden state
+    STATE_ACTION_MAP = {
+        'growth': ['follow',  'like'],
+        'engagement': ['comment', 'like'],
+        'idle': ['like', None]
+    }
+
+    # Max observations of each engagement type, see `_compress_count`
+    MAX_OBSERVATION_COUNT = 8
+
     def __init__(self):
         """
         Instantiate action generator.
+        Log probability tables are precomputed, so decoding only does additions and argmax
         """
         self.hidden_states = HMM_HIDDEN_STATES
         self.observation_symbols = HMM_OBSERVATION_LIST
+        self._obs_to_idx = {obs: idx for idx, obs in enumerate(self.observation_symbols)}
+        with np.errstate(divide="ignore"):
+          self._log_startprob = np.log(self.START_PROB)
+          # Transposed, so the emission of an observation for all states is a contiguous row
+          self._log_emissionprob = np.log(self.EMISSION_PROB).T.copy()
 
     
+    def _compress_count(self, count: int) -> int:
+        """
+        Compress the count of an engagement type into the number of its observations, by log-bucketing.
+        1 -> 1, 2-3 -> 2, 4-7 -> 3, ..., capped at MAX_OBSERVATION_COUNT (128 and more).
+        So the observation sequence, and the decoding time, is bounded no matter how large the counts are,
+        while a larger count still weighs more
+        """
+        return min(self.MAX_OBSERVATION_COUNT, count.bit_length())
+
+
     def observe_statistics(self, statistics: dict) -> list:
         """
         Function to observe statistics.
@@ -28,13 +62,13 @@ class ActionGenerator:
         """
         
         observations = []
-        # Engagement based
+        # Engagement based, each count is compressed (see `_compress_count`)
         if (statistics[0] and isinstance(statistics[0], int)):
-          observations.extend(["new_comment" for _ in range(statistics[0])])
+          observations.extend(["new_comment" for _ in range(self._compress_count(statistics[0]))])
         if (statistics[1] and isinstance(statistics[1], int)):
-          observations.extend(["new_follower" for _ in range(statistics[1])])
+          observations.extend(["new_follower" for _ in range(self._compress_count(statistics[1]))])
         if (statistics[2] and isinstance(statistics[2], int)):
-          observations.extend(["post_liked" for _ in range(statistics[2])])
+          observations.extend(["post_liked" for _ in range(self._compress_count(statistics[2]))])
 
         # Shuffle the observation
         random.shuffle(observations)
@@ -52,6 +86,120 @@ class ActionGenerator:
         return observations
 
 
+    def _transition_matrix(self, iteration: int) -> np.ndarray:
+        """
+        Return transition matrix of the iteration.
+        The more iteration, the more likely to be in idle state
+        """
+        # Increase idle probability with iterations
+        idle_addition_prob = (0.1 * iteration)
+        return np.array([
+            [(0.9 - idle_addition_prob) * 5/9 , (0.9 - idle_addition_prob) * 4/9  , 0.1 + idle_addition_prob],  # growth
+            [(0.9 - idle_addition_prob) * 3/9 , (0.9 - idle_addition_prob) * 6/9  , 0.1 + idle_addition_prob],  # engagement
+            [(1.0 - idle_addition_prob) / 2   , (1.0 - idle_addition_prob) / 2    , 0.0 + idle_addition_prob]   # idle
+        ])
+
+
+    def _max_plus_product(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        """
+        Max-plus matrix product over the first two axes, result[i, j, ...] = max_k a[i, k, ...] + b[k, j, ...].
+        It is associative like the ordinary product, so chains of it can be computed by a prefix scan.
+        The state axes come first, so each operation runs over the long batch and time axes
+        """
+        result = a[:, 0, None] + b[None, 0]
+        candidate = np.empty_like(result)
+        for k in range(1, a.shape[1]):
+          np.add(a[:, k, None], b[None, k], out=candidate)
+          np.maximum(result, candidate, out=result)
+        return result
+
+
+    def _prefix_scan(self, x: np.ndarray, combine) -> np.ndarray:
+        """
+        Inclusive prefix scan of x along its last axis with the associative combine(earlier, later).
+        Adjacent pairs are combined, the half as long sequence of pairs is scanned, then the even positions are filled in,
+        so it takes 2 * log2(n) vectorized steps and O(n) work
+        """
+        n = x.shape[-1]
+        if (n == 1):
+          return x
+        pair_prefixes = self._prefix_scan(combine(x[..., :n - 1:2], x[..., 1::2]), combine)
+        result = np.empty_like(x)
+        result[..., 0] = x[..., 0]
+        result[..., 1::2] = pair_prefixes
+        result[..., 2::2] = combine(pair_prefixes[..., :(n - 1) // 2], x[..., 2::2])
+        return result
+
+
+    def viterbi(self, obs_idx: np.ndarray, transition_matrices: np.ndarray) -> np.ndarray:
+        """
+        Decode the most likely hidden state sequence of the observations for a batch of transition matrices.
+        obs_idx has shape (n_observations,) and transition_matrices has shape (n_batch, n_states, n_states).
+        Returns the state sequences with shape (n_batch, n_observations)
+
+        Both recursions are associative, so instead of one Python step per observation they are prefix scans (see `_prefix_scan`):
+        - forward, the max-plus product of the step matrices (transition, then emission of the next observation)
+        - backtrack, the composition of the backpointer maps (state at t -> best state at t - 1), from the last observation
+        The log probabilities are summed in another order than the sequential recursion, so exactly tied paths may be broken differently
+        """
+        n_batch, n_states, _ = transition_matrices.shape
+        n_observations = len(obs_idx)
+        with np.errstate(divide="ignore"):
+          # Shape (n_states, n_states, n_batch, 1)
+          log_transmat = np.log(transition_matrices).transpose(1, 2, 0)[..., None]
+        # Shape (n_states, n_observations)
+        log_emission = self._log_emissionprob[obs_idx].T
+
+        # log_delta[j, b, t] is the log probability of the best path of the first t + 1 observations ending in state j
+        log_delta = np.empty((n_states, n_batch, n_observations))
+        log_delta[:, :, 0] = (self._log_startprob + log_emission[:, 0])[:, None]
+        if (n_observations > 1):
+          steps = self._prefix_scan(log_transmat + log_emission[None, :, None, 1:], self._max_plus_product)
+          log_delta[..., 1:] = self._max_plus_product(log_delta[None, :, :, :1], steps)[0]
+
+        state_sequences = np.empty((n_batch, n_observations), dtype=np.intp)
+        last_states = log_delta[..., -1].argmax(axis=0)
+        state_sequences[:, -1] = last_states
+        if (n_observations > 1):
+          # backpointers[j, b, t - 1] is the best state at t - 1 of the path in state j at t
+          backpointers = (log_delta[:, None, :, :-1] + log_transmat).argmax(axis=0)
+          # Maps from the last state to the state at t, scanned from the last observation
+          compose = lambda earlier, later: np.take_along_axis(later, earlier, axis=0)
+          last_to_state = self._prefix_scan(backpointers[..., ::-1], compose)[..., ::-1]
+          state_sequences[:, :-1] = np.take_along_axis(last_to_state, np.broadcast_to(last_states[None, :, None], (1,) + last_to_state.shape[1:]), axis=0)[0]
+        return state_sequences
+
+
+    def decide_actions(self, observations: list, n_iterations: int) -> Tuple[list, list]:
+        """
+        Function to decide actions for n_iterations at once.
+        The state sequences of all iterations are decoded in one batched pass.
+        Returns the list of actions and the list of states, which stop at the first None action
+        """
+        try:
+          obs_idx = np.array([self._obs_to_idx[o] for o in observations])
+          transition_matrices = np.stack([self._transition_matrix(iteration) for iteration in range(n_iterations)])
+          state_sequences = self.viterbi(obs_idx, transition_matrices)
+
+          actions = []
+          states = []
+          for iteration in range(n_iterations):
+            state_sequence_str = [self.hidden_states[state] for state in state_sequences[iteration]]
+            print(f"[STATE SEQUENCE {iteration+1}] {state_sequence_str}")
+            current_state = self.hidden_states[state_sequences[iteration, -1]]
+
+            chosen_action = random.choice(self.STATE_ACTION_MAP[current_state])
+            actions.append(chosen_action)
+            states.append(current_state)
+            if (chosen_action is None):
+              break
+          return actions, states
+
+        except Exception as e:
+            print(f"Error in action generation: {e}")
+            return [None], [None]
+
+
     def decide_action(self, observations: list, iteration: int) -> Tuple[str, str]:
         """
         Function to decide action.
@@ -60,50 +208,15 @@ class ActionGenerator:
         The more iteration, the more likely to be in idle state
         """
         try:
-          # Map observations to integers
-          obs_to_idx = {obs: idx for idx, obs in enumerate(self.observation_symbols)}
-          obs_idx = [obs_to_idx[o] for o in observations]
-          obs_sequence = np.array(obs_idx).reshape(-1, 1)
-
-          # Build and train the HMM
-          model = CategoricalHMM(n_components=len(self.hidden_states), n_iter=100, random_state=42)
-          # Define starting probability
-          model.startprob_ = np.array([0.40, 0.40, 0.2])
-
-          # Increase idle probability with iterations
-          idle_addition_prob = (0.1 * iteration)  
-
-          # Define transition matrix
-          model.transmat_ = np.array([
-              [(0.9 - idle_addition_prob) * 5/9 , (0.9 - idle_addition_prob) * 4/9  , 0.1 + idle_addition_prob],  # growth
-              [(0.9 - idle_addition_prob) * 3/9 , (0.9 - idle_addition_prob) * 6/9  , 0.1 + idle_addition_prob],  # engagement
-              [(1.0 - idle_addition_prob) / 2   , (1.0 - idle_addition_prob) / 2    , 0.0 + idle_addition_prob]   # idle
-          ])
-          # Define emission probability
-          model.emissionprob_ = np.array([
-                # new_com, new_fol, liked, morning, afternoon, night
-                [0.20,    0.30,    0.20,    0.12,    0.10,    0.08],   # growth
-                [0.30,    0.20,    0.20,    0.08,    0.12,    0.10],   # engagement
-                [0.20,    0.20,    0.30,    0.10,    0.10,    0.10],    # idle
-            ])
-
-
-          # Predict hidden states from observation sequence
-          state_sequence = model.predict(obs_sequence)
+          obs_idx = np.array([self._obs_to_idx[o] for o in observations])
+          state_sequence = self.viterbi(obs_idx, self._transition_matrix(iteration)[None])[0]
           state_sequence_str = [self.hidden_states[state] for state in state_sequence]
           print(f"[STATE SEQUENCE {iteration+1}] {state_sequence_str}")
           current_state = self.hidden_states[state_sequence[-1]]
 
-          # Define simplified action policies
-          state_action_map = {
-              'growth': ['follow',  'like'],
-              'engagement': ['comment', 'like'],
-              'idle': ['like', None] 
-          }
-          possible_actions = state_action_map[current_state]
-          chosen_action = random.choice(possible_actions)
+          chosen_action = random.choice(self.STATE_ACTION_MAP[current_state])
           return chosen_action, current_state
-        
+
         except Exception as e:
             print(f"Error in action generation: {e}")
-            return None, None
\ No newline at end of file
+            return None, None
@@ -69,6 +69,9 @@ class PromptGenerator():
         for notes in previous_iteration_notes:
           previous_iteration_notes_subprompt += "{\n"
           for key, value in notes.items():
+            # Timing of the evaluation is not useful for the model
+            if (key == "evaluation_time"):
+              continue
             previous_iteration_notes_subprompt += f"{key}: {value}\n"
           previous_iteration_notes_subprompt += "}\n"
         previous_iteration_notes_subprompt += "If the only \"_passing\" field with False value is \"naturalness_passing\", you *should focus* on paraphrasing your previous answer to sound more natural, fluent, and human-like. \n" 
@@ -252,10 +255,11 @@ class PromptGenerator():
                               query_str=new_message)
 
 
-  def generate_prompt_reply_chat(self, new_message: str, previous_messages: list[dict] = [], previous_iteration_notes: list[dict] = []) -> str:
+  def generate_prompt_reply_chat(self, new_message: str, previous_messages: list[dict] = [], previous_iteration_notes: list[dict] = [], is_routed: bool = False) -> str:
     """
     Generate a prompt for replying chat
     See the Class Memory for the template of the previous messages
+    is_routed is True if the tools are already selected for the province and the type of place of the message
     """
     context = "You have to be informative and clear in giving information to users. You also have to assure the correctness of the facts that you provide.\n"
 
@@ -273,7 +277,10 @@ class PromptGenerator():
     context += "You should and have to use the tools in answering the question using RAG method. The usage of the tools is critical on this aspect. "
     context += "The tools can be used to inquire information related to tourism. Furthermore, you might also be provided with tools to see the summarization of your previous messages. "
     context += "You need and have to utilize all the tools that are provided. In doing action, please do iteration to all the tools you think is related to the query. "
-    context += "Do not use only one tools. Whenever you are unsure whether it is Nusa Tenggara Timur or Nusa Tenggara Barat, you should check both tools for Nusa Tenggara Timur and Nusa Tenggara Barat to answer the questions. "
+    if (is_routed):
+      context += "The tourism tools are already selected for the province and the type of place asked in the message. "
+    else:
+      context += "Do not use only one tools. Whenever you are unsure whether it is Nusa Tenggara Timur or Nusa Tenggara Barat, you should check both tools for Nusa Tenggara Timur and Nusa Tenggara Barat to answer the questions. "
     context += "You should also try to use the tools to check previous memory to get better context. "
 
     # Setup subprompts
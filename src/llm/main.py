@@ -3,5 +3,6 @@ import asyncio
 
 nusava = Agent()
 app = nusava.input_gateway_component.app
+asgi_app = nusava.input_gateway_component.asgi_app   # To run on ASGI server, e.g. uvicorn main:asgi_app
 if __name__ == "__main__":
-  asyncio.run(nusava.run())   # To run on Flask
+  asyncio.run(nusava.run())   # To run on Flask (or ASGI if LLM_SERVER_MODE=asgi)
@@ -0,0 +1,49 @@
+from connector.mongo import MongoConnector
+import argparse
+
+def migrate(mongo_connector: MongoConnector, unset_marks: bool = False) -> None:
+  """
+  Migrate the mark_like, mark_comment, and mark_follow arrays embedded in communities documents to the engagements collection.
+  If unset_marks is True, the embedded arrays are removed after the migration
+  """
+  mark_fields = [("posts", "mark_like", "like"), ("posts", "mark_comment", "comment"), ("influencers", "mark_follow", "follow")]
+  projection = {"community_id": 1, "posts.id": 1, "posts.mark_like": 1, "posts.mark_comment": 1, "influencers.id": 1, "influencers.mark_follow": 1}
+  communities = mongo_connector.database["communities"].find({}, projection)
+
+  total_marked = 0
+  for community in communities:
+    community_id = community['community_id']
+    engagements = []
+    for array_field, mark_field, action in mark_fields:
+      for target in community.get(array_field, []):
+        for user_id in target.get(mark_field, None) or []:
+          engagements.append({"user_id": str(user_id), "action": action, "target_id": target['id'], "community_id": community_id})
+
+    marked_count = mongo_connector.mark_engagements(engagements)
+    total_marked += marked_count
+    print(f"[MIGRATE ENGAGEMENTS] Community {community_id}: {marked_count} new engagements out of {len(engagements)} marks")
+
+    if (unset_marks):
+      for array_field, mark_field, _ in mark_fields:
+        mongo_connector.database["communities"].update_one(
+          {"community_id": community_id, array_field: {"$type": "array"}},
+          {"$unset": {f"{array_field}.$[].{mark_field}": ""}}
+        )
+
+  print(f"[MIGRATE ENGAGEMENTS] Migration is done with {total_marked} new engagements")
+
+
+
+if __name__ == "__main__":
+  """
+  This function is run manually.
+  It is used to migrate the engagement marks in communities to the engagements collection.
+  This function will not be run on server's runtime.
+  Run with --unset-marks to also remove the embedded arrays, once the engagements collection is in use.
+  """
+  parser = argparse.ArgumentParser(description="Migrate the engagement marks in communities to the engagements collection")
+  parser.add_argument("--unset-marks", action="store_true", help="Remove the mark arrays from the communities after the migration")
+  args = parser.parse_args()
+
+  mongo_connector = MongoConnector()
+  migrate(mongo_connector, unset_marks=args.unset_marks)
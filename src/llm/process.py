@@ -8,10 +8,10 @@ async def process(nusava: Agent) -> None:
   await nusava.set_user(user_id)
 
   # Run process data
-  nusava.process_data_hotel()
-  nusava.process_data_post()
-  nusava.process_data_association_rule()
-  nusava.process_data_tourist_attraction()
+  await nusava.process_data_hotel()
+  await nusava.process_data_post()
+  await nusava.process_data_association_rule()
+  await nusava.process_data_tourist_attraction()
   await nusava.process_labelling_communities()
 
 
@@ -19,7 +19,8 @@ async def process(nusava: Agent) -> None:
 if __name__ == "__main__":
   """
   This function is run manually. 
-  It is used to migrate the data from MongoDB to Pinecone.
+  It is used to sync the data from MongoDB to Pinecone.
+  Only new or changed data is embedded, and data removed from MongoDB is deleted from Pinecone.
   This function will not be run on server's runtime.
   """
   nusava = Agent()
@@ -0,0 +1,68 @@
+import unittest
+from agent.context import ContextCompressor
+from llama_index.core.schema import NodeWithScore, TextNode
+from utils.function import association_rule_data_to_string, post_data_to_string_list
+
+
+def to_nodes(texts: list[str]) -> list[NodeWithScore]:
+  return [NodeWithScore(node=TextNode(id_=str(i), text=text), score=1.0) for i, text in enumerate(texts)]
+
+
+class TestContextCompressor(unittest.TestCase):
+  """
+  Tests of the ContextCompressor node postprocessor
+  """
+
+  def setUp(self):
+    self.compressor = ContextCompressor(max_tokens=100000)
+
+
+  def test_distinct_association_rules_are_unchanged(self):
+    rules = [
+      {"antecedent": [{"place": "Tanto Hotel"}], "consequent": [{"place": "Siola Hotel"}]},
+      {"antecedent": [{"place": "Tanto Hotel"}], "consequent": [{"place": "Serene Beach Villa"}]},
+      {"antecedent": [{"place": "Siola Hotel"}], "consequent": [{"place": "Tanto Hotel"}]},
+      {"antecedent": [{"place": "La Boheme Bajo Hostel"}], "consequent": [{"place": "Sahid T-MORE Kupang"}]},
+      {"antecedent": [{"place": "Sahid T-MORE Kupang"}], "consequent": [{"place": "La Boheme Bajo Hostel"}]},
+      {"antecedent": [{"place": "Tanto Hotel"}, {"place": "Siola Hotel"}], "consequent": [{"place": "Serene Beach Villa"}]},
+      {"antecedent": [{"place": "Golo Hilltop Hotel"}], "consequent": [{"place": "Bintang Flores Hotel"}]},
+      {"antecedent": [{"place": "Bintang Flores Hotel"}], "consequent": [{"place": "Ayana Komodo Resort"}]},
+      {"antecedent": [{"place": "Ayana Komodo Resort"}], "consequent": [{"place": "Meruorah Komodo Hotel"}]},
+      {"antecedent": [{"place": "Villa Ombak Gili Trawangan"}], "consequent": [{"place": "Pearl of Trawangan"}]},
+    ]
+    nodes = to_nodes([association_rule_data_to_string(rule) for rule in rules])
+    self.assertEqual(self.compressor.postprocess_nodes(nodes), nodes)
+
+
+  def test_duplicate_association_rule_is_removed(self):
+    rule = association_rule_data_to_string({"antecedent": [{"place": "Tanto Hotel"}], "consequent": [{"place": "Siola Hotel"}]})
+    nodes = to_nodes([rule, rule])
+    self.assertEqual(self.compressor.postprocess_nodes(nodes), nodes[:1])
+
+
+  def test_posts_of_a_community_are_not_capped(self):
+    community = {"community_id": 7, "posts": [{"caption": caption, "posted_at": "2025-01-01"} for caption in [
+      "Sunset at Pink Beach, the sand really is pink!",
+      "Trekking up Padar Island before sunrise",
+      "Komodo dragons up close in Rinca",
+      "Snorkeling with manta rays near Taka Makassar",
+      "Local coffee tasting in Bajawa village",
+    ]]}
+    nodes = to_nodes(post_data_to_string_list(community))
+    self.assertEqual(self.compressor.postprocess_nodes(nodes), nodes)
+
+
+  def test_chunks_of_an_entity_are_capped(self):
+    reviews = [f"Tanto Hotel Review {i+1}:\nrating: {i}\ntext: {text}" for i, text in enumerate([
+      "Great view of the harbour and friendly staff",
+      "Breakfast was cold but the room was clean",
+      "Noisy at night because of the karaoke next door",
+      "Perfect location to start the Komodo boat trip",
+      "The pool is small, yet the rooftop bar is lovely",
+    ])]
+    nodes = to_nodes(reviews)
+    self.assertEqual(self.compressor.postprocess_nodes(nodes), nodes[:self.compressor.max_nodes_per_source])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -14,4 +14,10 @@ HMM_OBSERVATION_LIST = [
   "morning_time",
   "afternoon_time",
   "night_time",
-]
\ No newline at end of file
+]
+
+# Fixed preamble of every association rule document, followed by its antecedents and consequents
+ASSOCIATION_RULE_PREAMBLE = "Here is an insight of recommendation from data mining process.\n" \
+                            "The data is about association rule of hotels. " \
+                            "Therefore, this data can be used to link as a recommendation system for hotels.\n" \
+                            "The data consist of antecedents and consequents. If user ask or talk about hotels in antecedents, you can recommend the hotels in consequents.\n"
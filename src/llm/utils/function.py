@@ -2,6 +2,7 @@ from llama_index.core import Document
 from llama_index.core.node_parser import SimpleNodeParser
 from datetime import datetime, timedelta, timezone
 from typing import Optional, Tuple
+from utils.constant import ASSOCIATION_RULE_PREAMBLE
 
 
 def json_to_string_list(data, prefix: str, result_arr: list, max_limit_arr: int = 20):
@@ -91,7 +92,7 @@ def clean_quotation_string(text: str) -> str:
     return text
   
 
-def get_province_from_location(location:str) -> Optional[str]:
+def get_province_from_location(location:str, is_verbose: bool = True) -> Optional[str]:
   """
   Determine the province based on the location
   """
@@ -106,7 +107,8 @@ def get_province_from_location(location:str) -> Optional[str]:
     if (substr in location.upper()):
       return "ntb"
 
-  print(f"[LOCATION UNDETERMINED] {location}")
+  if (is_verbose):
+    print(f"[LOCATION UNDETERMINED] {location}")
   return None
 
 
@@ -241,6 +243,42 @@ def attraction_data_to_string_list(data: dict, max_limit_arr: int = 20) -> Tuple
   return data_list, province
 
 
+def post_data_to_string_list(community: dict) -> list[str]:
+  """
+  Convert posts of a community to list of string, one string for each post
+  """
+  community_id = community['community_id']
+  post_string_list = []
+  for post in community.get('posts', []):
+    post_data = f"""Community ID: {community_id}\n""" \
+                f"""Post Caption: \"{post['caption']}\"\n""" \
+                f"""Post Created Time: {post['posted_at']}\n"""\
+                f"""Comment Ammount: {len(post.get('comments', []))}\n"""
+    post_string_list.append(post_data)
+  return post_string_list
+
+
+def association_rule_data_to_string(asso_rule: dict) -> str:
+  """
+  Convert association rule data to string
+  """
+  antecedents = asso_rule['antecedent']
+  consequents = asso_rule['consequent']
+
+  antecedents_string = "Antecedents:\n"
+  for i, antecedent in enumerate(antecedents):
+    antecedents_string += f"{i+1}. {antecedent['place']}\n"
+
+  consequents_string = "Consequents:\n"
+  for i, consequent in enumerate(consequents):
+    consequents_string += f"{i+1}. {consequent['place']}\n"
+
+  asso_rule_string = ASSOCIATION_RULE_PREAMBLE
+  asso_rule_string += antecedents_string
+  asso_rule_string += consequents_string
+  return asso_rule_string
+
+
 def adjust_scheduled_time(scheduled_time_str: str) -> datetime:
     """
     Adjust the scheduled time so it does not return time earlier then current time.